@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+api_v1.py - JSON REST API hàng loạt (/api/v1) cho công cụ nhập dữ liệu từ nơi khác
+- Mỗi request là một batch: kiểm tra toàn bộ trước, rồi áp dụng trong một transaction
+  storage + một lần ghi (SQLite: một transaction, JSON / journal: một lần ghi + fsync)
+- Một item sai → cả batch bị từ chối, không thay đổi gì; errors chỉ rõ item nào (index)
+- Số item tối đa mỗi batch: app.config['API_BATCH_MAX'] (API_BATCH_MAX trong .env)
+
+POST /api/v1/subtasks          {"subtasks": [{"goal_id", "title", "note"?, "created_at"?, "created_time"?}]}
+POST /api/v1/subtasks/delete   {"ids": [subtask_id, ...]}
+PATCH /api/v1/goals            {"goals": [{"id", "status"?, "title"?, "description"?, "target_date"?, "progress"?}]}
+POST /api/v1/goals/delete      {"ids": [goal_id, ...]}   (xóa cả hoạt động của goal)
+"""
+
+import logging
+from datetime import datetime
+from flask import Blueprint, current_app, jsonify, request
+from storage import BatchError, get_storage
+
+logger = logging.getLogger(__name__)
+
+api = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+GOAL_STATUSES = ('active', 'paused', 'completed')
+
+
+class _Invalid(Exception):
+    """Body không hợp lệ: trả về status kèm message / errors"""
+
+    def __init__(self, message, errors=None, status=400):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+        self.status = status
+
+
+def _items(key):
+    """Danh sách item trong body JSON ({key: [...]}) - kiểm tra kiểu và giới hạn kích thước batch"""
+    body = request.get_json(silent=True)
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise _Invalid(f"Body phải là JSON dạng {{\"{key}\": [...]}} với ít nhất một phần tử")
+    limit = current_app.config.get('API_BATCH_MAX', 5000)
+    if len(items) > limit:
+        raise _Invalid(f"Tối đa {limit} phần tử mỗi batch (nhận {len(items)})", status=413)
+    return items
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def _is_format(value, fmt):
+    try:
+        datetime.strptime(value, fmt)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _check(items, validate, objects=True):
+    """validate(item) → (giá trị, lỗi); gom lỗi của mọi item rồi mới từ chối"""
+    values, errors = [], []
+    for i, item in enumerate(items):
+        if objects and not isinstance(item, dict):
+            errors.append({'index': i, 'message': 'Phần tử phải là object'})
+            continue
+        value, error = validate(item)
+        if error:
+            errors.append({'index': i, 'message': error})
+        values.append(value)
+    if errors:
+        raise _Invalid(f"{len(errors)} phần tử không hợp lệ", errors)
+    return values
+
+
+def _new_subtask(item, now):
+    goal_id, title = item.get('goal_id'), item.get('title')
+    if not _is_id(goal_id):
+        return None, 'goal_id phải là số nguyên dương'
+    if not isinstance(title, str) or not title.strip():
+        return None, 'Thiếu title'
+    note = item.get('note', '')
+    if not isinstance(note, str):
+        return None, 'note phải là chuỗi'
+    created_at = item.get('created_at', now.strftime("%Y-%m-%d"))
+    if not _is_format(created_at, '%Y-%m-%d'):
+        return None, 'created_at phải có dạng YYYY-MM-DD'
+    created_time = item.get('created_time', now.strftime("%H:%M:%S"))
+    if not _is_format(created_time, '%H:%M:%S'):
+        return None, 'created_time phải có dạng HH:MM:SS'
+    return (goal_id, {
+        'title': title,
+        'note': note,
+        'created_at': created_at,
+        'created_time': created_time,
+    }), None
+
+
+def _goal_update(item):
+    goal_id = item.get('id')
+    if not _is_id(goal_id):
+        return None, 'id phải là số nguyên dương'
+    fields = {}
+    if 'title' in item:
+        if not isinstance(item['title'], str) or not item['title'].strip():
+            return None, 'title không được rỗng'
+        fields['title'] = item['title']
+    if 'description' in item:
+        if not isinstance(item['description'], str):
+            return None, 'description phải là chuỗi'
+        fields['description'] = item['description']
+    if 'target_date' in item:
+        if not _is_format(item['target_date'], '%Y-%m-%d'):
+            return None, 'target_date phải có dạng YYYY-MM-DD'
+        fields['target_date'] = item['target_date']
+    if 'status' in item:
+        if item['status'] not in GOAL_STATUSES:
+            return None, f"status phải là một trong {', '.join(GOAL_STATUSES)}"
+        fields['status'] = item['status']
+    if 'progress' in item:
+        progress = item['progress']
+        if not isinstance(progress, int) or isinstance(progress, bool) or not 0 <= progress <= 100:
+            return None, 'progress phải là số nguyên 0 - 100'
+        fields['progress'] = progress
+    if not fields:
+        return None, 'Không có field nào để cập nhật'
+    return (goal_id, fields), None
+
+
+def _record_id(value):
+    if not _is_id(value):
+        return None, 'id phải là số nguyên dương'
+    return value, None
+
+
+@api.errorhandler(_Invalid)
+def _invalid(e):
+    return jsonify({'success': False, 'message': e.message, 'errors': e.errors}), e.status
+
+
+@api.errorhandler(BatchError)
+def _not_found(e):
+    return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 404
+
+
+@api.route('/subtasks', methods=['POST'])
+def create_subtasks():
+    """Thêm nhiều hoạt động (có thể cho nhiều goal) trong một lần ghi"""
+    now = datetime.now()
+    items = _check(_items('subtasks'), lambda item: _new_subtask(item, now))
+    created = get_storage().add_subtasks(items)
+    logger.info(f"📥 API batch: added {len(created)} subtasks")
+    return jsonify({'success': True, 'count': len(created), 'subtasks': created}), 201
+
+
+@api.route('/subtasks/delete', methods=['POST'])
+def delete_subtasks():
+    """Xóa nhiều hoạt động trong một lần ghi"""
+    ids = _check(_items('ids'), _record_id, objects=False)
+    deleted = get_storage().delete_subtasks(ids)
+    logger.info(f"🗑️  API batch: deleted {len(deleted)} subtasks")
+    return jsonify({'success': True, 'count': len(deleted), 'ids': [task['id'] for task in deleted]})
+
+
+@api.route('/goals', methods=['PATCH'])
+def update_goals():
+    """Đổi trạng thái / thông tin nhiều mục tiêu trong một lần ghi"""
+    updates = _check(_items('goals'), _goal_update)
+    goals = get_storage().update_goals(updates)
+    logger.info(f"✏️  API batch: updated {len(goals)} goals")
+    return jsonify({'success': True, 'count': len(goals), 'goals': goals})
+
+
+@api.route('/goals/delete', methods=['POST'])
+def delete_goals():
+    """Xóa nhiều mục tiêu (kèm hoạt động) trong một lần ghi"""
+    ids = _check(_items('ids'), _record_id, objects=False)
+    removed = get_storage().delete_goals(ids)
+    logger.info(f"🗑️  API batch: deleted {len(removed)} goals")
+    return jsonify({
+        'success': True,
+        'count': len(removed),
+        'ids': list(removed),
+        'subtasks_deleted': sum(removed.values()),
+    })
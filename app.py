@@ -5,12 +5,20 @@ app.py - Flask Web Application (Updated with Manual Backup)
 - Thêm: Backup thủ công gửi Telegram
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash, make_response, session
 import os
-from datetime import datetime, timedelta
-import requests
+import atexit
+import hashlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
 from dotenv import load_dotenv
 from storage import get_storage
+from markupsafe import Markup
+from page_cache import LRUCache
+from api_v1 import api as api_v1
+from telegram_outbox import Outbox, OutboxSender, TelegramClient, TelegramError, TokenBucket
+from json_stream import record_digest
+from backup import EXTENSIONS, BackupManager, available_encodings, compress_chunks, negotiate_encoding
 import logging
 
 load_dotenv()
@@ -24,15 +32,89 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
+# Số phần tử tối đa mỗi batch của JSON API /api/v1 (api_v1.py)
+app.config['API_BATCH_MAX'] = int(os.getenv('API_BATCH_MAX', '5000'))
 
 # Storage Manager
 MONGO_URI = os.getenv('MONGO_URI', None)
-storage = get_storage(mongo_uri=MONGO_URI)
+MONGO_LAYOUT = os.getenv('MONGO_LAYOUT', 'document')
+MONGO_DB = os.getenv('MONGO_DB', 'goal_tracker_2026')
+# Pool / timeout của MongoClient (tạo lười ở lần đồng bộ đầu tiên)
+MONGO_OPTIONS = {
+    'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '10')),
+    'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+    'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_MS', '60000')),
+    'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '3000')),
+    'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '3000')),
+    'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '10000')),
+}
+# Circuit breaker: số lỗi liên tiếp trước khi bỏ qua Mongo, thời gian bỏ qua, chu kỳ ping nền
+MONGO_BREAKER = {
+    'failure_threshold': int(os.getenv('MONGO_BREAKER_FAILURES', '3')),
+    'reset_timeout': float(os.getenv('MONGO_BREAKER_RESET_S', '30')),
+    'probe_interval': float(os.getenv('MONGO_PROBE_INTERVAL_S', '10')),
+}
+STORAGE_JOURNAL = os.getenv('STORAGE_JOURNAL', 'false').lower() == 'true'
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '1000'))
+STORAGE_GROUP_COMMIT_MS = int(os.getenv('STORAGE_GROUP_COMMIT_MS', '0'))
+SQLITE_PATH = os.getenv('SQLITE_PATH', None)
+STORAGE_COMPACT = os.getenv('STORAGE_COMPACT', 'false').lower() == 'true'
+# Chia lịch sử hoạt động theo 'month' / 'year' (để trống = một file)
+STORAGE_PARTITION = os.getenv('STORAGE_PARTITION', '').lower() or None
+# Nhiều worker process (gunicorn) cùng dùng thư mục data: khóa file + bộ đếm phiên bản chung
+STORAGE_MULTIPROCESS = os.getenv('STORAGE_MULTIPROCESS', 'false').lower() == 'true'
+# Số lần chạy lại khi đọc - sửa - ghi toàn bộ dữ liệu bị xung đột (storage.update_data)
+STORAGE_OCC_RETRIES = int(os.getenv('STORAGE_OCC_RETRIES', '3'))
+storage = get_storage(
+    mongo_uri=MONGO_URI,
+    mongo_db=MONGO_DB,
+    mongo_layout=MONGO_LAYOUT,
+    mongo_options=MONGO_OPTIONS,
+    mongo_breaker=MONGO_BREAKER,
+    sqlite_path=SQLITE_PATH,
+    journal=STORAGE_JOURNAL,
+    compact_every=JOURNAL_COMPACT_EVERY,
+    group_commit_ms=STORAGE_GROUP_COMMIT_MS,
+    compact_memory=STORAGE_COMPACT,
+    partition=STORAGE_PARTITION,
+    multiprocess=STORAGE_MULTIPROCESS,
+    occ_max_retries=STORAGE_OCC_RETRIES
+)
+
+# JSON API hàng loạt /api/v1 (api_v1.py) dùng chung storage singleton ở trên
+app.register_blueprint(api_v1)
+
+# Số mục mỗi trang (phân trang keyset trong storage): thẻ goal trên dashboard, /goals, hoạt động của một goal
+DASHBOARD_PAGE_SIZE = int(os.getenv('DASHBOARD_PAGE_SIZE', '2'))
+GOALS_PAGE_SIZE = int(os.getenv('GOALS_PAGE_SIZE', '12'))
+ACTIVITY_PAGE_SIZE = int(os.getenv('ACTIVITY_PAGE_SIZE', '50'))
+
+# Cache HTML đã render (page_cache.py): số trang, số fragment (0 = tắt), dung lượng tối đa mỗi loại
+PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', '128'))
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', '1024'))
+PAGE_CACHE_MAX_MB = int(os.getenv('PAGE_CACHE_MAX_MB', '32'))
+page_cache = LRUCache(PAGE_CACHE_SIZE, PAGE_CACHE_MAX_MB * 1024 * 1024)
+fragment_cache = LRUCache(FRAGMENT_CACHE_SIZE, PAGE_CACHE_MAX_MB * 1024 * 1024)
+
+# Backup gửi Telegram: 'full' (mỗi lần một bản đầy đủ) hoặc 'incremental' (full hàng tháng + delta)
+TELEGRAM_BACKUP_MODE = os.getenv('TELEGRAM_BACKUP_MODE', 'full').lower()
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'data/backups')
+# Giới hạn upload file của Telegram Bot API
+TELEGRAM_MAX_UPLOAD = 50 * 1024 * 1024
+backups = BackupManager(storage, BACKUP_DIR)
 
 # Telegram Config
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID', '')
 TELEGRAM_THREAD_ID = os.getenv('TELEGRAM_THREAD_ID', '')
+# Gửi nền qua outbox (telegram_outbox.py): API base (server giả khi chạy thử), timeout, giới hạn tốc độ, số lần thử
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org')
+TELEGRAM_OUTBOX_PATH = os.getenv('TELEGRAM_OUTBOX_PATH', 'data/telegram_outbox.db')
+TELEGRAM_CONNECT_TIMEOUT_S = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT_S', '5'))
+TELEGRAM_READ_TIMEOUT_S = float(os.getenv('TELEGRAM_READ_TIMEOUT_S', '60'))
+TELEGRAM_RATE_PER_S = float(os.getenv('TELEGRAM_RATE_PER_S', '1'))
+TELEGRAM_BURST = int(os.getenv('TELEGRAM_BURST', '3'))
+TELEGRAM_MAX_ATTEMPTS = int(os.getenv('TELEGRAM_MAX_ATTEMPTS', '5'))
 
 
 # ============================================================
@@ -40,53 +122,76 @@ TELEGRAM_THREAD_ID = os.getenv('TELEGRAM_THREAD_ID', '')
 # ============================================================
 
 def send_telegram_message(message):
-    """Gửi tin nhắn qua Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return False, "Chưa cấu hình Telegram trong .env"
+    """Đưa tin nhắn vào outbox (gửi nền), trả về (success, message, job_id)"""
+    if telegram_sender is None:
+        return False, "Chưa cấu hình Telegram trong .env", None
     
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "parse_mode": "Markdown"
-    }
-    
-    if TELEGRAM_THREAD_ID:
-        payload["message_thread_id"] = TELEGRAM_THREAD_ID
+    job_id = telegram_sender.submit('message', {'text': message})
+    return True, "Đã đưa vào hàng đợi gửi Telegram", job_id
+
+
+def send_backup(kind, caption):
+    """Đưa việc tạo backup nén (full/delta/auto) + gửi Telegram vào outbox, trả về (success, message, job_id)"""
+    if telegram_sender is None:
+        return False, "Chưa cấu hình Telegram", None
     
-    try:
-        response = requests.post(url, json=payload)
-        if response.status_code == 200:
-            return True, "Đã gửi thành công!"
-        else:
-            return False, f"Lỗi: {response.text}"
-    except Exception as e:
-        return False, f"Lỗi kết nối: {str(e)}"
+    job_id = telegram_sender.submit('backup', {'kind': kind, 'caption': caption})
+    return True, "Đã đưa backup vào hàng đợi gửi Telegram", job_id
 
 
-def send_telegram_file(file_path, caption=""):
-    """Gửi file qua Telegram"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        return False, "Chưa cấu hình Telegram"
+def deliver_message(payload):
+    """Handler outbox 'message' (chạy trong thread gửi nền)"""
+    telegram.send_message(TELEGRAM_CHAT_ID, payload['text'], TELEGRAM_THREAD_ID)
+    return "Đã gửi thành công!"
+
+
+def deliver_backup(payload):
+    """Handler outbox 'backup': tạo backup lúc gửi; chỉ ghi vào manifest khi gửi thành công"""
+    pending = backups.prepare(payload['kind'])
+    if pending is None:
+        return "Không có thay đổi kể từ lần backup trước"
     
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendDocument"
+    entry = pending.entry
+    if entry['size'] > TELEGRAM_MAX_UPLOAD:
+        backups.discard(pending)
+        raise TelegramError(f"File backup quá lớn cho Telegram ({entry['size'] // (1024 * 1024)} MB)", retryable=False)
     
+    label = 'Full' if entry['type'] == 'full' else f"Delta ({entry['changes']} thay đổi, base: {entry['base']})"
     try:
-        with open(file_path, 'rb') as f:
-            files = {'document': f}
-            data = {'chat_id': TELEGRAM_CHAT_ID, 'caption': caption}
-            
-            if TELEGRAM_THREAD_ID:
-                data['message_thread_id'] = TELEGRAM_THREAD_ID
-            
-            response = requests.post(url, files=files, data=data)
-            
-            if response.status_code == 200:
-                return True, "Đã gửi file thành công!"
-            else:
-                return False, f"Lỗi: {response.text}"
-    except Exception as e:
-        return False, f"Lỗi: {str(e)}"
+        telegram.send_document(TELEGRAM_CHAT_ID, pending.path, f"{payload['caption']}\n🧩 {label}", TELEGRAM_THREAD_ID)
+    except Exception:
+        # Lần thử sau tạo lại backup từ dữ liệu lúc đó
+        backups.discard(pending)
+        raise
+    backups.commit(pending)
+    return "Đã gửi file thành công!"
+
+
+def queued(success, msg, job_id):
+    """Response cho endpoint gửi Telegram: 202 + job id để hỏi trạng thái (api_telegram_job)"""
+    if not success:
+        return jsonify({'success': False, 'message': msg})
+    return jsonify({
+        'success': True,
+        'message': msg,
+        'job_id': job_id,
+        'status_url': url_for('api_telegram_job', job_id=job_id),
+    }), 202
+
+
+telegram = telegram_sender = None
+if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
+    telegram = TelegramClient(TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE,
+                              TELEGRAM_CONNECT_TIMEOUT_S, TELEGRAM_READ_TIMEOUT_S)
+    telegram_sender = OutboxSender(
+        Outbox(TELEGRAM_OUTBOX_PATH),
+        {'message': deliver_message, 'backup': deliver_backup},
+        TokenBucket(TELEGRAM_RATE_PER_S, TELEGRAM_BURST),
+        max_attempts=TELEGRAM_MAX_ATTEMPTS
+    )
+    # atexit chạy ngược thứ tự đăng ký: dừng thread gửi trước, đóng session sau
+    atexit.register(telegram.close)
+    atexit.register(telegram_sender.stop)
 
 
 def get_week_range(date=None):
@@ -100,86 +205,153 @@ def get_week_range(date=None):
     return start, end
 
 
+def short_date(iso_day):
+    """'YYYY-MM-DD' → 'DD/MM' (cắt chuỗi, không cần strptime)"""
+    return f"{iso_day[8:10]}/{iso_day[5:7]}"
+
+
+_templates_stamp = None
+
+def templates_stamp():
+    """Dấu (mtime, size) của thư mục templates - sửa template là đổi ETag; chỉ stat lại khi auto reload"""
+    global _templates_stamp
+    if _templates_stamp is None or app.debug or app.config.get('TEMPLATES_AUTO_RELOAD'):
+        folder = os.path.join(app.root_path, app.template_folder)
+        stamp = []
+        for name in sorted(os.listdir(folder)):
+            st = os.stat(os.path.join(folder, name))
+            stamp.append((name, st.st_mtime_ns, st.st_size))
+        _templates_stamp = tuple(stamp)
+    return _templates_stamp
+
+
+def page_key(template):
+    """
+    Khóa phiên bản của một trang: dữ liệu đã lưu + template + tham số URL + ngày hôm nay
+    (trang tuần / tháng đổi theo ngày). Không nạp dữ liệu
+    """
+    return (
+        storage.change_token(),
+        template,
+        templates_stamp(),
+        tuple(sorted(request.view_args.items())),
+        tuple(sorted(request.args.items(multi=True))),
+        datetime.now().strftime('%Y-%m-%d'),
+    )
+
+
+def cached_page(template, mimetype='text/html'):
+    """
+    Trang HTML (hoặc fragment JSON) có ETag / Last-Modified + cache bản đã render theo page_key:
+    - If-None-Match / If-Modified-Since khớp → 304 trước khi view nạp dữ liệu hay render
+    - Cùng khóa đã render trong worker này → trả HTML từ page_cache, không chạy view
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('_flashes'):
+                # Thông báo flash chỉ hiện một lần → luôn render, không cache
+                return view(*args, **kwargs)
+            
+            key = page_key(template)
+            etag = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=12).hexdigest()
+            # Header HTTP tính theo giây; trang đổi theo ngày nên không cũ hơn 0h hôm nay
+            midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+            last_modified = datetime.fromtimestamp(
+                int(max(storage.last_modified(), midnight)), timezone.utc
+            )
+            
+            # If-None-Match được ưu tiên, chỉ xét If-Modified-Since khi không có ETag (RFC 9110)
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                fresh = bool(request.if_modified_since) and last_modified <= request.if_modified_since
+            
+            if fresh:
+                response = app.response_class(status=304)
+            else:
+                body = page_cache.get(key)
+                if body is not None:
+                    response = app.response_class(body, mimetype=mimetype)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        # Redirect (không tìm thấy goal, chưa có dữ liệu báo cáo, ...) không gắn ETag / cache
+                        return response
+                    page_cache.put(key, response.get_data())
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # Trình duyệt được giữ bản sao nhưng phải hỏi lại mỗi lần
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+@app.template_global()
+def cached_fragment(name, record, caller):
+    """
+    {% call cached_fragment('goals.card', goal) %}...{% endcall %}
+    HTML của khối được cache theo nội dung record (goal không đổi → không render lại)
+    """
+    key = (name, templates_stamp(), record_digest(record))
+    return Markup(fragment_cache.get_or_render(key, caller))
+
+
 # ============================================================
 # WEB ROUTES
 # ============================================================
 
 @app.route('/')
+@cached_page('index.html')
 def index():
     """Dashboard - Trang chủ"""
-    data = storage.load_data()
+    # Thống kê (bộ đếm được storage cập nhật theo từng thay đổi)
+    stats = storage.dashboard_stats()
     
-    # Thống kê
-    total_goals = len(data['goals'])
-    active_goals = len([g for g in data['goals'] if g.get('status') == 'active'])
-    completed_goals = len([g for g in data['goals'] if g.get('status') == 'completed'])
-    
-    # Đếm sub tasks tuần này
-    week_start, week_end = get_week_range()
-    week_subtasks = len([t for t in data['sub_tasks'] 
-                         if week_start.date() <= datetime.strptime(t['created_at'], "%Y-%m-%d").date() <= week_end.date()])
-    
-    stats = {
-        'total_goals': total_goals,
-        'active_goals': active_goals,
-        'completed_goals': completed_goals,
-        'week_subtasks': week_subtasks
-    }
-    
-    # === PHÂN TRANG CHO MỤC TIÊU TRÊN DASHBOARD ===
-    page = request.args.get('page', 1, type=int)
-    per_page = 2  # Bạn có thể đổi thành 5, 8, 9, 12 tùy thích
-    
-    all_goals = data['goals']
-    total_goals_count = len(all_goals)  # để hiển thị tổng số
-    
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_goals = all_goals[start:end]
-    
-    total_pages = (total_goals_count + per_page - 1) // per_page if total_goals_count > 0 else 1
+    # === PHÂN TRANG CHO MỤC TIÊU TRÊN DASHBOARD (keyset theo id, chỉ copy goal của trang) ===
+    page_goals, prev_cursor, next_cursor = storage.goals_page(
+        DASHBOARD_PAGE_SIZE, request.args.get('after'), request.args.get('before')
+    )
     
     return render_template('index.html', 
-                           goals=paginated_goals,
+                           goals=page_goals,
                            stats=stats,
                            telegram_configured=bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID),
-                           page=page,
-                           total_pages=total_pages,
-                           total_goals=total_goals_count)
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor,
+                           total_goals=stats['total_goals'])
 
 
 @app.route('/goals')
+@cached_page('goals.html')
 def goals():
     """Danh sách mục tiêu"""
-    data = storage.load_data()
+    page_goals, prev_cursor, next_cursor = storage.goals_page(
+        GOALS_PAGE_SIZE, request.args.get('after'), request.args.get('before')
+    )
     
-    # Đếm số hoạt động cho mỗi goal
-    for goal in data['goals']:
-        goal['subtask_count'] = len([t for t in data['sub_tasks'] if t['goal_id'] == goal['id']])
+    # Đếm số hoạt động cho mỗi goal (index goal_id → sub_tasks)
+    counts = storage.subtask_counts()
+    for goal in page_goals:
+        goal['subtask_count'] = counts.get(goal['id'], 0)
     
-    return render_template('goals.html', goals=data['goals'])
+    return render_template('goals.html', goals=page_goals,
+                           prev_cursor=prev_cursor, next_cursor=next_cursor)
 
 
 @app.route('/goals/add', methods=['GET', 'POST'])
 def add_goal():
     """Thêm mục tiêu mới"""
     if request.method == 'POST':
-        data = storage.load_data()
-        
-        max_id = max([g['id'] for g in data['goals']], default=0)
-        
-        goal = {
-            "id": max_id + 1,
+        goal = storage.add_goal({
             "title": request.form['title'],
             "description": request.form.get('description', ''),
             "target_date": request.form.get('target_date', '2026-12-31'),
             "created_at": datetime.now().strftime("%Y-%m-%d"),
             "status": "active",
             "progress": 0
-        }
-        
-        data['goals'].append(goal)
-        storage.save_data(data)
+        })
         
         flash('✅ Đã tạo mục tiêu mới thành công!', 'success')
         return redirect(url_for('goal_detail', goal_id=goal['id']))
@@ -188,39 +360,41 @@ def add_goal():
 
 
 @app.route('/goals/<int:goal_id>')
+@cached_page('goal_detail.html')
 def goal_detail(goal_id):
     """Chi tiết mục tiêu - CHỈ quản lý hoạt động"""
-    data = storage.load_data()
-    goal = next((g for g in data['goals'] if g['id'] == goal_id), None)
+    goal = storage.get_goal(goal_id)
     
     if not goal:
         flash('❌ Không tìm thấy mục tiêu', 'danger')
         return redirect(url_for('goals'))
     
-    # Lấy danh sách hoạt động
-    sub_tasks = [t for t in data['sub_tasks'] if t['goal_id'] == goal_id]
-    sub_tasks.sort(key=lambda x: (x['created_at'], x['created_time']), reverse=True)
+    # Một trang hoạt động, mới nhất trước (không sắp xếp / copy toàn bộ lịch sử của goal)
+    sub_tasks, prev_cursor, next_cursor = storage.subtasks_page(
+        goal_id, ACTIVITY_PAGE_SIZE, request.args.get('after'), request.args.get('before')
+    )
     
-    return render_template('goal_detail.html', goal=goal, sub_tasks=sub_tasks)
+    return render_template('goal_detail.html', goal=goal, sub_tasks=sub_tasks,
+                           subtask_count=storage.subtask_count(goal_id),
+                           prev_cursor=prev_cursor, next_cursor=next_cursor)
 
 
 @app.route('/goals/<int:goal_id>/edit', methods=['GET', 'POST'])
 def edit_goal(goal_id):
     """Chỉnh sửa mục tiêu"""
-    data = storage.load_data()
-    goal = next((g for g in data['goals'] if g['id'] == goal_id), None)
+    goal = storage.get_goal(goal_id)
     
     if not goal:
         flash('❌ Không tìm thấy mục tiêu', 'danger')
         return redirect(url_for('goals'))
     
     if request.method == 'POST':
-        goal['title'] = request.form['title']
-        goal['description'] = request.form.get('description', '')
-        goal['target_date'] = request.form.get('target_date')
-        goal['status'] = request.form.get('status', 'active')
-        
-        storage.save_data(data)
+        storage.update_goal(goal_id, {
+            'title': request.form['title'],
+            'description': request.form.get('description', ''),
+            'target_date': request.form.get('target_date'),
+            'status': request.form.get('status', 'active'),
+        })
         flash('✅ Đã cập nhật mục tiêu thành công!', 'success')
         return redirect(url_for('goal_detail', goal_id=goal_id))
     
@@ -230,10 +404,7 @@ def edit_goal(goal_id):
 @app.route('/goals/<int:goal_id>/delete', methods=['POST'])
 def delete_goal(goal_id):
     """Xóa mục tiêu"""
-    data = storage.load_data()
-    data['goals'] = [g for g in data['goals'] if g['id'] != goal_id]
-    data['sub_tasks'] = [t for t in data['sub_tasks'] if t['goal_id'] != goal_id]
-    storage.save_data(data)
+    storage.delete_goal_cascade(goal_id)
     
     flash('✅ Đã xóa mục tiêu thành công!', 'success')
     return redirect(url_for('goals'))
@@ -242,27 +413,16 @@ def delete_goal(goal_id):
 @app.route('/goals/<int:goal_id>/subtask/add', methods=['POST'])
 def add_subtask(goal_id):
     """Thêm hoạt động (sub task)"""
-    data = storage.load_data()
-    goal = next((g for g in data['goals'] if g['id'] == goal_id), None)
-    
-    if not goal:
-        flash('❌ Không tìm thấy mục tiêu', 'danger')
-        return redirect(url_for('goals'))
-    
-    max_id = max([t['id'] for t in data['sub_tasks']], default=0)
-    
-    subtask = {
-        "id": max_id + 1,
-        "goal_id": goal_id,
-        "goal_title": goal['title'],
+    subtask = storage.add_subtask(goal_id, {
         "title": request.form['title'],
         "note": request.form.get('note', ''),
         "created_at": datetime.now().strftime("%Y-%m-%d"),
         "created_time": datetime.now().strftime("%H:%M:%S")
-    }
+    })
     
-    data['sub_tasks'].append(subtask)
-    storage.save_data(data)
+    if not subtask:
+        flash('❌ Không tìm thấy mục tiêu', 'danger')
+        return redirect(url_for('goals'))
     
     flash('✅ Đã thêm hoạt động mới!', 'success')
     return redirect(url_for('goal_detail', goal_id=goal_id))
@@ -271,146 +431,64 @@ def add_subtask(goal_id):
 @app.route('/subtask/<int:subtask_id>/delete', methods=['POST'])
 def delete_subtask(subtask_id):
     """Xóa hoạt động"""
-    data = storage.load_data()
-    subtask = next((t for t in data['sub_tasks'] if t['id'] == subtask_id), None)
+    subtask = storage.delete_subtask(subtask_id)
     
     if not subtask:
         flash('❌ Không tìm thấy hoạt động', 'danger')
         return redirect(url_for('index'))
     
-    goal_id = subtask['goal_id']
-    data['sub_tasks'] = [t for t in data['sub_tasks'] if t['id'] != subtask_id]
-    storage.save_data(data)
-    
     flash('✅ Đã xóa hoạt động!', 'success')
-    return redirect(url_for('goal_detail', goal_id=goal_id))
+    return redirect(url_for('goal_detail', goal_id=subtask['goal_id']))
 
 
 @app.route('/progress')
+@cached_page('progress.html')
 def progress():
     """Trang Tiến Độ - READ ONLY, tự động tính"""
-    data = storage.load_data()
-    
     today = datetime.now()
     week_start, week_end = get_week_range()
     month_start = today.replace(day=1)
     
-    # ===== TIẾN ĐỘ TUẦN =====
-    week_tasks = [t for t in data['sub_tasks'] 
-                  if week_start.date() <= datetime.strptime(t['created_at'], "%Y-%m-%d").date() <= week_end.date()]
-    
-    # Thống kê tuần
-    week_goals = set([t['goal_id'] for t in week_tasks])
-    week_days = set([t['created_at'] for t in week_tasks])
+    # Thống kê tuần / tháng (đọc bộ đếm có sẵn)
+    week_stats, month_stats = storage.progress_stats(today)
     
-    week_stats = {
-        'total_activities': len(week_tasks),
-        'active_goals': len(week_goals),
-        'avg_per_day': round(len(week_tasks) / 7, 1) if week_tasks else 0
-    }
-    
-    # Nhóm theo goal
-    week_by_goal = {}
-    for task in week_tasks:
-        goal_id = task['goal_id']
-        if goal_id not in week_by_goal:
-            week_by_goal[goal_id] = {
-                'goal_title': task['goal_title'],
-                'tasks': []
-            }
-        week_by_goal[goal_id]['tasks'].append(task)
-    
-    # ===== TIẾN ĐỘ THÁNG =====
-    month_tasks = [t for t in data['sub_tasks'] 
-                   if datetime.strptime(t['created_at'], "%Y-%m-%d").date() >= month_start.date()]
-    
-    # Thống kê tháng
-    month_goals = set([t['goal_id'] for t in month_tasks])
-    month_days = set([t['created_at'] for t in month_tasks])
-    
-    # Đếm goals hoàn thành trong tháng
-    completed_in_month = 0
-    for goal in data['goals']:
-        if goal.get('status') == 'completed':
-            # Kiểm tra nếu có hoạt động trong tháng
-            has_activity = any(t['goal_id'] == goal['id'] for t in month_tasks)
-            if has_activity:
-                completed_in_month += 1
-    
-    month_stats = {
-        'total_activities': len(month_tasks),
-        'active_goals': len(month_goals),
-        'completed_goals': completed_in_month,
-        'days_active': len(month_days)
-    }
-    
-    # Nhóm theo goal
-    month_by_goal = {}
-    for task in month_tasks:
-        goal_id = task['goal_id']
-        if goal_id not in month_by_goal:
-            month_by_goal[goal_id] = {
-                'goal_title': task['goal_title'],
-                'tasks': []
-            }
-        month_by_goal[goal_id]['tasks'].append(task)
+    # Chỉ tóm tắt theo goal; danh sách hoạt động tải khi mở rộng (api_goal_activities)
+    week_goals = storage.activity_summary(week_start, week_end)
+    month_goals = storage.activity_summary(month_start)
     
     return render_template('progress.html',
                          week_stats=week_stats,
-                         week_by_goal=week_by_goal,
+                         week_goals=week_goals,
+                         week_start=week_start.strftime('%Y-%m-%d'),
+                         week_end=week_end.strftime('%Y-%m-%d'),
                          week_range=f"{week_start.strftime('%d/%m')} - {week_end.strftime('%d/%m/%Y')}",
                          month_stats=month_stats,
-                         month_by_goal=month_by_goal,
+                         month_goals=month_goals,
                          month_name=f"{today.month}/{today.year}")
 
 
 @app.route('/reports')
+@cached_page('reports.html')
 def reports():
     """Báo cáo - CHỈ hiển thị khi có đủ dữ liệu"""
-    data = storage.load_data()
-    
     today = datetime.now()
     week_start, week_end = get_week_range()
     month_start = today.replace(day=1)
     
-    # Kiểm tra dữ liệu tuần
-    week_tasks = [t for t in data['sub_tasks'] 
-                  if week_start.date() <= datetime.strptime(t['created_at'], "%Y-%m-%d").date() <= week_end.date()]
-    
-    # Kiểm tra dữ liệu tháng
-    month_tasks = [t for t in data['sub_tasks'] 
-                   if datetime.strptime(t['created_at'], "%Y-%m-%d").date() >= month_start.date()]
+    # Tóm tắt tuần / tháng theo goal (không copy từng hoạt động)
+    week_goals = storage.activity_summary(week_start, week_end)
+    month_goals = storage.activity_summary(month_start)
     
     # Nếu KHÔNG có dữ liệu → 404
-    if not week_tasks and not month_tasks:
+    if not week_goals and not month_goals:
         flash('⚠️ Chưa có dữ liệu để tạo báo cáo. Hãy thêm hoạt động trước!', 'warning')
         return redirect(url_for('index'))
     
-    # Nhóm báo cáo tuần
-    week_by_goal = {}
-    for task in week_tasks:
-        goal_id = task['goal_id']
-        if goal_id not in week_by_goal:
-            week_by_goal[goal_id] = {
-                'goal_title': task['goal_title'],
-                'tasks': []
-            }
-        week_by_goal[goal_id]['tasks'].append(task)
-    
-    # Nhóm báo cáo tháng
-    month_by_goal = {}
-    for task in month_tasks:
-        goal_id = task['goal_id']
-        if goal_id not in month_by_goal:
-            month_by_goal[goal_id] = {
-                'goal_title': task['goal_title'],
-                'tasks': []
-            }
-        month_by_goal[goal_id]['tasks'].append(task)
-    
     return render_template('reports.html', 
-                         week_by_goal=week_by_goal,
-                         month_by_goal=month_by_goal,
+                         week_goals=week_goals,
+                         month_goals=month_goals,
+                         week_start=week_start.strftime('%Y-%m-%d'),
+                         week_end=week_end.strftime('%Y-%m-%d'),
                          week_range=f"{week_start.strftime('%d/%m')} - {week_end.strftime('%d/%m/%Y')}",
                          month_name=f"Tháng {today.month}/{today.year}")
 
@@ -421,66 +499,116 @@ def reports():
 
 @app.route('/api/download-backup', methods=['GET'])
 def api_download_backup():
-    """Backup thủ công: Tải file JSON về máy"""
+    """
+    Backup thủ công: Tải dữ liệu JSON về máy (stream từng record, mọi backend)
+    - Nén theo Accept-Encoding (gzip/zstd) trong lúc truyền
+    - ?compress=gzip|zstd: tải về file nén (.json.gz / .json.zst), ?compress=none: không nén
+    - ?pretty=1: JSON thụt lề như file dữ liệu
+    """
     try:
-        json_file = 'data/goals_data.json'
+        requested = request.args.get('compress', '').lower()
+        if requested and requested != 'none' and requested not in available_encodings():
+            return jsonify({'success': False, 'message': f'Không hỗ trợ nén: {requested}'}), 400
         
-        if not os.path.exists(json_file):
-            return jsonify({'success': False, 'message': 'File không tồn tại'}), 404
+        indent = 2 if request.args.get('pretty') == '1' else None
+        chunks = storage.export_chunks(indent=indent)
         
         # Tạo tên file với timestamp
         today = datetime.now()
         download_name = f"goals_backup_{today.strftime('%Y%m%d_%H%M%S')}.json"
         
-        return send_file(
-            json_file,
-            as_attachment=True,
-            download_name=download_name,
-            mimetype='application/json'
-        )
+        if requested:
+            # Tải về file nén (hoặc không nén nếu 'none')
+            encoding = None if requested == 'none' else requested
+            headers = {}
+            mimetype = 'application/json'
+            if encoding:
+                download_name += EXTENSIONS[encoding]
+                mimetype = 'application/gzip' if encoding == 'gzip' else 'application/zstd'
+        else:
+            # Nén trong lúc truyền, trình duyệt tự giải nén và lưu file .json
+            encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+            headers = {'Vary': 'Accept-Encoding'}
+            if encoding:
+                headers['Content-Encoding'] = encoding
+            mimetype = 'application/json'
+        
+        headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        return Response(compress_chunks(chunks, encoding), mimetype=mimetype, headers=headers)
     except Exception as e:
         logger.error(f"Download backup error: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/goals/<int:goal_id>/activities', methods=['GET'])
+@cached_page('_activity_rows.html', mimetype='application/json')
+def api_goal_activities(goal_id):
+    """
+    Một trang hoạt động của goal trong khoảng ngày, cũ → mới (trang tiến độ / báo cáo tải khi mở rộng)
+    ?start=YYYY-MM-DD[&end=YYYY-MM-DD][&after=<next_cursor>][&style=progress|report][&offset=<số dòng đã hiện>]
+    """
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end = request.args.get('end')
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'Thiếu hoặc sai start / end (YYYY-MM-DD)'}), 400
+    
+    tasks, _, next_cursor = storage.subtasks_page(
+        goal_id, ACTIVITY_PAGE_SIZE, after=request.args.get('after'),
+        start=start, end=end, newest_first=False
+    )
+    html = render_template('_activity_rows.html', tasks=tasks,
+                           style=request.args.get('style', 'progress'),
+                           offset=request.args.get('offset', 0, type=int))
+    return jsonify({'success': True, 'activities': tasks, 'html': html, 'next_cursor': next_cursor})
+
+
+@app.route('/api/storage-info', methods=['GET'])
+def api_storage_info():
+    """Trạng thái storage: backend, version, đồng bộ MongoDB, số lần xung đột / chạy lại khi ghi"""
+    return jsonify({
+        **storage.get_backup_info(),
+        'page_cache': page_cache.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'telegram_outbox': telegram_sender.stats() if telegram_sender else None,
+    })
+
+
 @app.route('/api/backup-to-telegram', methods=['POST'])
 def api_backup_to_telegram():
-    """Backup thủ công: Gửi JSON về Telegram"""
+    """Backup thủ công: Gửi backup nén về Telegram (delta nếu TELEGRAM_BACKUP_MODE=incremental)"""
     try:
-        output_path = storage.export_json()
-        
+        kind = 'auto' if TELEGRAM_BACKUP_MODE == 'incremental' else 'full'
         today = datetime.now()
-        caption = f"💾 Backup thủ công\n🗓️ {today.strftime('%d/%m/%Y %H:%M:%S')}"
-        
-        success, msg = send_telegram_file(output_path, caption)
-        
-        # Xóa file tạm
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        
-        return jsonify({'success': success, 'message': msg})
+        return queued(*send_backup(kind, f"💾 Backup thủ công\n🗓️ {today.strftime('%d/%m/%Y %H:%M:%S')}"))
     except Exception as e:
         logger.error(f"Backup to Telegram error: {e}")
         return jsonify({'success': False, 'message': str(e)})
 
 
+@app.route('/api/telegram/jobs/<job_id>', methods=['GET'])
+def api_telegram_job(job_id):
+    """Trạng thái job gửi Telegram: queued → sending → sent | failed (attempts, last_error)"""
+    job = telegram_sender.outbox.get(job_id) if telegram_sender else None
+    if job is None:
+        return jsonify({'success': False, 'message': 'Không tìm thấy job'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
 @app.route('/api/test-telegram', methods=['POST'])
 def api_test_telegram():
     """Test Telegram bot"""
     message = "🧪 *Test message từ 2026 Goal Tracker!*\n\n✅ Kết nối thành công!"
-    success, msg = send_telegram_message(message)
-    return jsonify({'success': success, 'message': msg})
+    return queued(*send_telegram_message(message))
 
 
 @app.route('/api/send-weekly-reminder', methods=['POST'])
 def api_send_weekly_reminder():
     """Gửi báo cáo tuần qua Telegram"""
-    data = storage.load_data()
-    
     week_start, week_end = get_week_range()
     
-    week_tasks = [t for t in data['sub_tasks'] 
-                  if week_start.date() <= datetime.strptime(t['created_at'], "%Y-%m-%d").date() <= week_end.date()]
+    week_tasks = storage.subtasks_between(week_start, week_end)
     
     # Không gửi nếu không có dữ liệu
     if not week_tasks:
@@ -504,26 +632,23 @@ def api_send_weekly_reminder():
     for idx, (goal_id, info) in enumerate(by_goal.items(), 1):
         message += f"*{idx}. {info['title']}* ({len(info['tasks'])} hoạt động)\n"
         for task in info['tasks']:
-            date_str = datetime.strptime(task['created_at'], "%Y-%m-%d").strftime("%d/%m")
+            date_str = short_date(task['created_at'])
             message += f"   • {task['title']} - {date_str}\n"
         message += "\n"
     
     message += "💪 Tiếp tục phấn đấu tuần tới!"
     
-    success, msg = send_telegram_message(message)
-    return jsonify({'success': success, 'message': msg})
+    return queued(*send_telegram_message(message))
 
 
 @app.route('/api/send-monthly-review', methods=['POST'])
 def api_send_monthly_review():
     """Gửi báo cáo tháng qua Telegram"""
-    data = storage.load_data()
     today = datetime.now()
     
     month_start = today.replace(day=1)
     
-    month_tasks = [t for t in data['sub_tasks'] 
-                   if datetime.strptime(t['created_at'], "%Y-%m-%d").date() >= month_start.date()]
+    month_tasks = storage.subtasks_between(month_start)
     
     # Không gửi nếu không có dữ liệu
     if not month_tasks:
@@ -549,25 +674,16 @@ def api_send_monthly_review():
     
     message += "🎯 Chúc bạn đạt được mục tiêu 2026!"
     
-    success, msg = send_telegram_message(message)
-    return jsonify({'success': success, 'message': msg})
+    return queued(*send_telegram_message(message))
 
 
 @app.route('/api/send-monthly-backup', methods=['POST'])
 def api_send_monthly_backup():
-    """Gửi backup JSON tháng qua Telegram (tự động)"""
+    """Gửi backup đầy đủ (nén) hàng tháng qua Telegram (tự động), mở chuỗi delta mới"""
     try:
-        output_path = storage.export_json()
-        
         today = datetime.now()
         caption = f"📦 Backup tháng {today.month}/{today.year}\n🗓️ {today.strftime('%d/%m/%Y %H:%M:%S')}"
-        
-        success, msg = send_telegram_file(output_path, caption)
-        
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        
-        return jsonify({'success': success, 'message': msg})
+        return queued(*send_backup('full', caption))
     except Exception as e:
         logger.error(f"Monthly backup error: {e}")
         return jsonify({'success': False, 'message': str(e)})
@@ -586,7 +702,7 @@ if __name__ == '__main__':
     logger.info("=" * 60)
     logger.info(f"📍 Port: {port}")
     logger.info(f"🔧 Debug: {debug}")
-    logger.info(f"💾 Storage: JSON + MongoDB")
+    logger.info(f"💾 Storage: {'SQLite' if SQLITE_PATH else 'JSON'} + MongoDB")
     logger.info(f"📱 Telegram: {'✅ Configured' if TELEGRAM_BOT_TOKEN else '❌ Not configured'}")
     logger.info("=" * 60)
     
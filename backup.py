@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+backup.py - Backup dữ liệu
+- Nén theo luồng: gzip luôn có sẵn (zlib), zstd nếu cài package `zstandard` (optional)
+- Chọn kiểu nén từ query (?compress=gzip|zstd|none) hoặc header Accept-Encoding
+- Backup gửi Telegram: bản đầy đủ (full) + các bản thay đổi (delta) nối tiếp, ghi trong manifest
+- Công cụ restore: dựng lại dữ liệu từ bản full + chuỗi delta
+
+Restore từ thư mục chứa các file backup tải về từ Telegram:
+    python backup.py restore backups/ [--output data/restored_goals_data.json]
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import zlib
+import logging
+from datetime import datetime
+from json_stream import TABLES, encode_chunks, iter_data, open_text, record_digest
+from locking import FileLock
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Kiểu nén → phần mở rộng file khi tải về dạng file nén
+EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+CHUNK_SIZE = 64 * 1024
+
+
+def available_encodings():
+    """Các kiểu nén dùng được, ưu tiên giảm dần"""
+    return ('zstd', 'gzip') if zstandard else ('gzip',)
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Chọn kiểu nén từ header Accept-Encoding (bỏ qua mục có q=0), None nếu không nén
+    Ví dụ: 'gzip, deflate, br, zstd' → 'zstd' (nếu có zstandard) hoặc 'gzip'
+    """
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    for encoding in available_encodings():
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+def compress_chunks(chunks, encoding, level=6):
+    """Nén luồng text (str) theo `encoding`, trả về luồng bytes; encoding=None: chỉ encode UTF-8"""
+    if encoding is None:
+        compress, finish = (lambda data: data), (lambda: b'')
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    elif encoding == 'zstd' and zstandard:
+        compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        compress, finish = compressor.compress, compressor.flush
+    else:
+        raise ValueError(f"Unsupported compression: {encoding}")
+
+    for text in _coalesce(chunks):
+        out = compress(text.encode('utf-8'))
+        if out:
+            yield out
+    out = finish()
+    if out:
+        yield out
+
+
+def _coalesce(chunks, size=CHUNK_SIZE):
+    """Gom các đoạn nhỏ (mỗi record một đoạn) thành đoạn ~size ký tự để giảm overhead"""
+    pending, total = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        total += len(chunk)
+        if total >= size:
+            yield ''.join(pending)
+            pending, total = [], 0
+    if pending:
+        yield ''.join(pending)
+
+
+# ============================================================
+# BACKUP FULL / DELTA
+# ============================================================
+
+FULL_PREFIX = 'goals_full_'
+DELTA_PREFIX = 'goals_delta_'
+SUFFIX = '.json.gz'
+
+
+class PendingBackup:
+    """File backup đã tạo nhưng chưa ghi vào manifest (chờ gửi thành công)"""
+
+    def __init__(self, path, entry, state):
+        self.path = path
+        self.entry = entry
+        self.state = state
+        self.locked = True
+
+
+class BackupManager:
+    """
+    Backup nén, tăng dần:
+    - full: toàn bộ dữ liệu (JSON gọn, gzip), import thẳng được bằng import_json
+    - delta: record thêm/sửa/xóa so với lần backup trước (base)
+    manifest.json ghi chuỗi backup hiện tại; backup_state.json.gz giữ digest từng record
+    của lần backup gần nhất để tính delta mà không cần file backup cũ
+    Khóa backup_dir/.lock (thread + process) được giữ từ prepare đến commit/discard,
+    nên hai worker không cùng đọc - sửa - ghi manifest / state
+    """
+
+    def __init__(self, storage, backup_dir='data/backups', max_deltas=30):
+        self.storage = storage
+        self.backup_dir = backup_dir
+        self.max_deltas = max_deltas
+        self.manifest_file = os.path.join(backup_dir, 'manifest.json')
+        self.state_file = os.path.join(backup_dir, 'backup_state.json.gz')
+        os.makedirs(backup_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(backup_dir, '.lock'))
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'chain': []}
+
+    def prepare(self, kind='auto', now=None):
+        """
+        Tạo file backup, trả về PendingBackup (None nếu delta không có thay đổi)
+        kind: 'full', 'delta' hoặc 'auto' (full khi sang tháng mới / chưa có full / chuỗi delta quá dài)
+        """
+        self._acquire()
+        try:
+            pending = self._prepare(kind, now or datetime.now())
+        except Exception:
+            self._release()
+            raise
+        if pending is None:
+            self._release()
+        return pending
+
+    def _prepare(self, kind, now):
+        chain = self.load_manifest()['chain']
+        state = self._load_state() if chain else None
+
+        if kind == 'auto':
+            first = datetime.fromisoformat(chain[0]['created_at']) if chain else None
+            monthly_due = first is None or (first.year, first.month) != (now.year, now.month)
+            kind = 'full' if monthly_due or state is None or len(chain) > self.max_deltas else 'delta'
+        if kind == 'delta' and state is None:
+            kind = 'full'
+
+        items = self.storage.snapshot_items()
+        if kind == 'full':
+            return self._prepare_full(items, now)
+        return self._prepare_delta(items, state, chain[-1]['file'], len(chain), now)
+
+    def commit(self, pending):
+        """Ghi backup vào manifest (gọi sau khi gửi thành công), xóa file local"""
+        try:
+            manifest = self.load_manifest()
+            if pending.entry['type'] == 'full':
+                manifest['chain'] = []
+            manifest['chain'].append(pending.entry)
+            self._write_state(pending.state)
+            _replace_json(self.manifest_file, manifest)
+        finally:
+            self.discard(pending)
+        logger.info(f"📦 Backup committed: {pending.entry['file']}")
+
+    def discard(self, pending):
+        """Bỏ file backup (gửi lỗi → lần sau delta vẫn tính từ backup đã commit), nhả khóa"""
+        try:
+            if os.path.exists(pending.path):
+                os.remove(pending.path)
+        finally:
+            if pending.locked:
+                pending.locked = False
+                self._release()
+
+    def _acquire(self):
+        self._lock.acquire()
+        try:
+            self._file_lock.acquire(exclusive=True)
+        except Exception:
+            self._lock.release()
+            raise
+
+    def _release(self):
+        try:
+            self._file_lock.release()
+        finally:
+            self._lock.release()
+
+    def _prepare_full(self, items, now):
+        state = {table: {} for table in TABLES}
+        path = self._new_path(FULL_PREFIX, now, 0)
+        tmp_path = path + '.tmp'
+        digest = hashlib.sha256()
+        with open(tmp_path, 'wb') as f:
+            for chunk in compress_chunks(encode_chunks(_track(items, state), None), 'gzip'):
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        entry = {
+            'file': os.path.basename(path),
+            'type': 'full',
+            'base': None,
+            'created_at': now.isoformat(timespec='seconds'),
+            'size': os.path.getsize(path),
+            'sha256': digest.hexdigest(),
+            'records': {table: len(state[table]) for table in TABLES},
+        }
+        logger.info(f"📦 Full backup: {entry['file']} ({entry['size']} bytes)")
+        return PendingBackup(path, entry, state)
+
+    def _prepare_delta(self, items, old_state, base, seq, now):
+        state = {table: {} for table in TABLES}
+        upserts = {table: [] for table in TABLES}
+        rest = {}
+        for key, value in items:
+            if key not in TABLES:
+                rest[key] = value
+                continue
+            for position, record in enumerate(value):
+                record_key = _record_key(key, position, record)
+                digest = record_digest(record)
+                state[key][record_key] = digest
+                if old_state[key].get(record_key) != digest:
+                    # progress_logs không có id → lưu kèm vị trí
+                    upserts[key].append([position, record] if key == 'progress_logs' else record)
+        deletes = {
+            table: [k for k in old_state[table] if k not in state[table]]
+            for table in TABLES
+        }
+        changes = sum(len(v) for v in upserts.values()) + sum(len(v) for v in deletes.values())
+        if not changes:
+            logger.info("📦 No changes since last backup")
+            return None
+
+        delta = {
+            'backup_type': 'delta',
+            'base': base,
+            'created_at': now.isoformat(timespec='seconds'),
+            'upserts': upserts,
+            'deletes': deletes,
+            'rest': rest,
+        }
+        path = self._new_path(DELTA_PREFIX, now, seq)
+        raw = gzip.compress(json.dumps(delta, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(raw)
+        os.replace(path + '.tmp', path)
+        entry = {
+            'file': os.path.basename(path),
+            'type': 'delta',
+            'base': base,
+            'created_at': delta['created_at'],
+            'size': len(raw),
+            'sha256': hashlib.sha256(raw).hexdigest(),
+            'changes': changes,
+        }
+        logger.info(f"📦 Delta backup: {entry['file']} ({changes} changes, {entry['size']} bytes)")
+        return PendingBackup(path, entry, state)
+
+    def _new_path(self, prefix, now, seq):
+        """Tên file: thời điểm + số thứ tự trong chuỗi (không trùng dù tạo trong cùng một giây)"""
+        name = f"{prefix}{now.strftime('%Y%m%d_%H%M%S')}_{seq:03d}{SUFFIX}"
+        return os.path.join(self.backup_dir, name)
+
+    def _load_state(self):
+        try:
+            with gzip.open(self.state_file, 'rt', encoding='utf-8') as f:
+                raw = json.load(f)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return {table: dict((k, d) for k, d in raw.get(table, [])) for table in TABLES}
+
+    def _write_state(self, state):
+        raw = {table: [[k, d] for k, d in state[table].items()] for table in TABLES}
+        tmp_path = self.state_file + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(raw, f, separators=(',', ':'))
+        os.replace(tmp_path, self.state_file)
+
+
+def _record_key(table, position, record):
+    """Khóa so sánh giữa các lần backup: id (goals/sub_tasks), vị trí (progress_logs)"""
+    if table != 'progress_logs' and isinstance(record, dict) and 'id' in record:
+        return record['id']
+    return position
+
+
+def _track(items, state):
+    """Cho items đi qua nguyên vẹn, đồng thời ghi digest từng record vào state"""
+    for key, value in items:
+        if key in TABLES:
+            value = _track_records(key, value, state[key])
+        yield key, value
+
+
+def _track_records(table, records, digests):
+    for position, record in enumerate(records):
+        digests[_record_key(table, position, record)] = record_digest(record)
+        yield record
+
+
+def _replace_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ============================================================
+# RESTORE
+# ============================================================
+
+def restore(paths, output_path, full_name=None):
+    """
+    Dựng lại dữ liệu từ bản full mới nhất (hoặc full_name) + chuỗi delta nối sau nó,
+    ghi ra output_path dạng file dữ liệu JSON. Trả về danh sách file đã dùng theo thứ tự
+    """
+    files = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                files[name] = os.path.join(path, name)
+        else:
+            files[os.path.basename(path)] = path
+
+    fulls = sorted(name for name in files if name.startswith(FULL_PREFIX) and name.endswith(SUFFIX))
+    if full_name is None:
+        if not fulls:
+            raise ValueError("No full backup found")
+        full_name = fulls[-1]
+    if full_name not in files:
+        raise ValueError(f"Full backup not found: {full_name}")
+
+    # base → các delta dựa trên nó
+    deltas = {}
+    for name in files:
+        if name.startswith(DELTA_PREFIX) and name.endswith(SUFFIX):
+            with gzip.open(files[name], 'rt', encoding='utf-8') as f:
+                delta = json.load(f)
+            deltas.setdefault(delta['base'], []).append((delta['created_at'], name, delta))
+
+    tables = {table: {} for table in TABLES}
+    rest = {}
+    with open_text(files[full_name]) as f:
+        for table, record in iter_data(f):
+            if table is None:
+                rest = record
+            else:
+                key = _record_key(table, len(tables[table]), record)
+                tables[table][key] = record
+
+    used = [full_name]
+    while deltas.get(used[-1]):
+        # Nếu có nhiều delta cùng base (gửi lại sau lỗi), dùng bản mới nhất
+        _, name, delta = max(deltas[used[-1]], key=lambda item: item[:2])
+        if name in used:
+            break
+        for table in TABLES:
+            for key in delta['deletes'].get(table, []):
+                tables[table].pop(key, None)
+            for record in delta['upserts'].get(table, []):
+                if table == 'progress_logs':
+                    position, record = record
+                    tables[table][position] = record
+                else:
+                    tables[table][record['id']] = record
+        rest.update(delta.get('rest', {}))
+        used.append(name)
+
+    items = list(rest.items())
+    items += [(table, (tables[table][k] for k in sorted(tables[table])) if table == 'progress_logs'
+               else tables[table].values()) for table in TABLES]
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for chunk in encode_chunks(items, 2):
+            f.write(chunk)
+    os.replace(tmp_path, output_path)
+    return used
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if not args or args[0] != 'restore' or len(args) < 2:
+        print("Usage: python backup.py restore <backup_dir|files...> [--output path] [--full name]")
+        sys.exit(1)
+    output = 'data/restored_goals_data.json'
+    full = None
+    paths = []
+    rest_args = iter(args[1:])
+    for arg in rest_args:
+        if arg == '--output':
+            output = next(rest_args)
+        elif arg == '--full':
+            full = next(rest_args)
+        else:
+            paths.append(arg)
+    used = restore(paths, output, full)
+    print(f"✅ Restored from {len(used)} file(s): {', '.join(used)}")
+    print(f"   → {output} (import: copy vào data/goals_data.json hoặc storage.import_json)")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+columnar.py - Lưu sub_task dạng cột (STORAGE_COMPACT=true)
+- id, goal_id, ngày (ordinal), giây trong ngày nằm trong array kiểu số, không phải dict mỗi record
+- title / note / goal_title là chuỗi được intern (chuỗi trùng nhau chỉ giữ một bản)
+- created_at / created_time được dựng lại từ ordinal + giây khi đọc;
+  chỉ lưu chuỗi gốc nếu nó không ở dạng chuẩn YYYY-MM-DD / HH:MM:SS
+- Đọc qua RowView: trông như dict (task['title'], task.title trong template, dict(task))
+- Xóa đánh dấu tombstone, dồn mảng khi số hàng chết đủ lớn
+"""
+
+import sys
+from array import array
+from collections.abc import Mapping
+from datetime import date
+
+# Key được lưu thành cột riêng; các key khác của record nằm trong self._extra
+_TEXT_FIELDS = ('title', 'note', 'goal_title')
+_FIELDS = ('id', 'goal_id', 'title', 'note', 'created_at', 'created_time', 'goal_title')
+_MISSING = object()
+
+# Dồn mảng khi có hơn COMPACT_MIN hàng chết và chiếm hơn 1/4 tổng số hàng
+COMPACT_MIN = 1024
+
+
+class ColumnStore:
+    """Cùng interface với dataset.DictStore, dữ liệu nằm trong các mảng song song"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.goal_ids = array('q')
+        # 0 = created_at không hợp lệ (khi đó chuỗi gốc nằm trong _extra)
+        self.days = array('i')
+        self.secs = array('i')
+        self.alive = array('b')
+        self.text = {name: [] for name in _TEXT_FIELDS}
+        # vị trí → {key: giá trị} cho key không chuẩn / chuỗi ngày giờ không chuẩn
+        self._extra = {}
+        # id → vị trí trong mảng
+        self._pos = {}
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._pos)
+
+    def __contains__(self, task_id):
+        return task_id in self._pos
+
+    def get(self, task_id):
+        return RowView(self, task_id) if task_id in self._pos else None
+
+    def when(self, task_id):
+        pos = self._pos.get(task_id)
+        if pos is None or not self.days[pos]:
+            return None
+        return self.days[pos], self.secs[pos]
+
+    def values(self):
+        return [RowView(self, task_id) for task_id in self._pos]
+
+    def max_id(self):
+        return max(self._pos, default=0)
+
+    def snapshot_rows(self):
+        """
+        Bản chụp các hàng hiện tại (copy mảng, không copy chuỗi), trả về iterator dict;
+        thay đổi sau đó trên store không ảnh hưởng tới bản chụp
+        """
+        frozen = ColumnStore.__new__(ColumnStore)
+        frozen.ids = array('q', self.ids)
+        frozen.goal_ids = array('q', self.goal_ids)
+        frozen.days = array('i', self.days)
+        frozen.secs = array('i', self.secs)
+        frozen.alive = array('b', self.alive)
+        frozen.text = {name: list(values) for name, values in self.text.items()}
+        frozen._extra = dict(self._extra)
+        frozen._pos = dict(self._pos)
+        frozen._dead = self._dead
+        return (dict(RowView(frozen, task_id)) for task_id in list(frozen._pos))
+
+    def insert(self, task, when):
+        """Thêm record; id đã có thì ghi đè tại chỗ (giữ thứ tự)"""
+        day, secs = when or (0, 0)
+        extra = {k: v for k, v in task.items() if k not in _FIELDS}
+        # Chỉ giữ chuỗi gốc nếu không dựng lại được y hệt từ ordinal/giây
+        created_at, created_time = task.get('created_at', _MISSING), task.get('created_time', _MISSING)
+        if not day or created_at != date.fromordinal(day).isoformat():
+            extra['created_at'] = created_at
+        if not day or created_time != _format_time(secs):
+            extra['created_time'] = created_time
+        texts = [task.get(name, _MISSING) for name in _TEXT_FIELDS]
+        texts = [sys.intern(v) if type(v) is str else v for v in texts]
+
+        pos = self._pos.get(task['id'])
+        if pos is None:
+            pos = len(self.ids)
+            self._pos[task['id']] = pos
+            self.ids.append(task['id'])
+            self.goal_ids.append(task['goal_id'])
+            self.days.append(day)
+            self.secs.append(secs)
+            self.alive.append(1)
+            for name, value in zip(_TEXT_FIELDS, texts):
+                self.text[name].append(value)
+        else:
+            self.goal_ids[pos] = task['goal_id']
+            self.days[pos] = day
+            self.secs[pos] = secs
+            for name, value in zip(_TEXT_FIELDS, texts):
+                self.text[name][pos] = value
+        if extra:
+            self._extra[pos] = extra
+        else:
+            self._extra.pop(pos, None)
+
+    def remove(self, task_id):
+        """Đánh dấu xóa, trả về (goal_id, when) hoặc None nếu không có"""
+        pos = self._pos.get(task_id)
+        if pos is None:
+            return None
+        removed = (self.goal_ids[pos], self.when(task_id))
+        del self._pos[task_id]
+        self.alive[pos] = 0
+        self._extra.pop(pos, None)
+        for name in _TEXT_FIELDS:
+            self.text[name][pos] = None
+        self._dead += 1
+        if self._dead > COMPACT_MIN and self._dead * 4 > len(self.ids):
+            self._compact()
+        return removed
+
+    def field(self, pos, key):
+        """Giá trị key của hàng ở vị trí pos, _MISSING nếu record không có key"""
+        extra = self._extra.get(pos)
+        if extra is not None and key in extra:
+            return extra[key]
+        if key == 'id':
+            return self.ids[pos]
+        if key == 'goal_id':
+            return self.goal_ids[pos]
+        if key in self.text:
+            return self.text[key][pos]
+        if key == 'created_at':
+            return date.fromordinal(self.days[pos]).isoformat()
+        if key == 'created_time':
+            return _format_time(self.secs[pos])
+        return _MISSING
+
+    def keys_at(self, pos):
+        extra = self._extra.get(pos, {})
+        keys = [
+            key for key in _FIELDS
+            if (extra[key] if key in extra else self.field(pos, key)) is not _MISSING
+        ]
+        return keys + [key for key in extra if key not in _FIELDS]
+
+    def columns(self):
+        """Các cột số của hàng còn sống: {'id', 'goal_id', 'day', 'secs'} → array"""
+        if not self._dead:
+            return {'id': array('q', self.ids), 'goal_id': array('q', self.goal_ids),
+                    'day': array('i', self.days), 'secs': array('i', self.secs)}
+        live = [pos for pos, flag in enumerate(self.alive) if flag]
+        return {
+            'id': array('q', (self.ids[p] for p in live)),
+            'goal_id': array('q', (self.goal_ids[p] for p in live)),
+            'day': array('i', (self.days[p] for p in live)),
+            'secs': array('i', (self.secs[p] for p in live)),
+        }
+
+    def _compact(self):
+        """Bỏ hàng đã xóa, dựng lại mảng và bảng vị trí"""
+        live = [pos for pos, flag in enumerate(self.alive) if flag]
+        self.ids = array('q', (self.ids[p] for p in live))
+        self.goal_ids = array('q', (self.goal_ids[p] for p in live))
+        self.days = array('i', (self.days[p] for p in live))
+        self.secs = array('i', (self.secs[p] for p in live))
+        self.alive = array('b', [1]) * len(live)
+        self.text = {name: [values[p] for p in live] for name, values in self.text.items()}
+        self._extra = {new: self._extra[old] for new, old in enumerate(live) if old in self._extra}
+        self._pos = {task_id: pos for pos, task_id in enumerate(self.ids)}
+        self._dead = 0
+
+
+class RowView(Mapping):
+    """Một sub_task đọc từ ColumnStore, dùng được như dict (chỉ đọc)"""
+
+    __slots__ = ('_store', '_id')
+
+    def __init__(self, store, task_id):
+        self._store = store
+        self._id = task_id
+
+    def _pos(self):
+        pos = self._store._pos.get(self._id)
+        if pos is None:
+            raise KeyError(self._id)
+        return pos
+
+    def __getitem__(self, key):
+        value = self._store.field(self._pos(), key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return iter(self._store.keys_at(self._pos()))
+
+    def __len__(self):
+        return len(self._store.keys_at(self._pos()))
+
+    def __repr__(self):
+        return f"RowView({dict(self)!r})"
+
+
+def _format_time(secs):
+    return f"{secs // 3600:02d}:{secs // 60 % 60:02d}:{secs % 60:02d}"
@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+dataset.py - Dữ liệu trong bộ nhớ kèm index
+- id → goal, id → sub_task (dict giữ thứ tự chèn, tra cứu O(1))
+- goal_id → các sub_task của goal đó
+- Sequence id bền vững (không dùng lại id đã xóa)
+- Bucket theo ngày / tuần ISO / tháng cho truy vấn khoảng thời gian
+- created_at / created_time được parse một lần thành (ordinal ngày, giây trong ngày);
+  chuỗi ISO vẫn giữ nguyên trong record để ghi ra JSON
+- Bộ đếm tổng hợp (số goal theo trạng thái, số hoạt động theo goal trong từng tuần/tháng)
+- Thứ tự cho phân trang keyset: id goal tăng dần; mỗi goal một danh sách (khóa thời gian, id)
+  đã sắp xếp, dựng ở lần đầu cần đến rồi cập nhật tăng dần
+- sub_tasks nằm trong một "store": DictStore (dict/record, mặc định) hoặc
+  ColumnStore (mảng song song, xem columnar.py) khi bật chế độ tiết kiệm bộ nhớ
+Mọi index được cập nhật tăng dần theo từng thao tác, không build lại toàn bộ.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from calendar import monthrange
+from datetime import date
+from json_stream import iter_dict
+
+# Các thao tác ghi: op → (bảng, hành động)
+OPS = {
+    'add_goal': ('goals', 'upsert'),
+    'update_goal': ('goals', 'upsert'),
+    'delete_goal': ('goals', 'delete'),
+    'add_subtask': ('sub_tasks', 'upsert'),
+    'delete_subtask': ('sub_tasks', 'delete'),
+}
+
+
+class Dataset:
+    """Bản dữ liệu đã parse, thay cho dict {'goals': [...], 'sub_tasks': [...], ...}"""
+
+    def __init__(self, data, compact=False):
+        self._reset(compact)
+        self._load(iter_dict(data))
+
+    @classmethod
+    def from_stream(cls, items, compact=False):
+        """
+        Dựng Dataset từ luồng (bảng, record) của json_stream.iter_data,
+        từng record được đưa thẳng vào index, không giữ bản dict toàn bộ file
+        """
+        dataset = cls.__new__(cls)
+        dataset._reset(compact)
+        dataset._load(items)
+        return dataset
+
+    def _reset(self, compact):
+        self.compact = compact
+        self.goals = {}
+        # Bộ đếm: trạng thái → số goal; (tuần|tháng) → {goal_id: số hoạt động}
+        self.status_counts = {}
+        self.week_goals = {}
+        self.month_goals = {}
+        if compact:
+            from columnar import ColumnStore
+            self.sub_tasks = ColumnStore()
+        else:
+            self.sub_tasks = DictStore()
+        # Index chỉ giữ id (dict dùng như set có thứ tự), record lấy từ store
+        self.by_goal = {}
+        # Bucket thời gian: ordinal ngày / (năm ISO, tuần ISO) / (năm, tháng) → {id: None}
+        self.by_day = {}
+        self.by_week = {}
+        self.by_month = {}
+        self.progress_logs = []
+        self.extra = {}
+        # Phân trang keyset: [id goal] tăng dần; goal_id → [(khóa thời gian, id)] tăng dần
+        # None / thiếu key = chưa dựng (dựng khi có trang đầu tiên cần đến)
+        self._goal_order = None
+        self._task_order = {}
+
+    def _load(self, items):
+        """Nạp luồng (bảng, record); phần tử cuối (None, {key khác}) mang 'sequences' và key lạ"""
+        rest = self.merge(items)
+
+        # Các key khác trong file được giữ nguyên khi ghi lại
+        self.extra = {
+            k: v for k, v in rest.items()
+            if k not in ('goals', 'sub_tasks', 'progress_logs', 'sequences')
+        }
+
+        stored = rest.get('sequences') or {}
+        self.sequences = {
+            'goals': max(stored.get('goals', 0), max(self.goals, default=0)),
+            'sub_tasks': max(stored.get('sub_tasks', 0), self.sub_tasks.max_id()),
+        }
+
+    def merge(self, items):
+        """
+        Nạp thêm luồng (bảng, record) vào dữ liệu hiện có (id trùng = thay thế),
+        trả về phần (None, {key khác}) của luồng; extra / sequences không đổi
+        """
+        rest = {}
+        for table, record in items:
+            if table == 'goals':
+                self._upsert_goal(record)
+            elif table == 'sub_tasks':
+                if record['id'] in self.sub_tasks:
+                    self._remove_subtask(record['id'], keep_row=True)
+                self._insert_subtask(record)
+            elif table == 'progress_logs':
+                self.progress_logs.append(record)
+            elif table is None:
+                rest = record
+        return rest
+
+    # ---------- Chuyển đổi ----------
+
+    def to_dict(self, copy=False):
+        """Trả về dạng dict như file JSON (copy=True: copy từng record)"""
+        wrap = dict if copy else (lambda row: row)
+        data = dict(self.extra)
+        data['goals'] = [wrap(g) for g in self.goals.values()]
+        # Row view của ColumnStore luôn phải chuyển thành dict
+        data['sub_tasks'] = [dict(t) if copy or self.compact else t for t in self.sub_tasks.values()]
+        data['progress_logs'] = [wrap(p) for p in self.progress_logs]
+        data['sequences'] = dict(self.sequences)
+        return data
+
+    def items(self, with_records=True):
+        """
+        (key, giá trị) theo thứ tự của to_dict, các bảng là iterator record
+        (cho json_stream.encode_chunks ghi snapshot mà không dựng list/chuỗi lớn)
+        with_records=False: sub_tasks / progress_logs để rỗng (nằm trong file partition)
+        """
+        yield from self.extra.items()
+        yield 'goals', iter(self.goals.values())
+        if not with_records:
+            yield 'sub_tasks', iter(())
+            yield 'progress_logs', iter(())
+        else:
+            yield 'sub_tasks', (dict(t) for t in self.sub_tasks.values()) if self.compact else iter(self.sub_tasks.values())
+            yield 'progress_logs', iter(self.progress_logs)
+        yield 'sequences', dict(self.sequences)
+
+    def snapshot_items(self):
+        """
+        Như items() nhưng chụp lại ngay lúc gọi (chỉ copy tham chiếu / mảng số),
+        để stream ra ngoài lock mà vẫn nhất quán trong khi dữ liệu tiếp tục thay đổi
+        """
+        items = list(self.extra.items())
+        items.append(('goals', list(self.goals.values())))
+        items.append(('sub_tasks', self.sub_tasks.snapshot_rows()))
+        items.append(('progress_logs', list(self.progress_logs)))
+        items.append(('sequences', dict(self.sequences)))
+        return items
+
+    # ---------- Tra cứu ----------
+
+    def next_id(self, table):
+        """Cấp id mới cho bảng (tăng sequence ngay để request song song không trùng id)"""
+        self.sequences[table] += 1
+        return self.sequences[table]
+
+    def subtasks_of(self, goal_id, newest_first=False, start=None, end=None):
+        """
+        Các sub_task của một goal, theo thứ tự thêm vào
+        newest_first=True: sắp xếp theo (created_at, created_time) giảm dần bằng khóa số nguyên
+        start/end (date): chỉ lấy hoạt động có ngày trong [start, end], so sánh ordinal đã parse
+        """
+        ids = self.by_goal.get(goal_id, ())
+        if start is not None or end is not None:
+            low = start.toordinal() if start else 1
+            high = end.toordinal() if end else date.max.toordinal()
+            when = self.sub_tasks.when
+            ids = [i for i in ids if when(i) and low <= when(i)[0] <= high]
+        tasks = self._rows(ids)
+        if newest_first:
+            tasks.sort(key=self.sort_key, reverse=True)
+        return tasks
+
+    def sort_key(self, task):
+        """Khóa sắp xếp thời gian: ordinal * 86400 + giây (0 nếu ngày không hợp lệ)"""
+        return _order_key(self.sub_tasks.when(task['id']))
+
+    def goals_page(self, limit, after=None, before=None):
+        """Trang goal theo id tăng dần → (goals, cursor trang trước, cursor trang sau), xem keyset_page"""
+        if self._goal_order is None:
+            self._goal_order = sorted(self.goals)
+        ids, prev_key, next_key = keyset_page(self._goal_order, limit, after, before)
+        return [self.goals[goal_id] for goal_id in ids], prev_key, next_key
+
+    def subtasks_page(self, goal_id, limit, after=None, before=None, start=None, end=None, newest_first=True):
+        """
+        Trang sub_task của goal theo (created_at, created_time, id), mặc định mới nhất trước
+        → (sub_tasks, cursor trang trước, cursor trang sau); cursor là (khóa thời gian, id)
+        start/end (date): chỉ lấy hoạt động trong [start, end] (bisect trên cùng danh sách thứ tự)
+        Chỉ đọc `limit` record, không sắp xếp lại toàn bộ hoạt động của goal
+        """
+        order = self._task_order.get(goal_id)
+        if order is None:
+            when = self.sub_tasks.when
+            order = sorted((_order_key(when(i)), i) for i in self.by_goal.get(goal_id, ()))
+            self._task_order[goal_id] = order
+        low = bisect_left(order, (start.toordinal() * 86400, 0)) if start else 0
+        high = bisect_left(order, ((end.toordinal() + 1) * 86400, 0)) if end else len(order)
+        keys, prev_key, next_key = keyset_page(order, limit, after, before, newest_first, low, high)
+        return self._rows(task_id for _, task_id in keys), prev_key, next_key
+
+    def activity_summary(self, start, end=None):
+        """
+        Tóm tắt hoạt động trong [start, end] theo goal, không copy record:
+        [(goal_id, số hoạt động, ordinal ngày đầu, ordinal ngày cuối, goal_title của record)]
+        theo thứ tự goal xuất hiện lần đầu trong khoảng (như nhóm theo goal từ subtasks_between)
+        """
+        get, when = self.sub_tasks.get, self.sub_tasks.when
+        summary = {}
+        for bucket in self._buckets_between(start, end):
+            for task_id in bucket:
+                day = when(task_id)[0]
+                task = get(task_id)
+                entry = summary.get(task['goal_id'])
+                if entry is None:
+                    summary[task['goal_id']] = [1, day, day, task.get('goal_title')]
+                else:
+                    entry[0] += 1
+                    entry[1] = min(entry[1], day)
+                    entry[2] = max(entry[2], day)
+        return [(goal_id, *entry) for goal_id, entry in summary.items()]
+
+    def subtask_count(self, goal_id):
+        return len(self.by_goal.get(goal_id, ()))
+
+    def subtasks_between(self, start, end=None):
+        """
+        Sub_task có created_at trong [start, end] (date), end=None: không giới hạn trên
+        Chi phí tỉ lệ với số bucket + số kết quả, không quét toàn bộ dữ liệu
+        """
+        rows = []
+        for bucket in self._buckets_between(start, end):
+            rows.extend(self._rows(bucket))
+        return rows
+
+    def columns(self):
+        """Toàn bộ hoạt động dạng cột: {'id', 'goal_id', 'day', 'secs'} → array, cho phân tích hàng loạt"""
+        return self.sub_tasks.columns()
+
+    def _rows(self, ids):
+        get = self.sub_tasks.get
+        return [get(task_id) for task_id in ids]
+
+    def count_between(self, start, end=None):
+        """Số sub_task trong [start, end], chỉ cộng kích thước bucket"""
+        return sum(len(bucket) for bucket in self._buckets_between(start, end))
+
+    def _buckets_between(self, start, end):
+        if not self.by_month:
+            return
+        if end is None:
+            end = _month_end(*max(self.by_month))
+        # Không duyệt các tháng trước hoạt động sớm nhất (start có thể là date.min)
+        start = max(start, date(*min(self.by_month), 1))
+        if start > end:
+            return
+
+        # Đúng một tuần ISO (Thứ 2 - Chủ Nhật, như get_week_range) → 1 bucket
+        if start.weekday() == 0 and (end - start).days == 6:
+            bucket = self.by_week.get(tuple(start.isocalendar()[:2]))
+            if bucket:
+                yield bucket
+            return
+
+        # Tháng trọn vẹn dùng bucket tháng, phần lẻ đầu/cuối dùng bucket ngày
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            first, last = date(year, month, 1), _month_end(year, month)
+            if start <= first and last <= end:
+                bucket = self.by_month.get((year, month))
+                if bucket:
+                    yield bucket
+            else:
+                for ordinal in range(max(start, first).toordinal(), min(end, last).toordinal() + 1):
+                    bucket = self.by_day.get(ordinal)
+                    if bucket:
+                        yield bucket
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    # ---------- Thống kê (đọc bộ đếm, không quét dữ liệu) ----------
+
+    def dashboard_stats(self, today):
+        """Số goal theo trạng thái + số hoạt động tuần chứa `today`"""
+        return {
+            'total_goals': len(self.goals),
+            'active_goals': self.status_counts.get('active', 0),
+            'completed_goals': self.status_counts.get('completed', 0),
+            'week_subtasks': len(self.by_week.get(tuple(today.isocalendar()[:2]), ())),
+        }
+
+    def week_stats(self, today):
+        """Thống kê tuần ISO chứa `today`"""
+        key = tuple(today.isocalendar()[:2])
+        total = len(self.by_week.get(key, ()))
+        return {
+            'total_activities': total,
+            'active_goals': len(self.week_goals.get(key, ())),
+            'avg_per_day': round(total / 7, 1) if total else 0,
+        }
+
+    def month_stats(self, today):
+        """Thống kê tháng chứa `today`"""
+        key = (today.year, today.month)
+        goals = self.month_goals.get(key, {})
+        first = date(today.year, today.month, 1).toordinal()
+        last = _month_end(today.year, today.month).toordinal()
+        return {
+            'total_activities': len(self.by_month.get(key, ())),
+            'active_goals': len(goals),
+            # Goal đã hoàn thành và có hoạt động trong tháng
+            'completed_goals': sum(
+                1 for goal_id in goals
+                if self.goals.get(goal_id, {}).get('status') == 'completed'
+            ),
+            'days_active': sum(1 for ordinal in range(first, last + 1) if ordinal in self.by_day),
+        }
+
+    # ---------- Ghi ----------
+
+    def apply(self, op, payload):
+        """Áp dụng một thao tác (idempotent: add trùng id = thay thế, xóa id không tồn tại = bỏ qua)"""
+        table, action = OPS[op]
+        if table == 'goals':
+            if action == 'upsert':
+                self._upsert_goal(payload)
+                self.sequences['goals'] = max(self.sequences['goals'], payload['id'])
+            else:
+                old = self.goals.pop(payload['id'], None)
+                if old is not None:
+                    _count(self.status_counts, old.get('status'), -1)
+                    if self._goal_order is not None:
+                        del self._goal_order[bisect_left(self._goal_order, payload['id'])]
+                # Bỏ luôn thứ tự của goal thay vì gỡ từng phần tử
+                self._task_order.pop(payload['id'], None)
+                for task_id in list(self.by_goal.get(payload['id'], ())):
+                    self._remove_subtask(task_id)
+        else:
+            if action == 'upsert':
+                # Gỡ bản cũ (nếu có) khỏi index/bộ đếm, store thay thế tại chỗ
+                self._remove_subtask(payload['id'], keep_row=True)
+                self._insert_subtask(payload)
+                self.sequences['sub_tasks'] = max(self.sequences['sub_tasks'], payload['id'])
+            else:
+                self._remove_subtask(payload['id'])
+
+    def _upsert_goal(self, goal):
+        old = self.goals.get(goal['id'])
+        if old is not None:
+            _count(self.status_counts, old.get('status'), -1)
+        elif self._goal_order is not None:
+            insort(self._goal_order, goal['id'])
+        self.goals[goal['id']] = goal
+        _count(self.status_counts, goal.get('status'), 1)
+
+    def _insert_subtask(self, task):
+        task_id, goal_id = task['id'], task['goal_id']
+        day = parse_day(task.get('created_at'))
+        self.sub_tasks.insert(task, (day, parse_time(task.get('created_time'))) if day else None)
+        self.by_goal.setdefault(goal_id, {})[task_id] = None
+        order = self._task_order.get(goal_id)
+        if order is not None:
+            key = (_order_key(self.sub_tasks.when(task_id)), task_id)
+            if not order or key > order[-1]:
+                # Trường hợp thường gặp: hoạt động mới nhất → thêm vào cuối
+                order.append(key)
+            else:
+                # Chèn vào giữa (nạp kỳ cũ, sửa ngày) → dựng lại khi cần, tránh dời mảng nhiều lần
+                del self._task_order[goal_id]
+        for index, key in self._calendar_keys(day):
+            index.setdefault(key, {})[task_id] = None
+        self._count_period(goal_id, day, 1)
+
+    def _remove_subtask(self, task_id, keep_row=False):
+        if keep_row:
+            task = self.sub_tasks.get(task_id)
+            if task is None:
+                return
+            goal_id, when = task['goal_id'], self.sub_tasks.when(task_id)
+        else:
+            removed = self.sub_tasks.remove(task_id)
+            if removed is None:
+                return
+            goal_id, when = removed
+        _discard(self.by_goal, goal_id, task_id)
+        order = self._task_order.get(goal_id)
+        if order is not None:
+            i = bisect_left(order, (_order_key(when), task_id))
+            if i < len(order) and order[i][1] == task_id:
+                del order[i]
+        for index, key in self._calendar_keys(when[0] if when else None):
+            _discard(index, key, task_id)
+        self._count_period(goal_id, when[0] if when else None, -1)
+
+    def _count_period(self, goal_id, ordinal, delta):
+        """Cập nhật bộ đếm hoạt động theo goal của tuần và tháng chứa ngày `ordinal`"""
+        if not ordinal:
+            return
+        day = date.fromordinal(ordinal)
+        for counters, key in (
+            (self.week_goals, tuple(day.isocalendar()[:2])),
+            (self.month_goals, (day.year, day.month)),
+        ):
+            _count(counters.setdefault(key, {}), goal_id, delta)
+            if not counters[key]:
+                del counters[key]
+
+    def _calendar_keys(self, ordinal):
+        """Các (bucket index, key) ứng với ordinal ngày; rỗng nếu ngày không hợp lệ"""
+        if not ordinal:
+            return ()
+        day = date.fromordinal(ordinal)
+        return (
+            (self.by_day, ordinal),
+            (self.by_week, tuple(day.isocalendar()[:2])),
+            (self.by_month, (day.year, day.month)),
+        )
+
+
+def keyset_page(keys, limit, after=None, before=None, descending=False, low=0, high=None):
+    """
+    Phân trang keyset trên danh sách khóa đã sắp xếp tăng dần (bisect, không quét)
+    after: trang ngay sau khóa `after` theo thứ tự hiển thị; before: trang ngay trước khóa `before`
+    descending=True: hiển thị từ khóa lớn nhất; low/high: chỉ xét keys[low:high] (không copy)
+    → (khóa của trang theo thứ tự hiển thị, cursor trang trước, cursor trang sau); hết trang → None
+    """
+    first, last = low, len(keys) if high is None else high
+    if descending:
+        if after is not None:
+            high = bisect_left(keys, after, first, last)
+            low = max(first, high - limit)
+        elif before is not None:
+            low = bisect_right(keys, before, first, last)
+            high = min(last, low + limit)
+        else:
+            high = last
+            low = max(first, high - limit)
+        page = keys[low:high][::-1]
+        has_prev, has_next = high < last, low > first
+    else:
+        if after is not None:
+            low = bisect_right(keys, after, first, last)
+            high = min(last, low + limit)
+        elif before is not None:
+            high = bisect_left(keys, before, first, last)
+            low = max(first, high - limit)
+        else:
+            low = first
+            high = min(last, first + limit)
+        page = keys[low:high]
+        has_prev, has_next = low > first, high < last
+    return (
+        page,
+        page[0] if page and has_prev else None,
+        page[-1] if page and has_next else None,
+    )
+
+
+def _order_key(when):
+    """(ordinal ngày, giây) → số nguyên để sắp xếp, 0 nếu ngày không hợp lệ"""
+    return when[0] * 86400 + when[1] if when else 0
+
+
+def parse_day(value):
+    """'YYYY-MM-DD' → ordinal ngày (int), None nếu không hợp lệ"""
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_time(value):
+    """'HH:MM:SS' → số giây trong ngày (int), 0 nếu không hợp lệ"""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except (AttributeError, ValueError):
+        return 0
+
+
+class DictStore:
+    """Lưu sub_task dạng dict như trong file JSON (mặc định)"""
+
+    def __init__(self):
+        self.rows = {}
+        # id → (ordinal ngày, giây trong ngày), None nếu created_at không hợp lệ
+        self._when = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, task_id):
+        return task_id in self.rows
+
+    def get(self, task_id):
+        return self.rows.get(task_id)
+
+    def when(self, task_id):
+        return self._when.get(task_id)
+
+    def values(self):
+        return self.rows.values()
+
+    def max_id(self):
+        return max(self.rows, default=0)
+
+    def snapshot_rows(self):
+        """Bản chụp các record hiện tại (record không bị sửa tại chỗ nên chỉ cần copy tham chiếu)"""
+        return iter(list(self.rows.values()))
+
+    def insert(self, task, when):
+        """Thêm record; id đã có thì thay thế tại chỗ (giữ thứ tự)"""
+        self.rows[task['id']] = task
+        self._when[task['id']] = when
+
+    def remove(self, task_id):
+        """Xóa record, trả về (goal_id, when) hoặc None nếu không có"""
+        task = self.rows.pop(task_id, None)
+        if task is None:
+            return None
+        return task['goal_id'], self._when.pop(task_id, None)
+
+    def columns(self):
+        ids, goal_ids, days, secs = array('q'), array('q'), array('i'), array('i')
+        for task_id, task in self.rows.items():
+            when = self._when.get(task_id) or (0, 0)
+            ids.append(task_id)
+            goal_ids.append(task['goal_id'])
+            days.append(when[0])
+            secs.append(when[1])
+        return {'id': ids, 'goal_id': goal_ids, 'day': days, 'secs': secs}
+
+
+def _discard(index, key, task_id):
+    """Xóa task_id khỏi index[key], xóa luôn key nếu bucket rỗng"""
+    bucket = index.get(key)
+    if bucket is not None:
+        bucket.pop(task_id, None)
+        if not bucket:
+            del index[key]
+
+
+def _count(counter, key, delta):
+    """counter[key] += delta, xóa key khi về 0"""
+    value = counter.get(key, 0) + delta
+    if value > 0:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+def _month_end(year, month):
+    return date(year, month, monthrange(year, month)[1])
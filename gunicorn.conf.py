@@ -0,0 +1,23 @@
+"""
+gunicorn.conf.py - Chạy production nhiều worker
+    gunicorn -c gunicorn.conf.py app:app
+Mỗi worker có StorageManager riêng; các worker phối hợp qua khóa file + bộ đếm
+phiên bản chung (STORAGE_MULTIPROCESS, xem locking.py)
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', '2'))
+threads = int(os.getenv('WEB_THREADS', '4'))
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+
+# Không preload: app (storage, kết nối MongoDB, thread đồng bộ) được tạo trong từng worker sau fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+if workers > 1:
+    # Biến môi trường của master được worker kế thừa
+    os.environ.setdefault('STORAGE_MULTIPROCESS', 'true')
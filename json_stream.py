@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+json_stream.py - Đọc / ghi file dữ liệu JSON theo từng record
+- goals / sub_tasks / progress_logs được trả về từng phần tử một, không parse cả file vào bộ nhớ
+- Đọc file theo chunk, bộ nhớ chỉ tỉ lệ với record lớn nhất
+- Hỗ trợ file export ({'export_timestamp': ..., 'data': {...}}) lẫn file dữ liệu thường
+- Ghi: encode từng record, kết quả giống hệt json.dumps(data, ensure_ascii=False, indent=2)
+"""
+
+import gzip
+import hashlib
+import json
+from itertools import islice
+
+# Các key là danh sách record, được stream từng phần tử
+TABLES = ('goals', 'sub_tasks', 'progress_logs')
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+def iter_data(fp, chunk_size=CHUNK_SIZE):
+    """
+    Duyệt file dữ liệu: yield (tên bảng, record) cho từng record,
+    cuối cùng yield (None, {các key khác}) (ví dụ 'sequences')
+    File export được mở lớp 'data', các key metadata bên ngoài bị bỏ qua
+    """
+    reader = _Reader(fp, chunk_size)
+    if reader.peek() != '{':
+        raise ValueError("Data file must contain a JSON object")
+    reader.expect('{')
+
+    top, inner = {}, {}
+    seen_table = False
+    wrapped = False
+    for path, value, is_record in _members(reader, ()):
+        key = path[-1]
+        if len(path) == 2:
+            wrapped = True
+        elif key in TABLES:
+            seen_table = True
+        if is_record:
+            yield key, value
+        else:
+            (inner if len(path) == 2 else top)[key] = value
+
+    reader.expect_end()
+    yield None, (inner if wrapped and not seen_table else top)
+
+
+def iter_dict(data):
+    """Dict dạng file dữ liệu → cùng dạng luồng như iter_data"""
+    for table in TABLES:
+        for record in data.get(table) or []:
+            yield table, record
+    yield None, {k: v for k, v in data.items() if k not in TABLES}
+
+
+def encode_chunks(items, indent=2):
+    """
+    (key, giá trị) → các đoạn text JSON của cả object, giống json.dumps(..., indent=indent)
+    indent=None: dạng gọn không khoảng trắng (separators=(',', ':'))
+    Giá trị của bảng (TABLES) là iterable record, mỗi record được encode riêng
+    """
+    if indent is None:
+        nl = nl2 = ''
+        colon = ':'
+        encode = lambda value, _: json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    else:
+        nl, nl2 = '\n' + ' ' * indent, '\n' + ' ' * (2 * indent)
+        colon = ': '
+        encode = lambda value, newline: json.dumps(value, ensure_ascii=False, indent=indent).replace('\n', newline)
+    # Chuỗi JSON không chứa ký tự xuống dòng thật → thêm thụt lề cho mọi dòng là an toàn
+
+    first = True
+    for key, value in items:
+        yield ('{' if first else ',') + nl + json.dumps(key, ensure_ascii=False) + colon
+        first = False
+        if key in TABLES:
+            empty = True
+            for record in value:
+                yield ('[' if empty else ',') + nl2 + encode(record, nl2)
+                empty = False
+            yield '[]' if empty else nl + ']'
+        else:
+            yield encode(value, nl)
+    yield '{}' if first else nl[:1] + '}'
+
+
+def record_digest(record):
+    """Dấu nội dung ổn định giữa các process (hash() của Python bị random hóa)"""
+    raw = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def open_text(path):
+    """Mở file dữ liệu để đọc text, tự giải nén nếu là .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def batched(items, size):
+    """Chia iterable thành các list tối đa `size` phần tử"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _members(reader, path):
+    """Duyệt các cặp key/value của object vừa mở '{' → (path, value, is_record)"""
+    if reader.peek() == '}':
+        reader.expect('}')
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise ValueError("Object key must be a string")
+        reader.expect(':')
+        ch = reader.peek()
+        if key in TABLES and ch == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield path + (key,), reader.value(), True
+                    if reader.next_char(',]') == ']':
+                        break
+        elif key == 'data' and not path and ch == '{':
+            reader.expect('{')
+            yield from _members(reader, ('data',))
+        else:
+            yield path + (key,), reader.value(), False
+        if reader.next_char(',}') == '}':
+            return
+
+
+class _Reader:
+    """Bộ đệm trên file: đọc thêm chunk khi giá trị JSON chưa trọn vẹn"""
+
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        """Bỏ phần đã đọc, nối thêm ít nhất `size` ký tự từ file"""
+        chunk = self.fp.read(max(size or 0, self.chunk_size))
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        """Ký tự kế tiếp khác khoảng trắng ('' nếu hết file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos] if self.pos < len(self.buf) else ''
+            self._fill()
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"Expected {ch!r} at offset {self.pos}")
+        self.pos += 1
+
+    def next_char(self, allowed):
+        ch = self.peek()
+        if not ch or ch not in allowed:
+            raise ValueError(f"Expected one of {allowed!r} at offset {self.pos}")
+        self.pos += 1
+        return ch
+
+    def expect_end(self):
+        if self.peek():
+            raise ValueError(f"Extra data at offset {self.pos}")
+
+    def value(self):
+        """Parse một giá trị JSON hoàn chỉnh tại vị trí hiện tại"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                # Giá trị bị cắt ở cuối bộ đệm → đọc gấp đôi để tổng chi phí vẫn tuyến tính
+                self._fill(len(self.buf) - self.pos)
+                continue
+            if not self.eof and (
+                end == len(self.buf)
+                or (isinstance(value, (int, float)) and self.buf[end] in _NUMBER_CHARS)
+            ):
+                # Số bị cắt ở cuối bộ đệm ('12' của '12.5') → đọc thêm rồi parse lại
+                self._fill(len(self.buf) - self.pos)
+                continue
+            self.pos = end
+            return value
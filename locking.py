@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+locking.py - Đồng bộ giữa nhiều worker process (STORAGE_MULTIPROCESS=true, xem gunicorn.conf.py)
+- FileLock: fcntl.flock trên file .lock - shared khi đọc file dữ liệu, exclusive khi ghi
+- SharedCounter: số phiên bản 8 byte trong file, map vào bộ nhớ (mmap) ở mọi process;
+  writer tăng sau mỗi lần ghi, reader so sánh để biết cache đã cũ mà không cần syscall
+Cả hai tự mở lại sau fork (fd / mapping không dùng chung giữa process cha và con)
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+
+_COUNTER = struct.Struct('<Q')
+
+
+class FileLock:
+    """
+    flock giữa các process. Trong một process các lần acquire lồng nhau chỉ tăng bộ đếm
+    (caller tự tuần tự hóa giữa các thread, ví dụ giữ StorageManager._lock)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._depth = 0
+        self._exclusive = False
+
+    def _file(self):
+        if self._fd is None or self._pid != os.getpid():
+            # Sau fork: khóa của process cha không thuộc về process con
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+            self._depth = 0
+        return self._fd
+
+    def acquire(self, exclusive):
+        fd = self._file()
+        if self._depth:
+            if exclusive and not self._exclusive:
+                raise RuntimeError("Cannot upgrade a shared lock to exclusive")
+            self._depth += 1
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        self._exclusive = exclusive
+        self._depth = 1
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SharedCounter:
+    """Bộ đếm dùng chung qua file map vào bộ nhớ; chỉ tăng khi đang giữ FileLock exclusive"""
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._pid = None
+
+    def _mapping(self):
+        if self._map is None or self._pid != os.getpid():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < _COUNTER.size:
+                    os.ftruncate(fd, _COUNTER.size)
+                self._map = mmap.mmap(fd, _COUNTER.size)
+            finally:
+                os.close(fd)
+            self._pid = os.getpid()
+        return self._map
+
+    def value(self):
+        return _COUNTER.unpack_from(self._mapping())[0]
+
+    def increment(self):
+        mapping = self._mapping()
+        value = _COUNTER.unpack_from(mapping)[0] + 1
+        _COUNTER.pack_into(mapping, 0, value)
+        return value
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+mongo_client.py - Kết nối MongoDB lười, tự phục hồi, có circuit breaker
+- Không kết nối lúc khởi động: MongoClient được tạo ở lần dùng đầu tiên (import app.py không bị chặn)
+- Pool / timeout lấy từ cấu hình (MONGO_MAX_POOL_SIZE, MONGO_SOCKET_TIMEOUT_MS, ... trong app.py)
+- Circuit breaker: sau N lỗi kết nối liên tiếp thì "mở" → mọi thao tác bỏ qua Mongo ngay
+  (MongoUnavailable) thay vì chờ timeout; sau reset_timeout cho thử lại một lần (half-open)
+- Thread nền ping định kỳ: phát hiện Mongo sập / hồi phục, bỏ client cũ khi breaker mở
+  (lần thử sau tạo client mới), gọi on_recover khi Mongo hoạt động trở lại
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
+
+logger = logging.getLogger(__name__)
+
+# Lỗi mạng / chọn server (AutoReconnect, ServerSelectionTimeoutError, NetworkTimeout đều là ConnectionFailure)
+CONNECTION_ERRORS = (ConnectionFailure,)
+
+DEFAULT_CLIENT_OPTIONS = {
+    'maxPoolSize': 10,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    'serverSelectionTimeoutMS': 3000,
+    'connectTimeoutMS': 3000,
+    'socketTimeoutMS': 10000,
+}
+
+
+class MongoUnavailable(Exception):
+    """MongoDB đang không dùng được (breaker mở hoặc lỗi kết nối)"""
+
+
+class CircuitBreaker:
+    """closed → (failure_threshold lỗi liên tiếp) → open → (reset_timeout giây) → half_open → closed/open"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Cho phép một thao tác? Hết reset_timeout khi đang mở → cho đúng một lần thử (half_open)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self):
+        """True nếu thao tác lúc này chắc chắn bị từ chối (không tính là một lần thử)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return self._clock() - self.opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN
+
+    def record_success(self):
+        """Trả về True nếu breaker vừa đóng lại (Mongo hồi phục)"""
+        with self._lock:
+            recovered = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            return recovered
+
+    def record_failure(self):
+        """Trả về True nếu breaker vừa mở"""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+                self.trips += 1
+                return True
+            if self.state == self.OPEN:
+                self.opened_at = self._clock()
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
+
+
+class MongoConnection:
+    """MongoClient tạo lười + circuit breaker + thread ping nền"""
+
+    def __init__(self, uri, db_name, options=None, failure_threshold=3, reset_timeout=30.0,
+                 probe_interval=10.0, on_recover=None, client_factory=MongoClient):
+        self.uri = uri
+        self.db_name = db_name
+        self.options = {**DEFAULT_CLIENT_OPTIONS, **(options or {})}
+        self.probe_interval = probe_interval
+        self.on_recover = on_recover
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._client_factory = client_factory
+        self._lock = threading.Lock()
+        self._client = None
+        self._db = None
+        self._probe = None
+        self._stop = threading.Event()
+        self.connects = 0
+        self.last_error = None
+
+    @contextmanager
+    def use(self):
+        """
+        with conn.use() as db: ... - breaker mở → MongoUnavailable ngay, không chờ timeout
+        Lỗi kết nối trong khối with được ghi nhận và đổi thành MongoUnavailable
+        """
+        self._start_probe()
+        if not self.breaker.allow():
+            raise MongoUnavailable(f"MongoDB circuit open: {self.last_error}")
+        try:
+            yield self._database()
+        except CONNECTION_ERRORS as e:
+            self._failed(e)
+            raise MongoUnavailable(str(e)) from e
+        except BaseException:
+            # Server đã trả lời (lỗi thao tác / lỗi của caller) → kết nối vẫn tốt
+            self._succeeded()
+            raise
+        self._succeeded()
+
+    def available(self):
+        return not self.breaker.is_open()
+
+    def ping(self):
+        """Ping MongoDB (nếu breaker cho phép), True nếu thành công"""
+        if self.breaker.is_open():
+            return False
+        try:
+            with self.use() as db:
+                db.client.admin.command('ping')
+            return True
+        except MongoUnavailable:
+            return False
+
+    def _database(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory(self.uri, **self.options)
+                self._db = self._client[self.db_name]
+                self.connects += 1
+            return self._db
+
+    def _succeeded(self):
+        if self.breaker.record_success():
+            logger.info("✅ MongoDB is reachable again")
+            if self.on_recover:
+                self.on_recover()
+
+    def _failed(self, error):
+        self.last_error = str(error)
+        if self.breaker.record_failure():
+            logger.warning(f"⚠️  MongoDB circuit opened, skipping MongoDB for {self.breaker.reset_timeout:.0f}s: {error}")
+            # Bỏ client (pool có thể toàn kết nối chết); lần thử sau tạo client mới
+            with self._lock:
+                client, self._client, self._db = self._client, None, None
+            if client is not None:
+                client.close()
+
+    def _start_probe(self):
+        if self._probe is not None or not self.probe_interval:
+            return
+        with self._lock:
+            if self._probe is None:
+                self._probe = threading.Thread(target=self._probe_loop, name='mongo-probe', daemon=True)
+                self._probe.start()
+
+    def _probe_loop(self):
+        while not self._stop.wait(self.probe_interval):
+            # Breaker đang mở và chưa hết reset_timeout → bỏ qua, không tốn kết nối
+            self.ping()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            client, self._client, self._db = self._client, None, None
+        if client is not None:
+            client.close()
+
+    def stats(self):
+        return {
+            **self.breaker.stats(),
+            'connected': self._client is not None,
+            'connects': self.connects,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+mongo_sync.py - Đồng bộ MongoDB chạy nền
+- Request chỉ đẩy một "tín hiệu có thay đổi" vào hàng đợi giới hạn, không chờ Mongo
+- Worker gộp các tín hiệu đang chờ, chỉ đẩy snapshot mới nhất
+- Thử lại với backoff tăng dần khi Mongo lỗi
+- Layout chuẩn hóa (MONGO_LAYOUT=normalized): mỗi record một document, đồng bộ tăng dần
+- Có STORAGE_PARTITION: sub_tasks / progress_logs nằm trong collection theo kỳ (sub_tasks_2026_10, ...)
+"""
+
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+from pymongo import ReplaceOne, DeleteOne
+from json_stream import record_digest
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MongoSyncWorker:
+    """Thread nền đẩy snapshot dữ liệu lên MongoDB"""
+
+    def __init__(self, snapshot_fn, push_fn, max_queue=100, base_delay=1.0, max_delay=60.0):
+        """
+        snapshot_fn(): trả về bản dữ liệu hiện tại (được gọi trong worker, ngay trước khi đẩy)
+        push_fn(data): ghi dữ liệu lên MongoDB, raise nếu lỗi
+        """
+        self.snapshot_fn = snapshot_fn
+        self.push_fn = push_fn
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        # Đánh thức worker đang chờ backoff (MongoDB vừa hồi phục, xem retry_now)
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stats_lock = threading.Lock()
+
+        self._oldest_pending = None
+        self._inflight_since = None
+        self.last_success = None
+        self.last_error = None
+        self.pushed = 0
+        self.coalesced = 0
+        self.failures = 0
+
+        self._thread = threading.Thread(target=self._run, name='mongo-sync', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, version):
+        """Báo có thay đổi (không block). Hàng đợi đầy thì bỏ tín hiệu cũ nhất vì đằng nào cũng bị gộp"""
+        now = time.time()
+        with self._stats_lock:
+            if self._oldest_pending is None:
+                self._oldest_pending = now
+            self._idle.clear()
+        while True:
+            try:
+                self._queue.put_nowait((version, now))
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    with self._stats_lock:
+                        self.coalesced += 1
+                except queue.Empty:
+                    pass
+
+    def _drain(self):
+        """Lấy hết tín hiệu đang chờ, trả về tín hiệu mới nhất"""
+        latest = self._queue.get()
+        while True:
+            try:
+                latest = self._queue.get_nowait()
+                with self._stats_lock:
+                    self.coalesced += 1
+            except queue.Empty:
+                return latest
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                version, _ = self._drain()
+            except Exception:
+                continue
+            if version is None:
+                # Tín hiệu dừng
+                break
+
+            delay = self.base_delay
+            while not self._stop.is_set():
+                with self._stats_lock:
+                    # Mốc thời gian của thay đổi cũ nhất nằm trong lần đẩy này
+                    if self._inflight_since is None:
+                        self._inflight_since = self._oldest_pending
+                    self._oldest_pending = None
+                try:
+                    self.push_fn(self.snapshot_fn())
+                    with self._stats_lock:
+                        self.last_success = time.time()
+                        self.pushed += 1
+                        self.last_error = None
+                        self._inflight_since = None
+                    break
+                except Exception as e:
+                    with self._stats_lock:
+                        self.failures += 1
+                        self.last_error = str(e)
+                    logger.warning(f"⚠️  MongoDB backup failed, retry in {delay:.1f}s: {e}")
+                    self._wake.wait(delay)
+                    self._wake.clear()
+                    delay = min(delay * 2, self.max_delay)
+
+            with self._stats_lock:
+                if self._queue.empty() and self._oldest_pending is None and self._inflight_since is None:
+                    self._idle.set()
+
+    def retry_now(self):
+        """Bỏ qua thời gian backoff còn lại, thử đẩy lại ngay"""
+        self._wake.set()
+
+    def stats(self):
+        """
+        Độ sâu hàng đợi, độ trễ (giây) của thay đổi cũ nhất chưa đẩy, lần đẩy thành công gần nhất
+        status: 'synced' (không còn gì chờ đẩy) | 'pending' | 'error' (lần đẩy gần nhất lỗi, đang chờ thử lại)
+        """
+        with self._stats_lock:
+            oldest = self._inflight_since or self._oldest_pending
+            if self.last_error:
+                status = 'error'
+            else:
+                status = 'synced' if self._idle.is_set() else 'pending'
+            return {
+                'status': status,
+                'queue_depth': self._queue.qsize(),
+                'lag_seconds': round(time.time() - oldest, 3) if oldest else 0,
+                'last_success': (
+                    time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.last_success))
+                    if self.last_success else None
+                ),
+                'last_error': self.last_error,
+                'pushed': self.pushed,
+                'coalesced': self.coalesced,
+                'failures': self.failures,
+            }
+
+    def flush(self, timeout=None):
+        """Chờ đến khi mọi thay đổi đã được đẩy (True) hoặc hết timeout (False)"""
+        return self._idle.wait(timeout)
+
+    def stop(self, timeout=5):
+        """Dừng worker, cố đẩy nốt thay đổi cuối trong thời gian timeout"""
+        self.flush(timeout)
+        self._stop.set()
+        self._wake.set()
+        try:
+            self._queue.put_nowait((None, time.time()))
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+
+class NormalizedMongoMirror:
+    """
+    Layout chuẩn hóa trên MongoDB: mỗi goal / sub_task / progress_log là một document riêng
+    (tránh giới hạn 16MB của một document). Mỗi lần đồng bộ chỉ gửi record thay đổi qua bulk_write.
+    """
+
+    COLLECTIONS = ('goals', 'sub_tasks', 'progress_logs')
+    PARTITIONED = ('sub_tasks', 'progress_logs')
+
+    def __init__(self, db, batch_size=1000, partition_fn=None):
+        """partition_fn(record) → kỳ ('2026-10', '2026', 'undated'); None = không chia collection"""
+        self.db = db
+        self.batch_size = batch_size
+        self.partition_fn = partition_fn
+        self.meta = db['sync_meta']
+        # collection → {_id: digest} của những gì đang có trên Mongo
+        self._synced = None
+        self._indexed = set()
+
+        for name in self.PARTITIONED:
+            self._ensure_indexes(name)
+
+    def _ensure_indexes(self, collection):
+        if collection in self._indexed:
+            return
+        if collection.startswith('sub_tasks'):
+            self.db[collection].create_index('goal_id')
+        self.db[collection].create_index('created_at')
+        self._indexed.add(collection)
+
+    def _collection(self, name, record):
+        if self.partition_fn is None or name not in self.PARTITIONED:
+            return name
+        return f"{name}_{self.partition_fn(record).replace('-', '_')}"
+
+    def _collections_of(self, name):
+        """Collection của một bảng đang có trên Mongo: collection gốc + các collection theo kỳ (theo thứ tự thời gian)"""
+        if name not in self.PARTITIONED:
+            return [name]
+        prefix = name + '_'
+        return [name] + sorted(c for c in self.db.list_collection_names() if c.startswith(prefix))
+
+    def _prime(self):
+        """Đọc digest hiện có trên Mongo (lần đầu) để không phải gửi lại toàn bộ sau khi restart"""
+        self._synced = {}
+        for name in self.COLLECTIONS:
+            for collection in self._collections_of(name):
+                cursor = self.db[collection].find({}, {'_h': 1}).batch_size(self.batch_size)
+                self._synced[collection] = {doc['_id']: doc.get('_h') for doc in cursor}
+
+    def push(self, data, partitions=None):
+        """
+        Đồng bộ dữ liệu: upsert record mới/đổi, xóa record không còn tồn tại
+        partitions: tập kỳ có trong `data` (các kỳ khác chưa nạp, giữ nguyên trên Mongo); None = data là toàn bộ
+        """
+        if self._synced is None:
+            self._prime()
+        skip = set()
+        if partitions is not None and self.partition_fn is not None:
+            # Collection của kỳ chưa nạp giữ nguyên. Collection gốc (trước khi chia) không được so với
+            # `data` (chỉ có các kỳ đã nạp): record của nó được chuyển sang collection theo kỳ trước
+            loaded = {f"{name}_{key.replace('-', '_')}" for name in self.PARTITIONED for key in partitions}
+            for name in self.PARTITIONED:
+                if self._synced.get(name):
+                    self._split_base(name, loaded)
+            prefixes = tuple(name + '_' for name in self.PARTITIONED)
+            skip = {c for c in self._synced if c.startswith(prefixes) and c not in loaded}
+            skip.update(self.PARTITIONED)
+
+        total_upserts = total_deletes = 0
+        for name in self.COLLECTIONS:
+            groups = {}
+            for record in data.get(name, []):
+                groups.setdefault(self._collection(name, record), []).append(record)
+            targets = set(groups)
+            targets.update(c for c in self._synced if c not in skip and (c == name or c.startswith(name + '_')))
+
+            for collection in sorted(targets):
+                synced = self._synced.get(collection, {})
+                current = {}
+                ops = []
+                for position, record in enumerate(groups.get(collection, [])):
+                    # progress_logs không có id → dùng vị trí
+                    doc_id = record['id'] if name != 'progress_logs' and 'id' in record else position
+                    digest = record_digest(record)
+                    current[doc_id] = digest
+                    if synced.get(doc_id) != digest:
+                        ops.append(ReplaceOne({'_id': doc_id}, {**record, '_id': doc_id, '_h': digest}, upsert=True))
+                removed = [doc_id for doc_id in synced if doc_id not in current]
+                ops.extend(DeleteOne({'_id': doc_id}) for doc_id in removed)
+
+                if ops and name in self.PARTITIONED:
+                    self._ensure_indexes(collection)
+                for i in range(0, len(ops), self.batch_size):
+                    self.db[collection].bulk_write(ops[i:i + self.batch_size], ordered=False)
+                # Chỉ cập nhật trạng thái sau khi mọi batch thành công (lỗi → lần sau gửi lại)
+                self._synced[collection] = current
+                total_upserts += len(ops) - len(removed)
+                total_deletes += len(removed)
+
+        meta = {'_id': 'sync', '_backup_timestamp': datetime.now().isoformat(), '_backup_source': 'auto_sync'}
+        if data.get('sequences'):
+            # Sequence id không suy ra được từ record (id lớn nhất có thể đã bị xóa)
+            meta['sequences'] = dict(data['sequences'])
+        self.meta.replace_one({'_id': 'sync'}, meta, upsert=True)
+        logger.info(f"🔄 Synced to MongoDB: {total_upserts} upserts, {total_deletes} deletes")
+
+    def _split_base(self, name, loaded):
+        """
+        Chuyển record trong collection gốc (đồng bộ trước khi bật STORAGE_PARTITION) sang collection
+        theo kỳ rồi mới xóa khỏi collection gốc: kỳ chưa nạp nhận bản copy (không mất lịch sử cũ),
+        kỳ đã nạp thì `data` là bản đúng nên chỉ cần xóa
+        """
+        moves, digests, next_log = {}, {}, {}
+        cursor = self.db[name].find({}).sort('_id', 1).batch_size(self.batch_size)
+        for doc in cursor:
+            collection = self._collection(name, doc)
+            if collection in loaded:
+                continue
+            if name == 'progress_logs':
+                # _id là vị trí trong collection → nối vào cuối collection của kỳ
+                if collection not in next_log:
+                    synced = self._synced.get(collection, {})
+                    next_log[collection] = max((i for i in synced if isinstance(i, int)), default=-1) + 1
+                doc_id = next_log[collection]
+                next_log[collection] += 1
+            else:
+                doc_id = doc['_id']
+            record = {k: v for k, v in doc.items() if k not in ('_id', '_h')}
+            digest = record_digest(record)
+            moves.setdefault(collection, []).append(
+                ReplaceOne({'_id': doc_id}, {**record, '_id': doc_id, '_h': digest}, upsert=True)
+            )
+            digests.setdefault(collection, {})[doc_id] = digest
+
+        for collection, ops in moves.items():
+            self._ensure_indexes(collection)
+            for i in range(0, len(ops), self.batch_size):
+                self.db[collection].bulk_write(ops[i:i + self.batch_size], ordered=False)
+            self._synced.setdefault(collection, {}).update(digests[collection])
+        # Chỉ xóa sau khi mọi bản copy đã ghi xong
+        self.db[name].delete_many({})
+        self._synced[name] = {}
+        moved = sum(len(ops) for ops in moves.values())
+        logger.info(f"🗂️  Moved {moved} {name} records from MongoDB collection '{name}' into period collections")
+
+    def restore(self):
+        """Dựng lại dữ liệu từ các collection, đọc theo batch"""
+        data = {name: [] for name in self.COLLECTIONS}
+        for name, record in self.iter_records():
+            if name is not None:
+                data[name].append(record)
+            else:
+                data.update(record)
+        return data
+
+    def iter_records(self):
+        """Luồng (collection, record) như json_stream.iter_data, cursor đọc từng batch_size document"""
+        for name in self.COLLECTIONS:
+            for collection in self._collections_of(name):
+                cursor = self.db[collection].find({}).sort('_id', 1).batch_size(self.batch_size)
+                for doc in cursor:
+                    doc.pop('_id', None)
+                    doc.pop('_h', None)
+                    yield name, doc
+        meta = self.meta.find_one({'_id': 'sync'}) or {}
+        yield None, {'sequences': meta['sequences']} if meta.get('sequences') else {}
+
+    def has_backup(self):
+        return self.meta.find_one({'_id': 'sync'}) is not None
+
+    def last_backup(self):
+        meta = self.meta.find_one({'_id': 'sync'})
+        return meta.get('_backup_timestamp') if meta else None
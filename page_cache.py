@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+page_cache.py - Cache HTML đã render trong bộ nhớ (mỗi worker process một cache)
+- Trang: khóa gồm phiên bản dữ liệu + template + tham số URL (số trang) + ngày (xem app.page_key)
+  → dữ liệu đổi là khóa đổi, không cần xóa cache; bản cũ tự bị đẩy ra theo LRU
+- Fragment (thẻ goal trên index.html / goals.html): khóa theo nội dung record,
+  goal không đổi thì dùng lại HTML dù dữ liệu khác đã thay đổi
+- Giới hạn theo số mục và tổng kích thước, đếm hit / miss / eviction
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """LRU giới hạn số mục + tổng kích thước (len của giá trị); max_entries=0 → tắt"""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Giá trị đã cache (đánh dấu vừa dùng) hoặc None"""
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        if not self.max_entries or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = value
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        """Giá trị cache, hoặc render() rồi lưu lại"""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+partitions.py - Chia sub_tasks / progress_logs theo kỳ (STORAGE_PARTITION=month|year)
+- Mỗi kỳ một file <tên file dữ liệu>_partitions/<kỳ>.json ({'sub_tasks': [...], 'progress_logs': [...]})
+  kỳ là 'YYYY-MM' hoặc 'YYYY'; record có created_at không hợp lệ nằm trong kỳ 'undated'
+- goals, sequences và các key khác vẫn nằm trong file dữ liệu chính
+- manifest.json: mỗi kỳ → số record, số hoạt động theo goal, khoảng id, dấu file
+  → đếm theo goal / tìm kỳ chứa một id mà không phải đọc file của kỳ đó
+- Kỳ gần đây (HOT_DAYS ngày trở lại) và 'undated' được nạp ngay, kỳ cũ chỉ nạp khi truy vấn cần
+- Ghi: chỉ ghi lại file của các kỳ có thay đổi
+"""
+
+import json
+import logging
+import os
+import re
+from calendar import monthrange
+from datetime import date, timedelta
+from dataset import parse_day
+from json_stream import iter_data
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('month', 'year')
+UNDATED = 'undated'
+MANIFEST = 'manifest.json'
+
+# Kỳ chứa ngày (hôm nay - HOT_DAYS) trở về sau được nạp khi khởi động (đủ cho thống kê tuần/tháng)
+HOT_DAYS = 31
+
+_KEY_PATTERNS = {'month': re.compile(r'^\d{4}-\d{2}$'), 'year': re.compile(r'^\d{4}$')}
+
+
+def partition_key(record, granularity):
+    """Kỳ của record theo created_at: 'YYYY-MM' / 'YYYY', 'undated' nếu ngày không hợp lệ"""
+    ordinal = parse_day(record.get('created_at'))
+    if not ordinal:
+        return UNDATED
+    return _key_for_day(date.fromordinal(ordinal), granularity)
+
+
+def _key_for_day(day, granularity):
+    if granularity == 'year':
+        return f'{day.year:04d}'
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+def _stamp(path):
+    """[mtime_ns, size] của file, None nếu không có (so với 'stamp' trong manifest)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+class PartitionStore:
+    """Thư mục partition + manifest; biết kỳ nào đã nạp vào Dataset và kỳ nào cần ghi lại"""
+
+    def __init__(self, directory, granularity='month'):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.directory = directory
+        self.granularity = granularity
+        self.manifest_file = os.path.join(directory, MANIFEST)
+        # kỳ → {'sub_tasks', 'progress_logs', 'goals': {goal_id: số}, 'min_id', 'max_id', 'stamp'}
+        self.entries = {}
+        self.loaded = set()
+        self.dirty = set()
+        # Manifest được ghi với cách chia khác → phải chia lại toàn bộ
+        self.regranulate = False
+
+    def key_of(self, record):
+        return partition_key(record, self.granularity)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def exists(self):
+        return os.path.exists(self.manifest_file)
+
+    def reset(self):
+        """
+        Đọc lại manifest, chưa kỳ nào được nạp. Trả về các kỳ có file không khớp manifest
+        (crash giữa lúc ghi file kỳ và manifest) → cần nạp để thông tin được tính lại
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = {}
+        if self.exists():
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        self.entries = manifest.get('partitions', {})
+        self.regranulate = bool(self.entries) and manifest.get('granularity') != self.granularity
+        self.loaded, self.dirty = set(), set()
+
+        stale = []
+        for key, entry in list(self.entries.items()):
+            stamp = _stamp(self.path(key))
+            if stamp is None:
+                logger.warning(f"⚠️  Partition file missing: {self.path(key)}")
+                del self.entries[key]
+            elif stamp != entry.get('stamp'):
+                stale.append(key)
+        for name in os.listdir(self.directory):
+            key, ext = os.path.splitext(name)
+            # Bỏ qua manifest và file tạm (.xxx.tmp)
+            if ext == '.json' and name != MANIFEST and not name.startswith('.') and key not in self.entries:
+                self.entries[key] = {}
+                stale.append(key)
+        return stale
+
+    def hot_keys(self, today):
+        """Kỳ từ (today - HOT_DAYS) trở đi, cộng 'undated'"""
+        boundary = _key_for_day(today - timedelta(days=HOT_DAYS), self.granularity)
+        return [key for key in self.entries if key == UNDATED or key >= boundary]
+
+    def select(self, start=None, end=None, goal_id=None, task_id=None):
+        """
+        Các kỳ chưa nạp có thể chứa hoạt động thỏa mọi điều kiện:
+        ngày trong [start, end] (date, None = không giới hạn), thuộc goal_id, có id task_id
+        Không điều kiện nào → mọi kỳ chưa nạp
+        """
+        keys = [key for key in self.entries if key not in self.loaded]
+        if start is not None or end is not None:
+            low = _key_for_day(start, self.granularity) if start else ''
+            high = _key_for_day(end, self.granularity) if end else None
+            keys = [k for k in keys if k != UNDATED and low <= k and (high is None or k <= high)]
+        if goal_id is not None:
+            keys = [k for k in keys if str(goal_id) in self.entries[k].get('goals', {})]
+        if task_id is not None:
+            keys = [
+                k for k in keys
+                if self.entries[k].get('min_id', 0) <= task_id <= self.entries[k].get('max_id', 0)
+            ]
+        return keys
+
+    def newest_first(self, keys):
+        """Sắp các kỳ từ mới đến cũ, 'undated' cuối cùng (khóa thời gian nhỏ nhất)"""
+        return sorted(keys, key=lambda k: (k != UNDATED, k), reverse=True)
+
+    def period_end(self, key):
+        """Ngày cuối của kỳ, None với 'undated'"""
+        if key == UNDATED:
+            return None
+        year = int(key[:4])
+        if self.granularity == 'year' or len(key) == 4:
+            return date(year, 12, 31)
+        month = int(key[5:7])
+        return date(year, month, monthrange(year, month)[1])
+
+    def read(self, key):
+        """Luồng (bảng, record) của một kỳ, đọc từng record"""
+        with open(self.path(key), 'r', encoding='utf-8') as f:
+            for table, record in iter_data(f):
+                if table is not None:
+                    yield table, record
+
+    def unloaded_counts(self):
+        """goal_id → số hoạt động nằm trong các kỳ chưa nạp (theo manifest)"""
+        counts = {}
+        for key, entry in self.entries.items():
+            if key in self.loaded:
+                continue
+            for goal_id, count in entry.get('goals', {}).items():
+                goal_id = int(goal_id)
+                counts[goal_id] = counts.get(goal_id, 0) + count
+        return counts
+
+    def max_id(self):
+        return max((entry.get('max_id', 0) for entry in self.entries.values()), default=0)
+
+    def adopt(self, dataset):
+        """Dataset chứa toàn bộ dữ liệu (vừa thay mới / vừa chia lại) → mọi kỳ coi như đã nạp và cần ghi lại"""
+        keys = set(self.entries) | {UNDATED}
+        keys.update(_key_for_day(date(year, month, 1), self.granularity) for year, month in dataset.by_month)
+        keys.update(self.key_of(log) for log in dataset.progress_logs)
+        self.loaded = set(keys)
+        self.dirty = set(keys)
+        self.regranulate = False
+
+    def records(self, dataset, key):
+        """(sub_tasks, progress_logs) của kỳ `key` trong dataset; kỳ không đúng cách chia hiện tại → rỗng"""
+        if key == UNDATED:
+            when = dataset.sub_tasks.when
+            rows = [t for t in dataset.sub_tasks.values() if when(t['id']) is None]
+        elif _KEY_PATTERNS[self.granularity].match(key):
+            year = int(key[:4])
+            months = [(year, int(key[5:]))] if self.granularity == 'month' else [(year, m) for m in range(1, 13)]
+            get = dataset.sub_tasks.get
+            rows = [get(task_id) for month in months for task_id in dataset.by_month.get(month, ())]
+        else:
+            rows = []
+        logs = [log for log in dataset.progress_logs if self.key_of(log) == key]
+        return [dict(t) for t in rows], logs
+
+    def describe(self, rows, logs, path):
+        """Mục manifest cho một kỳ vừa ghi ra file `path`"""
+        goals = {}
+        for task in rows:
+            goal_id = str(task['goal_id'])
+            goals[goal_id] = goals.get(goal_id, 0) + 1
+        ids = [task['id'] for task in rows]
+        return {
+            'sub_tasks': len(rows),
+            'progress_logs': len(logs),
+            'goals': goals,
+            'min_id': min(ids, default=0),
+            'max_id': max(ids, default=0),
+            'stamp': _stamp(path),
+        }
+
+    def manifest_text(self):
+        return json.dumps(
+            {'granularity': self.granularity, 'partitions': dict(sorted(self.entries.items()))},
+            ensure_ascii=False, indent=2
+        )
+
+    def info(self):
+        return {
+            'granularity': self.granularity,
+            'partitions': len(self.entries),
+            'loaded_partitions': len(self.loaded & set(self.entries)),
+        }
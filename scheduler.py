@@ -30,7 +30,8 @@ def send_weekly_report():
         logger.info("📅 Đang gửi báo cáo tuần...")
         response = requests.post(f"{API_URL}/api/send-weekly-reminder", timeout=30)
         
-        if response.status_code == 200:
+        # 202: đã vào outbox của app, app tự gửi nền và thử lại khi Telegram lỗi
+        if response.status_code in (200, 202):
             result = response.json()
             logger.info("✅ Báo cáo tuần: " + result.get('message', 'OK'))
         else:
@@ -46,14 +47,14 @@ def send_monthly_report_with_backup():
         
         # 1. Báo cáo tháng
         response = requests.post(f"{API_URL}/api/send-monthly-review", timeout=30)
-        if response.status_code == 200:
+        if response.status_code in (200, 202):
             result = response.json()
             logger.info("✅ Báo cáo tháng: " + result.get('message', 'OK'))
         
         # 2. Backup JSON
         logger.info("💾 Đang gửi backup JSON...")
         backup_response = requests.post(f"{API_URL}/api/send-monthly-backup", timeout=30)
-        if backup_response.status_code == 200:
+        if backup_response.status_code in (200, 202):
             backup_result = backup_response.json()
             logger.info("✅ Backup: " + backup_result.get('message', 'OK'))
         
@@ -4,107 +4,1281 @@ storage.py - Dual Storage Manager (JSON + MongoDB)
 Tự động sync giữa JSON và MongoDB
 """
 
+import atexit
 import json
 import os
-from datetime import datetime
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import random
+import tempfile
+import threading
+import time
+from calendar import monthrange
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from mongo_client import MongoConnection, MongoUnavailable
+from mongo_sync import MongoSyncWorker, NormalizedMongoMirror
+from dataset import Dataset, OPS
+from json_stream import encode_chunks, iter_data, iter_dict, open_text
+from partitions import PartitionStore, partition_key
+from locking import FileLock, SharedCounter
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Các thao tác ghi vào journal: op → (bảng, hành động)
+JOURNAL_OPS = OPS
+
+# Số record mỗi batch khi import/restore dạng stream
+STREAM_BATCH_SIZE = 1000
+
+# update_data: số lần chạy lại khi xung đột (compare-and-swap thất bại)
+OCC_MAX_RETRIES = 3
+
+
+class ConflictError(Exception):
+    """Dữ liệu đã bị thay đổi kể từ lúc đọc (version không còn khớp)"""
+
+
+class BatchError(ValueError):
+    """Batch bị từ chối, không thay đổi nào được áp dụng; errors = [{'index', 'message'}]"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid item(s) in batch")
+        self.errors = errors
+
+
+class _CommitBatch:
+    """Một nhóm thay đổi được ghi xuống đĩa chung một lần"""
+    
+    def __init__(self):
+        self.lines = []
+        self.snapshot = False
+        self.done = False
+        self.error = None
+
+
+def _atomic_write(path, text):
+    """Ghi file qua file tạm cùng thư mục, fsync rồi os.replace (atomic trên POSIX)"""
+    _commit_temp(_write_temp(path, [text]), path)
+
+
+def _write_temp(path, chunks):
+    """Ghi lần lượt các đoạn text vào file tạm cạnh `path` (chưa fsync), trả về đường dẫn file tạm"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except BaseException:
+        _unlink_quietly(tmp_path)
+        raise
+    return tmp_path
+
+
+def _commit_temp(tmp_path, path):
+    """fsync file tạm rồi os.replace thành `path`"""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        # mkstemp tạo file 0600 → giữ quyền của file cũ (hoặc 0644)
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _unlink_quietly(tmp_path)
+        raise
+    
+    # fsync thư mục để việc rename cũng bền vững
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _as_date(value):
+    """date/datetime/chuỗi 'YYYY-MM-DD' → date"""
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _encode_cursor(key):
+    """Cursor phân trang → chuỗi cho URL: id goal hoặc '<khóa thời gian>_<id>'; None giữ nguyên"""
+    if key is None:
+        return None
+    return '_'.join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+
+
+def _decode_cursor(value, parts=1):
+    """Chuỗi cursor từ URL → id (parts=1) / tuple số; rỗng hoặc sai định dạng → None (trang đầu)"""
+    if not value:
+        return None
+    try:
+        numbers = tuple(int(part) for part in value.split('_'))
+    except ValueError:
+        return None
+    if len(numbers) != parts:
+        return None
+    return numbers[0] if parts == 1 else numbers
+
+
+def _cursor_day(key):
+    """Ngày của cursor hoạt động (khóa thời gian, id), None nếu hoạt động không có ngày hợp lệ"""
+    return date.fromordinal(key[0] // 86400) if key[0] else None
+
 
 class StorageManager:
     """Quản lý lưu trữ với JSON (primary) và MongoDB (backup)"""
     
-    def __init__(self, json_file='data/goals_data.json', mongo_uri=None):
+    def __init__(self, json_file='data/goals_data.json', mongo_uri=None,
+                 journal=False, compact_every=1000, group_commit_ms=0, sqlite_path=None,
+                 mongo_layout='document', compact_memory=False, partition=None,
+                 mongo_db='goal_tracker_2026', multiprocess=False, occ_max_retries=OCC_MAX_RETRIES,
+                 mongo_options=None, mongo_breaker=None):
         self.json_file = json_file
         self.mongo_uri = mongo_uri
+        self.mongo_layout = mongo_layout
+        self.mongo_db = mongo_db
         self.mongo_enabled = False
-        self.db = None
-        self.collection = None
+        self._mongo = None
+        self._mongo_sync = None
+        self._mongo_mirror = None
+        self._mongo_mirror_lock = threading.Lock()
+        
+        # Cache trong bộ nhớ: bản dữ liệu đã parse + dấu file (mtime, size, inode)
+        self._lock = threading.RLock()
+        self._cache = None
+        self._cache_stamp = None
+        self.data_version = 0
+        # Lưu sub_task dạng cột (columnar.py) thay vì dict mỗi record
+        self.compact_memory = compact_memory
+        self.stream_batch_size = STREAM_BATCH_SIZE
+        
+        # Optimistic concurrency (load_versioned / save_data(expected_version) / update_data)
+        self.occ_max_retries = occ_max_retries
+        self._occ_stats = {'conflicts': 0, 'retries': 0, 'exhausted': 0}
+        
+        # Journal (append-only JSONL) nằm cạnh snapshot
+        self.journal = journal
+        self.journal_file = os.path.splitext(json_file)[0] + '.journal.jsonl'
+        self.compact_every = compact_every
+        self._journal_entries = 0
+        
+        # Group commit: các writer đến trong cùng cửa sổ dùng chung một lần ghi + fsync
+        self.group_commit_ms = group_commit_ms
+        self._commit_cond = threading.Condition()
+        self._open_batch = None
+        self._inflight_batches = 0
+        self._flushing = False
         
         # Đảm bảo thư mục data tồn tại
         os.makedirs('data', exist_ok=True)
         
-        # Kết nối MongoDB nếu có
+        # SQLite backend (thay cho file JSON nếu có SQLITE_PATH)
+        self.sqlite = None
+        if sqlite_path:
+            from storage_sqlite import SqliteStore
+            self.sqlite = SqliteStore(sqlite_path)
+            self.journal = False
+            self.sqlite.migrate_from_json(json_file)
+        
+        # Nhiều worker process cùng ghi file JSON (locking.py); SQLite tự khóa nên không cần
+        self._file_lock = None
+        self._shared_version = None
+        if multiprocess and not self.sqlite:
+            base = os.path.splitext(json_file)[0]
+            self._file_lock = FileLock(base + '.lock')
+            self._shared_version = SharedCounter(base + '.version')
+        
+        # Chia sub_tasks / progress_logs theo tháng|năm (partitions.py); SQLite đã có index nên bỏ qua
+        # MongoDB (layout normalized) cũng chia collection theo kỳ này
+        self.partition = partition
+        self.partitions = None
+        partition_dir = os.path.splitext(json_file)[0] + '_partitions'
+        if partition and not self.sqlite:
+            self.partitions = PartitionStore(partition_dir, partition)
+            # Mỗi lần ghi chỉ ghi lại file của các kỳ có thay đổi → không cần journal
+            self.journal = False
+            self._persist_partitions()
+        elif not self.sqlite and os.path.exists(os.path.join(partition_dir, 'manifest.json')):
+            self._merge_partitions(partition_dir)
+        
+        # MongoDB (không bắt buộc): chỉ kết nối ở lần đồng bộ đầu tiên, không chặn lúc khởi động
         if mongo_uri:
-            self._connect_mongodb()
+            self._connect_mongodb(mongo_options, mongo_breaker or {})
     
-    def _connect_mongodb(self):
-        """Kết nối MongoDB (không bắt buộc)"""
-        try:
-            client = MongoClient(
-                self.mongo_uri,
-                serverSelectionTimeoutMS=3000,  # Timeout 3s
-                connectTimeoutMS=3000
-            )
-            # Test connection
-            client.admin.command('ping')
-            
-            self.db = client['goal_tracker_2026']
-            self.collection = self.db['goals_data']
-            self.mongo_enabled = True
-            
-            logger.info("✅ MongoDB connected successfully")
-            
-        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-            logger.warning(f"⚠️  MongoDB not available: {e}")
-            logger.info("📁 Using JSON file storage only")
-            self.mongo_enabled = False
-        except Exception as e:
-            logger.error(f"❌ MongoDB connection error: {e}")
-            self.mongo_enabled = False
+    def _connect_mongodb(self, options, breaker):
+        """
+        Chuẩn bị MongoDB (mongo_client.py): client tạo lười, circuit breaker, ping nền
+        Mongo sập / chưa chạy → các lần ghi bỏ qua Mongo ngay; hồi phục → tự đồng bộ lại
+        """
+        self._mongo = MongoConnection(
+            self.mongo_uri, self.mongo_db,
+            options=options,
+            on_recover=self._mongo_recovered,
+            **breaker
+        )
+        self.mongo_enabled = True
+        
+        # Đồng bộ chạy nền, request không phải chờ Mongo
+        self._mongo_sync = MongoSyncWorker(
+            snapshot_fn=self._mongo_snapshot,
+            push_fn=self._mongo_push
+        )
+        # atexit chạy ngược thứ tự đăng ký: dừng worker trước, đóng client sau
+        atexit.register(self._mongo.stop)
+        atexit.register(self._mongo_sync.stop)
+        logger.info(f"🍃 MongoDB sync enabled (lazy connect, db={self.mongo_db})")
+    
+    def _mongo_recovered(self):
+        """MongoDB hoạt động trở lại → đẩy ngay dữ liệu hiện tại (các lần ghi lúc Mongo sập đã bị bỏ qua)"""
+        if self._mongo_sync:
+            self._mongo_sync.enqueue(self.data_version)
+            self._mongo_sync.retry_now()
+    
+    def _mongo_mirror_for(self, db):
+        """Mirror của layout normalized, tạo lại khi client được tạo mới (digest cũ không còn tin được)"""
+        with self._mongo_mirror_lock:
+            if self._mongo_mirror is None or self._mongo_mirror.db is not db:
+                granularity = self.partition
+                self._mongo_mirror = NormalizedMongoMirror(
+                    db,
+                    partition_fn=(lambda record: partition_key(record, granularity)) if granularity else None
+                )
+            return self._mongo_mirror
     
     def load_data(self):
-        """Tải dữ liệu từ JSON (primary source)"""
+        """
+        Tải dữ liệu từ JSON (primary source)
+        Chỉ đọc lại file khi mtime/size/inode thay đổi, còn lại dùng cache
+        """
+        with self._lock:
+            return self._dataset(everything=True).to_dict(copy=True)
+    
+    def load_versioned(self):
+        """(bản copy toàn bộ dữ liệu, version) - truyền version cho save_data(expected_version=...)"""
+        with self._lock:
+            data = self._dataset(everything=True).to_dict(copy=True)
+            return data, self._version_token()
+    
+    def _version_token(self):
+        """
+        Version của dữ liệu đang cache (gọi sau _current, khi giữ lock)
+        SQLite: version trong DB (chung mọi process); JSON: data_version, tăng theo mọi thay đổi
+        kể cả khi đọc lại vì worker khác đã ghi
+        """
+        return self._cache_stamp if self.sqlite else self.data_version
+
+    def change_token(self):
+        """
+        Dấu phiên bản dữ liệu đã lưu, giống nhau ở mọi worker, không nạp dữ liệu (ETag của các trang)
+        SQLite: version trong DB; JSON: dấu file / bộ đếm dùng chung (xem _file_stamp)
+        """
+        if self.sqlite:
+            return ('sqlite', self.sqlite.version())
+        return ('json',) + self._file_stamp()
+
+    def last_modified(self):
+        """Thời điểm (epoch, giây) dữ liệu được ghi gần nhất theo mtime file, 0 nếu chưa có file"""
+        if self.sqlite:
+            # Chế độ WAL: thay đổi nằm trong file -wal cho tới lần checkpoint
+            paths = [self.sqlite.db_path, self.sqlite.db_path + '-wal']
+        else:
+            # Chế độ partition: file chính luôn được ghi lại sau file kỳ và manifest
+            paths = [self.json_file, self.journal_file] if self.journal else [self.json_file]
+        latest = 0
+        for path in paths:
+            try:
+                latest = max(latest, os.stat(path).st_mtime)
+            except FileNotFoundError:
+                pass
+        return latest
+
+    def _current(self):
+        """
+        Trả về Dataset đang cache (đọc lại snapshot + journal nếu file đã đổi). Gọi khi đang giữ lock
+        """
+        if self.sqlite:
+            if self._cache is None or self.sqlite.version() != self._cache_stamp:
+                data, self._cache_stamp = self.sqlite.load_all()
+                self._cache = Dataset(data, self.compact_memory)
+                self.data_version += 1
+            return self._cache
+        
+        if self._cache is not None and self._inflight_batches:
+            # Đang có thay đổi chưa ghi xong → cache là bản mới nhất, file trên đĩa chưa khớp
+            return self._cache
+        stamp = self._file_stamp()
+        if self._cache is None or stamp != self._cache_stamp:
+            with self._reading():
+                # Đọc lại dấu dưới khóa: worker khác có thể vừa ghi xong
+                stamp = self._file_stamp()
+                dataset = self._load_json_file()
+                if self.journal:
+                    self._replay_journal(dataset)
+                if self.partitions:
+                    self._attach_partitions(dataset)
+            self._cache = dataset
+            self._cache_stamp = stamp
+            self.data_version += 1
+        return self._cache
+    
+    def _dataset(self, everything=False, start=None, end=None, goal_id=None, task_id=None):
+        """
+        _current() + nạp các kỳ (partition) mà truy vấn cần. Gọi khi đang giữ lock
+        everything=True: mọi kỳ; còn lại xem PartitionStore.select
+        """
+        dataset = self._current()
+        parts = self.partitions
+        if parts is None:
+            return dataset
+        if everything:
+            keys = parts.select()
+        elif start is None and end is None and goal_id is None and task_id is None:
+            return dataset
+        else:
+            keys = parts.select(start, end, goal_id, task_id)
+        self._load_partitions(dataset, keys)
+        return dataset
+    
+    def _load_partitions(self, dataset, keys, parts=None):
+        """Đọc các kỳ chưa nạp vào dataset"""
+        parts = parts or self.partitions
+        keys = [key for key in keys if key not in parts.loaded]
+        with self._reading():
+            for key in keys:
+                dataset.merge(parts.read(key))
+                parts.loaded.add(key)
+        if keys:
+            logger.info(f"📂 Loaded partitions: {', '.join(sorted(keys))}")
+    
+    def _attach_partitions(self, dataset):
+        """
+        Dataset vừa đọc từ file chính (goals, sequences) → đọc manifest, nạp các kỳ gần đây
+        File chính còn chứa hoạt động (trước khi bật partition) hoặc đổi tháng ↔ năm:
+        nạp toàn bộ và đánh dấu chia lại (được ghi ở lần ghi kế tiếp)
+        """
+        parts = self.partitions
+        stale = parts.reset()
+        if len(dataset.sub_tasks) or dataset.progress_logs or parts.regranulate:
+            self._load_partitions(dataset, list(parts.entries))
+            parts.adopt(dataset)
+            logger.info(f"🗂️  Repartitioning data by {parts.granularity}")
+        else:
+            self._load_partitions(dataset, parts.hot_keys(date.today()) + stale)
+            # Tính lại mục manifest của kỳ không khớp file
+            parts.dirty.update(stale)
+        dataset.sequences['sub_tasks'] = max(
+            dataset.sequences['sub_tasks'], parts.max_id(), dataset.sub_tasks.max_id()
+        )
+    
+    def _persist_partitions(self):
+        """Khởi động: ghi ngay phần chia lại / sửa manifest (nếu có) thay vì đợi lần ghi đầu"""
+        with self._writing():
+            self._current()
+            batch = self._register_write(snapshot=True) if self.partitions.dirty else None
+        if batch:
+            self._await_commit(batch)
+    
+    def _merge_partitions(self, partition_dir):
+        """Đã tắt STORAGE_PARTITION: gộp các kỳ về lại file chính, đổi tên thư mục partition thành .bak"""
+        parts = PartitionStore(partition_dir)
+        parts.reset()
+        with self._writing():
+            dataset = self._current()
+            self._load_partitions(dataset, list(parts.entries), parts)
+            dataset.sequences['sub_tasks'] = max(dataset.sequences['sub_tasks'], dataset.sub_tasks.max_id())
+            self.data_version += 1
+            batch = self._register_write(snapshot=True)
+        self._await_commit(batch)
+        backup_dir = f"{partition_dir}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.bak"
+        os.replace(partition_dir, backup_dir)
+        logger.info(f"🗂️  Merged partitions into {self.json_file} (old files: {backup_dir})")
+    
+    @contextmanager
+    def _reading(self):
+        """Khóa đọc (shared) giữa các worker khi đọc file dữ liệu; không làm gì nếu chạy một process"""
+        if self._file_lock is None:
+            yield
+            return
+        self._file_lock.acquire(exclusive=False)
+        try:
+            yield
+        finally:
+            self._file_lock.release()
+    
+    @contextmanager
+    def _writing(self):
+        """
+        self._lock + khóa ghi (exclusive) giữa các worker: cache được đọc lại nếu worker khác
+        vừa ghi, nên đọc - sửa - ghi không làm mất thay đổi của nhau. Batch đăng ký bên trong
+        giữ khóa tới khi ghi xong xuống đĩa (xem _register_write / _flush_open_batch)
+        """
+        with self._lock:
+            if self._file_lock is None:
+                yield
+                return
+            self._file_lock.acquire(exclusive=True)
+            try:
+                yield
+            finally:
+                self._file_lock.release()
+    
+    def _load_json_file(self):
+        """Đọc file JSON theo từng record thẳng vào Dataset (không parse cả file thành dict)"""
         if os.path.exists(self.json_file):
             try:
                 with open(self.json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                    dataset = Dataset.from_stream(iter_data(f), self.compact_memory)
                 logger.info(f"📖 Loaded data from {self.json_file}")
-                return self._ensure_structure(data)
+                return dataset
             except Exception as e:
                 logger.error(f"❌ Error loading JSON: {e}")
-                return self._empty_structure()
+                return Dataset(self._empty_structure(), self.compact_memory)
         else:
             logger.info("📝 Creating new data file")
-            return self._empty_structure()
+            return Dataset(self._empty_structure(), self.compact_memory)
     
-    def save_data(self, data):
+    def _file_stamp(self):
+        """
+        Dấu nhận diện phiên bản dữ liệu: (mtime_ns, size, inode) của snapshot
+        và của journal (nếu bật), None cho file chưa tồn tại
+        Nhiều process: chỉ là bộ đếm phiên bản dùng chung (đọc từ mmap, không stat file)
+        """
+        if self._shared_version:
+            return (self._shared_version.value(),)
+        paths = [self.json_file, self.journal_file] if self.journal else [self.json_file]
+        if self.partitions:
+            paths.append(self.partitions.manifest_file)
+        stamp = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+    
+    def _copy_data(self, data):
+        """
+        Copy dữ liệu để route có thể sửa thoải mái mà không làm bẩn cache
+        (mỗi record là dict phẳng nên copy từng dict là đủ)
+        """
+        return {
+            key: [dict(row) for row in value] if isinstance(value, list) else value
+            for key, value in data.items()
+        }
+    
+    def save_data(self, data, expected_version=None):
         """
         Lưu dữ liệu vào cả JSON và MongoDB
         JSON là primary, MongoDB là backup tự động
+        Ở chế độ journal: ghi snapshot đầy đủ rồi xóa journal (đã gộp vào snapshot)
+        expected_version (từ load_versioned): compare-and-swap, raise ConflictError nếu
+        dữ liệu đã đổi kể từ lúc đọc. Trả về version mới
         """
         # 1. Lưu vào JSON (primary)
-        try:
+        with self._writing():
             data = self._ensure_structure(data)
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            
+            if expected_version is not None and not self.sqlite:
+                self._current()
+                if self.data_version != expected_version:
+                    self._occ_stats['conflicts'] += 1
+                    raise ConflictError(f"Data changed (version {expected_version} → {self.data_version})")
+            
+            if self.sqlite:
+                # So version trong cùng transaction ghi (an toàn giữa các process)
+                version = self.sqlite.replace_all(data, expected_version)
+                if version is None:
+                    self._occ_stats['conflicts'] += 1
+                    raise ConflictError(f"Data changed since version {expected_version}")
+                self._cache_stamp = version
+                self._cache = Dataset(self._copy_data(data), self.compact_memory)
+                self.data_version += 1
+                batch = None
+            else:
+                if self.partitions:
+                    # Manifest phải được đọc để xóa được file của kỳ không còn dữ liệu
+                    self._current()
+                # Cập nhật cache ngay, không cần parse lại file
+                self._cache = Dataset(self._copy_data(data), self.compact_memory)
+                if self.partitions:
+                    self.partitions.adopt(self._cache)
+                self.data_version += 1
+                batch = self._register_write(snapshot=True)
+            version = self._version_token()
+        if batch:
+            self._await_commit(batch)
+        
+        # 2. Backup vào MongoDB (nếu có)
+        self._backup_to_mongodb(data)
+        return version
+    
+    def update_data(self, mutate, max_retries=None):
+        """
+        Đọc - sửa - ghi toàn bộ dữ liệu kiểu optimistic: mutate(data) chạy ngoài lock trên bản copy,
+        save_data so version (compare-and-swap); xung đột thì đọc lại và chạy lại mutate,
+        tối đa max_retries lần (mặc định occ_max_retries) rồi raise ConflictError.
+        Trả về kết quả của mutate
+        """
+        if max_retries is None:
+            max_retries = self.occ_max_retries
+        for attempt in range(max_retries + 1):
+            data, version = self.load_versioned()
+            result = mutate(data)
+            try:
+                self.save_data(data, expected_version=version)
+                return result
+            except ConflictError:
+                with self._lock:
+                    if attempt == max_retries:
+                        self._occ_stats['exhausted'] += 1
+                        raise
+                    self._occ_stats['retries'] += 1
+                # Lùi ngẫu nhiên một chút để các writer xung đột không đụng nhau lần nữa
+                time.sleep(random.uniform(0, 0.005 * (attempt + 1)))
+    
+    def concurrency_stats(self):
+        """Số lần xung đột / chạy lại / hết lượt chạy lại của update_data và save_data(expected_version)"""
+        with self._lock:
+            return dict(self._occ_stats)
+    
+    def load_stream(self, items):
+        """
+        Thay toàn bộ dữ liệu bằng luồng (bảng, record) của json_stream.iter_data
+        - SQLite: ghi theo batch stream_batch_size record trong một transaction
+        - JSON: record đi thẳng vào Dataset rồi ghi snapshot, không có bản dict thứ hai
+        """
+        with self._writing():
+            if self.sqlite:
+                self._cache_stamp = self.sqlite.replace_stream(items, self.stream_batch_size)
+                # Đọc lại từ SQLite ở lần truy cập sau
+                self._cache = None
+                self.data_version += 1
+                batch = None
+            else:
+                if self.partitions:
+                    self._current()
+                self._cache = Dataset.from_stream(items, self.compact_memory)
+                if self.partitions:
+                    self.partitions.adopt(self._cache)
+                self.data_version += 1
+                batch = self._register_write(snapshot=True)
+        if batch:
+            self._await_commit(batch)
+        
+        self._backup_to_mongodb(None)
+    
+    def apply_change(self, op, payload):
+        """
+        Áp dụng một thay đổi đơn lẻ (xem JOURNAL_OPS)
+        - Chế độ journal: chỉ append 1 dòng vào journal, chi phí không phụ thuộc số bản ghi
+        - SQLite: một câu lệnh INSERT/DELETE trong transaction
+        - Chế độ thường: ghi lại toàn bộ snapshot như save_data
+        """
+        with self._writing():
+            batch = self._apply_locked(op, payload)
+        self._finish_write(batch)
+    
+    def _apply_locked(self, op, payload):
+        """
+        Phần của apply_change chạy dưới lock: ghi backend / đăng ký batch và cập nhật cache
+        Trả về batch cần chờ ghi xuống đĩa (chờ ngoài lock bằng _finish_write)
+        """
+        if op not in JOURNAL_OPS:
+            raise ValueError(f"Unknown storage operation: {op}")
+        
+        data = self._current()
+        
+        if self.sqlite:
+            version = self.sqlite.apply(op, payload)
+            if version == self._cache_stamp + 1:
+                data.apply(op, dict(payload))
+                self._cache_stamp = version
+            else:
+                # Có tiến trình khác vừa ghi → đọc lại ở lần sau
+                self._cache = None
+            self.data_version += 1
+            return None
+        
+        if self.partitions:
+            self._touch_partitions(data, op, payload)
+        
+        if self.journal:
+            line = json.dumps({'op': op, 'data': payload}, ensure_ascii=False, separators=(',', ':'))
+            self._journal_entries += 1
+            batch = self._register_write(
+                line=line,
+                snapshot=self._journal_entries >= self.compact_every
+            )
+        else:
+            batch = self._register_write(snapshot=True)
+        
+        data.apply(op, dict(payload))
+        self.data_version += 1
+        return batch
+    
+    def _touch_partitions(self, data, op, payload):
+        """Nạp các kỳ mà thao tác sửa (bản cũ lẫn bản mới của record) và đánh dấu cần ghi lại"""
+        table, action = JOURNAL_OPS[op]
+        parts = self.partitions
+        if table == 'goals':
+            if action == 'delete':
+                self._load_partitions(data, parts.select(goal_id=payload['id']))
+                parts.dirty.update(parts.key_of(t) for t in data.subtasks_of(payload['id']))
+            return
+        self._load_partitions(data, parts.select(task_id=payload['id']))
+        old = data.sub_tasks.get(payload['id'])
+        if old is not None:
+            parts.dirty.add(parts.key_of(old))
+        if action == 'upsert':
+            key = parts.key_of(payload)
+            self._load_partitions(data, [key] if key in parts.entries else [])
+            parts.loaded.add(key)
+            parts.dirty.add(key)
+    
+    def _finish_write(self, batch):
+        """Chờ batch ghi xong (không giữ lock) rồi báo đồng bộ MongoDB"""
+        if batch:
+            self._await_commit(batch)
+        
+        self._backup_to_mongodb(None)
+    
+    # ---------- Thao tác theo record ----------
+    
+    def add_goal(self, fields):
+        """Thêm mục tiêu với id mới, trả về record đã lưu"""
+        with self._writing():
+            goal = {'id': self.next_id('goals'), **fields}
+            batch = self._apply_locked('add_goal', goal)
+        self._finish_write(batch)
+        return dict(goal)
+    
+    def update_goal(self, goal_id, fields):
+        """
+        Cập nhật một số field của mục tiêu (đọc - sửa - ghi trong cùng lock, không mất cập nhật
+        song song), trả về record mới hoặc None nếu không có mục tiêu
+        """
+        with self._writing():
+            goal = self._current().goals.get(goal_id)
+            if goal is None:
+                return None
+            goal = {**goal, **fields, 'id': goal_id}
+            batch = self._apply_locked('update_goal', goal)
+        self._finish_write(batch)
+        return dict(goal)
+    
+    def delete_goal_cascade(self, goal_id):
+        """Xóa mục tiêu cùng mọi hoạt động của nó, trả về số hoạt động đã xóa (None nếu không có mục tiêu)"""
+        with self._writing():
+            data = self._dataset(goal_id=goal_id)
+            existed = goal_id in data.goals
+            removed = data.subtask_count(goal_id)
+            # Vẫn ghi thao tác xóa khi goal không còn, để dọn hoạt động mồ côi (nếu có)
+            batch = self._apply_locked('delete_goal', {'id': goal_id})
+        self._finish_write(batch)
+        return removed if existed else None
+    
+    def add_subtask(self, goal_id, fields):
+        """
+        Thêm hoạt động cho mục tiêu (kiểm tra mục tiêu và cấp id trong cùng lock),
+        trả về record đã lưu hoặc None nếu không có mục tiêu
+        """
+        with self._writing():
+            goal = self._current().goals.get(goal_id)
+            if goal is None:
+                return None
+            subtask = {
+                'id': self.next_id('sub_tasks'),
+                'goal_id': goal_id,
+                'goal_title': goal['title'],
+                **fields,
+            }
+            batch = self._apply_locked('add_subtask', subtask)
+        self._finish_write(batch)
+        return dict(subtask)
+    
+    def delete_subtask(self, subtask_id):
+        """Xóa hoạt động, trả về record đã xóa hoặc None nếu không có"""
+        with self._writing():
+            task = self._dataset(task_id=subtask_id).sub_tasks.get(subtask_id)
+            if task is None:
+                return None
+            task = dict(task)
+            batch = self._apply_locked('delete_subtask', {'id': subtask_id})
+        self._finish_write(batch)
+        return task
+    
+    # ---------- Thao tác hàng loạt (một transaction, một lần ghi) ----------
+    
+    def add_subtasks(self, items):
+        """
+        Thêm nhiều hoạt động [(goal_id, fields)] cho nhiều mục tiêu cùng lúc
+        Mục tiêu không tồn tại → BatchError, không thêm gì. Trả về các record đã lưu
+        """
+        with self._writing():
+            goals = self._current().goals
+            errors = [
+                {'index': i, 'message': f"Goal {goal_id} not found"}
+                for i, (goal_id, _) in enumerate(items) if goal_id not in goals
+            ]
+            if errors:
+                raise BatchError(errors)
+            ids = self.next_ids('sub_tasks', len(items))
+            subtasks = [
+                {'id': task_id, 'goal_id': goal_id, 'goal_title': goals[goal_id]['title'], **fields}
+                for task_id, (goal_id, fields) in zip(ids, items)
+            ]
+            batch = self._apply_batch_locked([('add_subtask', task) for task in subtasks])
+        self._finish_write(batch)
+        return [dict(task) for task in subtasks]
+    
+    def update_goals(self, updates):
+        """Cập nhật nhiều mục tiêu [(goal_id, fields)]; mục tiêu không tồn tại → BatchError. Trả về các record mới"""
+        with self._writing():
+            goals = self._current().goals
+            errors = [
+                {'index': i, 'message': f"Goal {goal_id} not found"}
+                for i, (goal_id, _) in enumerate(updates) if goal_id not in goals
+            ]
+            if errors:
+                raise BatchError(errors)
+            changed = {}
+            for goal_id, fields in updates:
+                # Cùng goal xuất hiện nhiều lần → gộp theo thứ tự
+                changed[goal_id] = {**changed.get(goal_id, goals[goal_id]), **fields, 'id': goal_id}
+            batch = self._apply_batch_locked([('update_goal', goal) for goal in changed.values()])
+        self._finish_write(batch)
+        return [dict(goal) for goal in changed.values()]
+    
+    def delete_subtasks(self, subtask_ids):
+        """Xóa nhiều hoạt động; id không tồn tại → BatchError. Trả về các record đã xóa"""
+        with self._writing():
+            tasks, errors = {}, []
+            for i, subtask_id in enumerate(subtask_ids):
+                task = self._dataset(task_id=subtask_id).sub_tasks.get(subtask_id)
+                if task is None:
+                    errors.append({'index': i, 'message': f"Subtask {subtask_id} not found"})
+                else:
+                    tasks[subtask_id] = dict(task)
+            if errors:
+                raise BatchError(errors)
+            batch = self._apply_batch_locked([('delete_subtask', {'id': task_id}) for task_id in tasks])
+        self._finish_write(batch)
+        return list(tasks.values())
+    
+    def delete_goals(self, goal_ids):
+        """Xóa nhiều mục tiêu cùng hoạt động của chúng; id không tồn tại → BatchError. Trả về {goal_id: số hoạt động đã xóa}"""
+        with self._writing():
+            goals = self._current().goals
+            errors = [
+                {'index': i, 'message': f"Goal {goal_id} not found"}
+                for i, goal_id in enumerate(goal_ids) if goal_id not in goals
+            ]
+            if errors:
+                raise BatchError(errors)
+            removed = {goal_id: self._dataset(goal_id=goal_id).subtask_count(goal_id) for goal_id in goal_ids}
+            batch = self._apply_batch_locked([('delete_goal', {'id': goal_id}) for goal_id in removed])
+        self._finish_write(batch)
+        return removed
+    
+    def _apply_batch_locked(self, changes):
+        """
+        Nhiều thay đổi dưới cùng lock: SQLite trong một transaction,
+        JSON / journal gom vào cùng một batch ghi (một lần ghi + fsync)
+        """
+        if not changes:
+            return None
+        if not self.sqlite:
+            batch = None
+            for op, payload in changes:
+                batch = self._apply_locked(op, payload)
+            return batch
+        
+        data = self._current()
+        version = self.sqlite.apply_many(changes)
+        if version == self._cache_stamp + 1:
+            for op, payload in changes:
+                data.apply(op, dict(payload))
+            self._cache_stamp = version
+        else:
+            self._cache = None
+        self.data_version += 1
+        return None
+    
+    def compact(self):
+        """
+        Gộp journal vào goals_data.json và xóa journal
+        Với SQLite: xuất trạng thái hiện tại ra goals_data.json
+        """
+        with self._writing():
+            data = self._current()
+            if self.sqlite:
+                _commit_temp(_write_temp(self.json_file, encode_chunks(data.items())), self.json_file)
+                return
+            batch = self._register_write(snapshot=True)
+        self._await_commit(batch)
+    
+    def list_goals(self):
+        """Danh sách mục tiêu (bản copy)"""
+        with self._lock:
+            return [dict(g) for g in self._current().goals.values()]
+    
+    def get_goal(self, goal_id):
+        """Tra cứu mục tiêu theo id (O(1)), None nếu không có"""
+        with self._lock:
+            goal = self._current().goals.get(goal_id)
+            return dict(goal) if goal else None
+    
+    def get_subtask(self, subtask_id):
+        """Tra cứu hoạt động theo id (O(1)), None nếu không có"""
+        with self._lock:
+            task = self._dataset(task_id=subtask_id).sub_tasks.get(subtask_id)
+            return dict(task) if task else None
+    
+    def list_subtasks(self, goal_id=None, start=None, end=None, newest_first=False):
+        """
+        Hoạt động, lọc theo mục tiêu và/hoặc khoảng ngày [start, end] (date hoặc 'YYYY-MM-DD')
+        - goal_id: dùng index goal_id (O(k)), khoảng ngày so sánh ordinal đã parse sẵn
+        - chỉ khoảng ngày: như subtasks_between (bucket / SQL theo index)
+        newest_first=True: mới nhất trước
+        """
+        start = _as_date(start) if start is not None else None
+        end = _as_date(end) if end is not None else None
+        if goal_id is not None:
+            with self._lock:
+                dataset = self._dataset(start=start, end=end, goal_id=goal_id)
+                return [dict(t) for t in dataset.subtasks_of(goal_id, newest_first, start, end)]
+        
+        if start is None and end is None:
+            with self._lock:
+                tasks = [dict(t) for t in self._dataset(everything=True).sub_tasks.values()]
+        else:
+            tasks = self.subtasks_between(start or date.min, end)
+        if newest_first:
+            tasks.sort(key=lambda t: (t.get('created_at') or '', t.get('created_time') or ''), reverse=True)
+        return tasks
+    
+    def goals_page(self, limit, after=None, before=None):
+        """
+        Trang mục tiêu theo id tăng dần (keyset): after / before là cursor (chuỗi) lấy từ trang trước đó
+        → (goals (bản copy), cursor trang trước, cursor trang sau); không còn trang → None
+        """
+        with self._lock:
+            goals, prev_key, next_key = self._current().goals_page(
+                limit, _decode_cursor(after), _decode_cursor(before)
+            )
+            return [dict(g) for g in goals], _encode_cursor(prev_key), _encode_cursor(next_key)
+    
+    def subtasks_page(self, goal_id, limit, after=None, before=None, start=None, end=None, newest_first=True):
+        """
+        Trang hoạt động của goal theo (created_at, created_time, id) - keyset, mặc định mới nhất trước
+        → (hoạt động (bản copy), cursor trang trước, cursor trang sau)
+        start/end (date hoặc 'YYYY-MM-DD'): chỉ lấy hoạt động trong khoảng ngày đó
+        Chỉ copy `limit` record; chế độ partition chỉ nạp các kỳ cần cho trang này
+        """
+        after, before = _decode_cursor(after, 2), _decode_cursor(before, 2)
+        start = _as_date(start) if start is not None else None
+        end = _as_date(end) if end is not None else None
+        with self._lock:
+            if start is not None or end is not None:
+                # Khoảng ngày đã giới hạn số kỳ cần đọc
+                dataset = self._dataset(start=start, end=end, goal_id=goal_id)
+            else:
+                dataset = self._current()
+                if self.partitions and newest_first:
+                    self._load_page_partitions(dataset, goal_id, limit, after, before)
+                elif self.partitions:
+                    dataset = self._dataset(goal_id=goal_id)
+            tasks, prev_key, next_key = dataset.subtasks_page(
+                goal_id, limit, after, before, start, end, newest_first
+            )
+            return [dict(t) for t in tasks], _encode_cursor(prev_key), _encode_cursor(next_key)
+    
+    def activity_summary(self, start, end=None):
+        """
+        Hoạt động trong [start, end] (end=None: không giới hạn) tóm tắt theo goal, không copy record:
+        [{'goal_id', 'goal_title', 'count', 'first_day', 'last_day'}] - cho trang tiến độ / báo cáo
+        """
+        start = _as_date(start)
+        end = _as_date(end) if end is not None else None
+        with self._lock:
+            dataset = self._dataset(start=start, end=end)
+            summary = []
+            for goal_id, count, first, last, title in dataset.activity_summary(start, end):
+                summary.append({
+                    'goal_id': goal_id,
+                    'goal_title': title,
+                    'count': count,
+                    'first_day': date.fromordinal(first).isoformat(),
+                    'last_day': date.fromordinal(last).isoformat(),
+                })
+            return summary
+    
+    def _load_page_partitions(self, dataset, goal_id, limit, after, before):
+        """
+        Nạp các kỳ chưa nạp có thể chứa hoạt động của trang: đi từ kỳ mới đến kỳ cũ,
+        dừng khi trang đã đủ và kỳ tiếp theo kết thúc trước hoạt động cuối trang
+        """
+        parts = self.partitions
+        if before is not None:
+            # Trang mới hơn cursor: các kỳ từ ngày của cursor trở đi (thường là kỳ gần đây, đã nạp)
+            self._load_partitions(dataset, parts.select(start=_cursor_day(before), goal_id=goal_id))
+            return
+        if after is not None and not after[0]:
+            # Cursor nằm trong nhóm không có ngày ('undated', luôn được nạp)
+            return
+        end = _cursor_day(after) if after is not None else None
+        for key in parts.newest_first(parts.select(end=end, goal_id=goal_id)):
+            # Lấy thêm 1 record để biết trang có đủ và còn trang sau hay không
+            tasks = dataset.subtasks_page(goal_id, limit + 1, after)[0]
+            if len(tasks) > limit:
+                boundary = dataset.sub_tasks.when(tasks[-1]['id'])
+                period_end = parts.period_end(key)
+                if boundary and period_end and period_end.toordinal() < boundary[0]:
+                    break
+            self._load_partitions(dataset, [key])
+    
+    def subtask_count(self, goal_id):
+        """Số hoạt động của một goal (kỳ chưa nạp: đọc số đếm trong manifest)"""
+        with self._lock:
+            count = self._current().subtask_count(goal_id)
+            if self.partitions:
+                count += self.partitions.unloaded_counts().get(goal_id, 0)
+            return count
+    
+    def subtask_counts(self):
+        """goal_id → số hoạt động"""
+        with self._lock:
+            counts = {goal_id: len(ids) for goal_id, ids in self._current().by_goal.items()}
+            if self.partitions:
+                # Kỳ chưa nạp: đọc số đếm trong manifest
+                for goal_id, count in self.partitions.unloaded_counts().items():
+                    counts[goal_id] = counts.get(goal_id, 0) + count
+            return counts
+    
+    def subtask_columns(self):
+        """Cột số của toàn bộ hoạt động: {'id', 'goal_id', 'day', 'secs'} → array (bản copy)"""
+        with self._lock:
+            return self._dataset(everything=True).columns()
+    
+    def next_id(self, table):
+        """Cấp id mới cho 'goals' hoặc 'sub_tasks' (sequence bền vững, không dùng lại id đã xóa)"""
+        return self.next_ids(table, 1)[0]
+    
+    def next_ids(self, table, count):
+        """Cấp count id liên tiếp (SQLite: một transaction), trả về range"""
+        with self._lock:
+            dataset = self._current()
+            if self.sqlite:
+                first_id = self.sqlite.reserve_ids(table, count)
+            else:
+                first_id = dataset.sequences[table] + 1
+            dataset.sequences[table] = max(dataset.sequences[table], first_id + count - 1)
+            return range(first_id, first_id + count)
+    
+    def subtasks_between(self, start, end=None):
+        """
+        Hoạt động có created_at trong [start, end] (date/datetime hoặc chuỗi YYYY-MM-DD)
+        end=None nghĩa là không giới hạn trên. Nhận thẳng kết quả của get_week_range()
+        """
+        start = _as_date(start)
+        end = _as_date(end) if end is not None else None
+        with self._lock:
+            if self.sqlite:
+                return self.sqlite.subtasks_between(start, end)
+            # Dùng bucket ngày/tuần/tháng, không quét toàn bộ
+            return [dict(t) for t in self._dataset(start=start, end=end).subtasks_between(start, end)]
+    
+    def dashboard_stats(self, today=None):
+        """Thống kê dashboard đọc từ bộ đếm (tự chuyển sang tuần mới theo `today`)"""
+        today = _as_date(today or datetime.now())
+        week_start = today - timedelta(days=today.weekday())
+        with self._lock:
+            dataset = self._dataset(start=week_start, end=week_start + timedelta(days=6))
+            return dataset.dashboard_stats(today)
+    
+    def progress_stats(self, today=None):
+        """(thống kê tuần, thống kê tháng) chứa `today`, đọc từ bộ đếm"""
+        today = _as_date(today or datetime.now())
+        week_start = today - timedelta(days=today.weekday())
+        with self._lock:
+            # Tuần có thể vắt sang tháng trước / sau
+            dataset = self._dataset(
+                start=min(week_start, today.replace(day=1)),
+                end=max(week_start + timedelta(days=6), today.replace(day=monthrange(today.year, today.month)[1]))
+            )
+            return dataset.week_stats(today), dataset.month_stats(today)
+    
+    def count_subtasks_between(self, start, end=None):
+        """Đếm hoạt động trong [start, end] mà không copy record"""
+        start = _as_date(start)
+        end = _as_date(end) if end is not None else None
+        with self._lock:
+            if self.sqlite:
+                return self.sqlite.count_subtasks_between(start, end)
+            return self._dataset(start=start, end=end).count_between(start, end)
+    
+    # ---------- Group commit ----------
+    
+    def _register_write(self, line=None, snapshot=False):
+        """
+        Đăng ký phần việc ghi đĩa vào batch đang mở (gọi khi đang giữ self._lock,
+        ngay sau khi đã sửa cache, để thứ tự journal đúng thứ tự thay đổi)
+        """
+        if self._open_batch is None:
+            if self._file_lock:
+                # Giữ khóa ghi tới khi batch xuống đĩa (lồng trong _writing nên không phải chờ)
+                self._file_lock.acquire(exclusive=True)
+            self._open_batch = _CommitBatch()
+            self._inflight_batches += 1
+        batch = self._open_batch
+        if line is not None:
+            batch.lines.append(line)
+        if snapshot:
+            batch.snapshot = True
+        return batch
+    
+    def _await_commit(self, batch):
+        """
+        Chờ batch được ghi xuống đĩa. Writer đầu tiên thấy không ai đang flush sẽ làm leader:
+        đợi group_commit_ms để các writer khác nhập nhóm, rồi ghi + fsync một lần cho cả nhóm
+        """
+        with self._commit_cond:
+            while not batch.done and self._flushing:
+                self._commit_cond.wait()
+            if batch.done:
+                if batch.error:
+                    raise batch.error
+                return
+            self._flushing = True
+        
+        try:
+            if self.group_commit_ms:
+                time.sleep(self.group_commit_ms / 1000)
+            self._flush_open_batch()
+        finally:
+            with self._commit_cond:
+                self._flushing = False
+                self._commit_cond.notify_all()
+        
+        if batch.error:
+            raise batch.error
+    
+    def _flush_open_batch(self):
+        """Lấy batch đang mở và ghi xuống đĩa (chỉ leader gọi)"""
+        with self._lock:
+            batch, self._open_batch = self._open_batch, None
+            tmp_path = error = None
+            part_temps = []
+            if batch.snapshot and self._cache is not None:
+                # Serialize dưới lock để snapshot nhất quán, ghi thẳng từng record vào file tạm
+                # (không dựng cả chuỗi JSON trong bộ nhớ); fsync + rename làm ngoài lock
+                try:
+                    if self.partitions:
+                        part_temps = self._partition_temps()
+                    tmp_path = _write_temp(
+                        self.json_file, encode_chunks(self._cache.items(with_records=not self.partitions))
+                    )
+                except Exception as e:
+                    error = e
+                    for part_tmp, _ in part_temps:
+                        if part_tmp:
+                            _unlink_quietly(part_tmp)
+                self._journal_entries = 0
+        
+        try:
+            if error is not None:
+                raise error
+            if batch.snapshot and tmp_path is None:
+                raise RuntimeError("Cache was discarded after a failed write; reload and retry")
+            if tmp_path is not None:
+                # File kỳ + manifest trước, file chính sau cùng
+                self._commit_partitions(part_temps)
+                self._write_snapshot(tmp_path)
+            elif batch.lines:
+                self._append_journal(batch.lines)
+        except Exception as e:
+            batch.error = e
+            with self._lock:
+                # Cache đã có thay đổi chưa ghi được → bỏ cache để lần sau đọc lại từ đĩa
+                self._cache = None
+        
+        with self._lock:
+            self._inflight_batches -= 1
+            if self._shared_version:
+                # Báo các worker khác đọc lại (kể cả khi lỗi: file có thể đã đổi một phần)
+                self._shared_version.increment()
+            if batch.error is None:
+                self._cache_stamp = self._file_stamp()
+            if self._file_lock:
+                self._file_lock.release()
+        with self._commit_cond:
+            batch.done = True
+    
+    def _partition_temps(self):
+        """
+        File tạm cho các kỳ có thay đổi và manifest (gọi dưới lock)
+        → [(file tạm, đích)], file tạm None = kỳ không còn record, xóa file
+        """
+        parts = self.partitions
+        temps = []
+        try:
+            for key in sorted(parts.dirty):
+                rows, logs = parts.records(self._cache, key)
+                path = parts.path(key)
+                if rows or logs:
+                    part_tmp = _write_temp(path, encode_chunks([('sub_tasks', rows), ('progress_logs', logs)]))
+                    temps.append((part_tmp, path))
+                    parts.entries[key] = parts.describe(rows, logs, part_tmp)
+                else:
+                    temps.append((None, path))
+                    parts.entries.pop(key, None)
+            temps.append((_write_temp(parts.manifest_file, [parts.manifest_text()]), parts.manifest_file))
+        except BaseException:
+            for part_tmp, _ in temps:
+                if part_tmp:
+                    _unlink_quietly(part_tmp)
+            raise
+        parts.dirty.clear()
+        return temps
+    
+    def _commit_partitions(self, temps):
+        """fsync + rename file kỳ / manifest; kỳ rỗng thì xóa file"""
+        for i, (part_tmp, path) in enumerate(temps):
+            try:
+                if part_tmp:
+                    _commit_temp(part_tmp, path)
+                else:
+                    _unlink_quietly(path)
+            except Exception:
+                for rest_tmp, _ in temps[i + 1:]:
+                    if rest_tmp:
+                        _unlink_quietly(rest_tmp)
+                raise
+        if len(temps) > 1:
+            logger.info(f"💾 Saved {len(temps) - 1} partition(s) to {self.partitions.directory}")
+    
+    def _write_snapshot(self, tmp_path):
+        """
+        Ghi snapshot an toàn khi crash: file tạm (đã ghi xong) + fsync + rename
+        Người đọc luôn thấy bản cũ hoặc bản mới hoàn chỉnh, không bao giờ thấy file ghi dở
+        """
+        try:
+            _commit_temp(tmp_path, self.json_file)
             logger.info(f"💾 Saved to JSON: {self.json_file}")
         except Exception as e:
             logger.error(f"❌ Error saving JSON: {e}")
             raise
         
-        # 2. Backup vào MongoDB (nếu có)
-        if self.mongo_enabled:
-            try:
-                # Thêm timestamp
-                backup_data = data.copy()
-                backup_data['_backup_timestamp'] = datetime.now().isoformat()
-                backup_data['_backup_source'] = 'auto_sync'
-                
-                # Upsert (insert hoặc update)
-                self.collection.replace_one(
-                    {'_id': 'current_data'},
-                    {**backup_data, '_id': 'current_data'},
-                    upsert=True
-                )
-                logger.info("🔄 Synced to MongoDB backup")
-            except Exception as e:
-                logger.warning(f"⚠️  MongoDB backup failed: {e}")
-                # Không raise error vì MongoDB chỉ là backup
+        if self.journal and os.path.exists(self.journal_file) and os.path.getsize(self.journal_file):
+            # Snapshot đã chứa mọi thay đổi → làm rỗng journal
+            with open(self.journal_file, 'w') as f:
+                os.fsync(f.fileno())
+            logger.info(f"🗜️  Compacted journal into {self.json_file}")
+    
+    def _append_journal(self, lines):
+        """Append các thay đổi vào journal (JSONL), một lần fsync cho cả nhóm"""
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _replay_journal(self, dataset):
+        """Áp dụng lần lượt các thay đổi trong journal lên snapshot vừa đọc (mỗi thao tác O(1))"""
+        self._journal_entries = 0
+        if not os.path.exists(self.journal_file):
+            return
+        
+        good_offset = 0
+        with open(self.journal_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Dòng cuối bị ghi dở khi crash → cắt bỏ để lần append sau không dính vào
+                    logger.warning(f"⚠️  Truncating torn tail of {self.journal_file}")
+                    break
+                good_offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"⚠️  Skipping corrupt journal line in {self.journal_file}")
+                    continue
+                dataset.apply(entry['op'], entry['data'])
+                self._journal_entries += 1
+        if good_offset != os.path.getsize(self.journal_file):
+            os.truncate(self.journal_file, good_offset)
+        
+        if self._journal_entries:
+            logger.info(f"📜 Replayed {self._journal_entries} journal entries")
+    
+    def _backup_to_mongodb(self, data):
+        """Báo worker nền đồng bộ MongoDB (không chờ, không làm chậm request)"""
+        # Breaker mở (Mongo đang sập) → bỏ qua, _mongo_recovered đồng bộ lại khi Mongo hoạt động
+        if self._mongo_sync and self._mongo.available():
+            self._mongo_sync.enqueue(self.data_version)
+    
+    def _mongo_snapshot(self):
+        """
+        Bản dữ liệu mới nhất để đẩy lên MongoDB (gọi từ worker nền)
+        Layout normalized: (dữ liệu, các kỳ đã nạp) - kỳ chưa nạp không đổi nên không cần đọc
+        """
+        if not self._mongo.available():
+            # Không tốn công chụp dữ liệu khi chắc chắn không đẩy được
+            raise MongoUnavailable("MongoDB circuit open")
+        with self._lock:
+            if self.mongo_layout != 'normalized':
+                return self._dataset(everything=True).to_dict(copy=True)
+            dataset = self._current()
+            loaded = set(self.partitions.loaded) if self.partitions else None
+            return dataset.to_dict(copy=True), loaded
+    
+    def _mongo_push(self, snapshot):
+        """push_fn của worker nền: breaker mở → MongoUnavailable ngay, worker thử lại sau"""
+        with self._mongo.use() as db:
+            if self.mongo_layout == 'normalized':
+                self._mongo_mirror_for(db).push(*snapshot)
+            else:
+                self._push_to_mongodb(db, snapshot)
+    
+    def _push_to_mongodb(self, db, data):
+        """Ghi toàn bộ dữ liệu vào MongoDB (chạy trong worker nền, raise nếu lỗi để retry)"""
+        # Thêm timestamp
+        backup_data = data.copy()
+        backup_data['_backup_timestamp'] = datetime.now().isoformat()
+        backup_data['_backup_source'] = 'auto_sync'
+        
+        # Upsert (insert hoặc update)
+        db['goals_data'].replace_one(
+            {'_id': 'current_data'},
+            {**backup_data, '_id': 'current_data'},
+            upsert=True
+        )
+        logger.info("🔄 Synced to MongoDB backup")
     
     def restore_from_mongodb(self):
         """Khôi phục dữ liệu từ MongoDB"""
@@ -113,7 +1287,12 @@ class StorageManager:
             return None
         
         try:
-            data = self.collection.find_one({'_id': 'current_data'})
+            with self._mongo.use() as db:
+                if self.mongo_layout == 'normalized':
+                    mirror = self._mongo_mirror_for(db)
+                    data = mirror.restore() if mirror.has_backup() else None
+                else:
+                    data = db['goals_data'].find_one({'_id': 'current_data'})
             if data:
                 # Xóa các field internal của MongoDB
                 data.pop('_id', None)
@@ -125,10 +1304,62 @@ class StorageManager:
             else:
                 logger.warning("⚠️  No backup found in MongoDB")
                 return None
+        except MongoUnavailable as e:
+            logger.warning(f"⚠️  MongoDB not available: {e}")
+            return None
         except Exception as e:
             logger.error(f"❌ Error restoring from MongoDB: {e}")
             return None
     
+    def load_from_mongodb(self):
+        """
+        Khôi phục thẳng vào storage (thay toàn bộ dữ liệu hiện tại), record được stream
+        theo batch thay vì dựng dict toàn bộ dữ liệu rồi save_data
+        """
+        if not self.mongo_enabled:
+            logger.error("❌ MongoDB not available")
+            return False
+        
+        try:
+            # Record được đọc từ Mongo trong lúc load_stream → giữ use() đến hết
+            with self._mongo.use() as db:
+                if self.mongo_layout == 'normalized':
+                    mirror = self._mongo_mirror_for(db)
+                    if not mirror.has_backup():
+                        logger.warning("⚠️  No backup found in MongoDB")
+                        return False
+                    items = mirror.iter_records()
+                else:
+                    data = db['goals_data'].find_one({'_id': 'current_data'})
+                    if not data:
+                        logger.warning("⚠️  No backup found in MongoDB")
+                        return False
+                    for key in ('_id', '_backup_timestamp', '_backup_source'):
+                        data.pop(key, None)
+                    items = iter_dict(data)
+                self.load_stream(items)
+            logger.info("✅ Restored from MongoDB into storage")
+            return True
+        except MongoUnavailable as e:
+            logger.warning(f"⚠️  MongoDB not available: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"❌ Error restoring from MongoDB: {e}")
+            return False
+    
+    def snapshot_items(self):
+        """Bản chụp nhất quán (key, giá trị) của toàn bộ dữ liệu, bảng là iterable record (xem Dataset.snapshot_items)"""
+        with self._lock:
+            return self._dataset(everything=True).snapshot_items()
+    
+    def export_chunks(self, indent=None):
+        """
+        Luồng text JSON của toàn bộ dữ liệu (mọi backend), chụp dữ liệu một lần dưới lock
+        rồi encode từng record ngoài lock: bản export nhất quán dù có ghi trong lúc tải
+        indent=None: JSON gọn, không khoảng trắng
+        """
+        return encode_chunks(self.snapshot_items(), indent)
+    
     def export_json(self, output_path=None):
         """Export dữ liệu ra file JSON"""
         if output_path is None:
@@ -154,19 +1385,11 @@ class StorageManager:
             raise
     
     def import_json(self, import_path):
-        """Import dữ liệu từ file JSON"""
+        """Import dữ liệu từ file JSON (file export hoặc file dữ liệu), đọc từng record"""
         try:
-            with open(import_path, 'r', encoding='utf-8') as f:
-                import_data = json.load(f)
-            
-            # Kiểm tra format
-            if 'data' in import_data:
-                data = import_data['data']
-            else:
-                data = import_data
-            
-            # Lưu vào hệ thống
-            self.save_data(data)
+            with open_text(import_path) as f:
+                # iter_data tự mở lớp 'data' của file export
+                self.load_stream(iter_data(f))
             logger.info(f"📥 Imported from {import_path}")
             return True
         except Exception as e:
@@ -176,8 +1399,11 @@ class StorageManager:
     def get_backup_info(self):
         """Lấy thông tin backup"""
         info = {
+            'backend': 'sqlite' if self.sqlite else 'json',
+            'multiprocess': self._file_lock is not None,
             'json_exists': os.path.exists(self.json_file),
             'json_size': 0,
+            'data_version': self.data_version,
             'mongodb_enabled': self.mongo_enabled,
             'mongodb_last_backup': None
         }
@@ -186,14 +1412,35 @@ class StorageManager:
         if info['json_exists']:
             info['json_size'] = os.path.getsize(self.json_file)
         
-        # MongoDB info
+        # SQLite info
+        if self.sqlite:
+            info.update(self.sqlite.get_info())
+        
+        info['concurrency'] = self.concurrency_stats()
+        
+        # Bộ đếm phiên bản dùng chung giữa các worker
+        if self._shared_version:
+            info['shared_version'] = self._shared_version.value()
+        
+        # Partition info
+        if self.partitions:
+            with self._lock:
+                info.update(self.partitions.info())
+        
+        # Journal info
+        if self.journal:
+            info['journal_entries'] = self._journal_entries
+            info['journal_size'] = (
+                os.path.getsize(self.journal_file) if os.path.exists(self.journal_file) else 0
+            )
+        
+        # MongoDB info: lấy từ worker đồng bộ trong bộ nhớ, không hỏi Mongo (request không chờ mạng)
         if self.mongo_enabled:
-            try:
-                backup = self.collection.find_one({'_id': 'current_data'})
-                if backup:
-                    info['mongodb_last_backup'] = backup.get('_backup_timestamp')
-            except:
-                pass
+            sync = self._mongo_sync.stats()
+            info['mongodb_sync'] = sync
+            info['mongodb_circuit'] = self._mongo.stats()
+            info['mongodb_last_backup'] = sync['last_success']
+            info['mongodb_status'] = 'unavailable' if not self._mongo.available() else sync['status']
         
         return info
     
@@ -219,9 +1466,26 @@ class StorageManager:
 # Singleton instance
 _storage_instance = None
 
-def get_storage(mongo_uri=None):
-    """Lấy storage instance (singleton)"""
+def get_storage(mongo_uri=None, journal=False, compact_every=1000, group_commit_ms=0,
+                sqlite_path=None, mongo_layout='document', compact_memory=False, partition=None,
+                mongo_db='goal_tracker_2026', multiprocess=False, occ_max_retries=OCC_MAX_RETRIES,
+                mongo_options=None, mongo_breaker=None):
+    """Lấy storage instance (singleton, mỗi worker process một instance)"""
     global _storage_instance
     if _storage_instance is None:
-        _storage_instance = StorageManager(mongo_uri=mongo_uri)
+        _storage_instance = StorageManager(
+            mongo_uri=mongo_uri,
+            mongo_layout=mongo_layout,
+            sqlite_path=sqlite_path,
+            journal=journal,
+            compact_every=compact_every,
+            group_commit_ms=group_commit_ms,
+            compact_memory=compact_memory,
+            partition=partition,
+            mongo_db=mongo_db,
+            multiprocess=multiprocess,
+            occ_max_retries=occ_max_retries,
+            mongo_options=mongo_options,
+            mongo_breaker=mongo_breaker
+        )
     return _storage_instance
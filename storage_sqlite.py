@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+storage_sqlite.py - SQLite backend cho StorageManager
+- goals, sub_tasks, progress_logs là các bảng riêng
+- Index trên sub_tasks(goal_id) và sub_tasks(created_at) cho truy vấn theo tuần/tháng
+- created_day (ordinal ngày) / created_secs (giây trong ngày) parse sẵn, so sánh bằng số nguyên
+- Migrate một lần từ file JSON cũ
+
+Chạy migrate thủ công:
+    python storage_sqlite.py migrate data/goals_data.json data/goals.db
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import logging
+from dataset import parse_day, parse_time
+from json_stream import batched, iter_data
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Các cột cố định của từng bảng, field lạ được giữ trong cột `extra` (JSON)
+# Cột mà record gốc không có được ghi tên vào extra[ABSENT_KEY] để đọc ra record y như JSON
+ABSENT_KEY = '__absent__'
+GOAL_COLUMNS = ('id', 'title', 'description', 'target_date', 'created_at', 'status', 'progress')
+SUBTASK_COLUMNS = ('id', 'goal_id', 'goal_title', 'title', 'note', 'created_at', 'created_time')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS goals (
+    id          INTEGER PRIMARY KEY,
+    title       TEXT,
+    description TEXT,
+    target_date TEXT,
+    created_at  TEXT,
+    status      TEXT,
+    progress    INTEGER,
+    extra       TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sub_tasks (
+    id           INTEGER PRIMARY KEY,
+    goal_id      INTEGER NOT NULL,
+    goal_title   TEXT,
+    title        TEXT,
+    note         TEXT,
+    created_at   TEXT,
+    created_time TEXT,
+    extra        TEXT,
+    created_day  INTEGER,
+    created_secs INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_sub_tasks_goal_id ON sub_tasks(goal_id);
+CREATE INDEX IF NOT EXISTS idx_sub_tasks_created_at ON sub_tasks(created_at);
+
+CREATE TABLE IF NOT EXISTS progress_logs (
+    seq    INTEGER PRIMARY KEY AUTOINCREMENT,
+    record TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteStore:
+    """Lưu trữ dữ liệu trong SQLite, mỗi thread dùng một connection riêng"""
+
+    def __init__(self, db_path='data/goals.db'):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+        self._upgrade_schema(conn)
+        logger.info(f"🗄️  SQLite storage: {db_path}")
+
+    def _upgrade_schema(self, conn):
+        """Database tạo trước khi có cột created_day/created_secs → thêm cột và điền giá trị"""
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(sub_tasks)')}
+        if 'created_day' not in columns:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('ALTER TABLE sub_tasks ADD COLUMN created_day INTEGER')
+                conn.execute('ALTER TABLE sub_tasks ADD COLUMN created_secs INTEGER')
+                rows = conn.execute('SELECT id, created_at, created_time FROM sub_tasks').fetchall()
+                conn.executemany(
+                    'UPDATE sub_tasks SET created_day = ?, created_secs = ? WHERE id = ?',
+                    ((parse_day(r['created_at']), parse_time(r['created_time']), r['id']) for r in rows)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            logger.info("🗄️  Added created_day/created_secs columns to sub_tasks")
+        # Record cũ có thể thiếu title / created_at → bỏ NOT NULL của database tạo trước đây
+        for table, column in (('goals', 'title'), ('sub_tasks', 'created_at')):
+            self._drop_not_null(conn, table, column)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sub_tasks_created_day ON sub_tasks(created_day)')
+
+    def _drop_not_null(self, conn, table, column):
+        """Tạo lại bảng (cùng cột, cùng dữ liệu) không có ràng buộc NOT NULL trên column"""
+        info = {row['name']: row['notnull'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if not info.get(column):
+            return
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()['sql']
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+            conn.execute(re.sub(rf'\b({column}\s+TEXT)\s+NOT NULL', r'\1', sql))
+            conn.execute(f'INSERT INTO {table} SELECT * FROM {table}_old')
+            conn.execute(f'DROP TABLE {table}_old')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        # Index đi theo bảng cũ đã bị xóa → tạo lại
+        conn.executescript(SCHEMA)
+        logger.info(f"🗄️  Dropped NOT NULL on {table}.{column}")
+
+    def _conn(self):
+        """Connection của thread hiện tại (autocommit, transaction mở bằng BEGIN)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---------- Đọc ----------
+
+    def version(self):
+        """Số phiên bản dữ liệu, tăng sau mỗi lần ghi"""
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row['value'])
+
+    def is_empty(self):
+        conn = self._conn()
+        return not (
+            conn.execute('SELECT 1 FROM goals LIMIT 1').fetchone()
+            or conn.execute('SELECT 1 FROM sub_tasks LIMIT 1').fetchone()
+        )
+
+    def load_all(self):
+        """Đọc toàn bộ dữ liệu về dạng dict như file JSON"""
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            data = {
+                'goals': [_row_to_dict(r, GOAL_COLUMNS) for r in conn.execute('SELECT * FROM goals ORDER BY id')],
+                'sub_tasks': [_row_to_dict(r, SUBTASK_COLUMNS) for r in conn.execute('SELECT * FROM sub_tasks ORDER BY id')],
+                'progress_logs': [json.loads(r['record']) for r in conn.execute('SELECT record FROM progress_logs ORDER BY seq')],
+            }
+            data['sequences'] = self._sequences(conn)
+            version = int(conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()['value'])
+        finally:
+            conn.execute('COMMIT')
+        logger.info(f"📖 Loaded data from {self.db_path}")
+        return data, version
+
+    def _sequences(self, conn):
+        return {
+            table: int(row['value']) if row else 0
+            for table, row in (
+                (table, conn.execute('SELECT value FROM meta WHERE key = ?', (f'seq_{table}',)).fetchone())
+                for table in ('goals', 'sub_tasks')
+            )
+        }
+
+    def subtasks_between(self, start, end=None):
+        """Hoạt động có ngày trong [start, end] (date), so sánh ordinal nguyên trên index created_day"""
+        where, params = _day_range(start, end)
+        rows = self._conn().execute(f'SELECT * FROM sub_tasks WHERE {where} ORDER BY id', params)
+        return [_row_to_dict(r, SUBTASK_COLUMNS) for r in rows]
+
+    def count_subtasks_between(self, start, end=None):
+        where, params = _day_range(start, end)
+        return self._conn().execute(f'SELECT COUNT(*) AS n FROM sub_tasks WHERE {where}', params).fetchone()['n']
+
+    # ---------- Ghi ----------
+
+    def replace_all(self, data, expected_version=None):
+        """
+        Thay toàn bộ dữ liệu trong một transaction, trả về version mới
+        expected_version: chỉ ghi nếu version hiện tại đúng bằng giá trị này, ngược lại trả về None
+        """
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if expected_version is not None and self.version() != expected_version:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute('DELETE FROM goals')
+            conn.execute('DELETE FROM sub_tasks')
+            conn.execute('DELETE FROM progress_logs')
+            self._insert_many(conn, 'goals', GOAL_COLUMNS, data.get('goals', []))
+            self._insert_many(conn, 'sub_tasks', SUBTASK_COLUMNS, data.get('sub_tasks', []))
+            conn.executemany(
+                'INSERT INTO progress_logs (record) VALUES (?)',
+                ((json.dumps(r, ensure_ascii=False),) for r in data.get('progress_logs', []))
+            )
+            for table, value in (data.get('sequences') or {}).items():
+                self._raise_sequence(conn, table, value)
+            version = self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info(f"💾 Saved to SQLite: {self.db_path}")
+        return version
+
+    def replace_stream(self, items, batch_size=1000):
+        """
+        Thay toàn bộ dữ liệu bằng luồng (bảng, record) của json_stream.iter_data,
+        ghi từng batch batch_size record trong một transaction, trả về version mới
+        """
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM goals')
+            conn.execute('DELETE FROM sub_tasks')
+            conn.execute('DELETE FROM progress_logs')
+            rest = {}
+            for batch in batched(items, batch_size):
+                by_table = {}
+                for table, record in batch:
+                    if table is None:
+                        rest = record
+                    else:
+                        by_table.setdefault(table, []).append(record)
+                # Record trùng id: bản sau thay bản trước như khi nạp vào Dataset
+                self._insert_many(conn, 'goals', GOAL_COLUMNS, by_table.get('goals', []), replace=True)
+                self._insert_many(conn, 'sub_tasks', SUBTASK_COLUMNS, by_table.get('sub_tasks', []), replace=True)
+                conn.executemany(
+                    'INSERT INTO progress_logs (record) VALUES (?)',
+                    ((json.dumps(r, ensure_ascii=False),) for r in by_table.get('progress_logs', []))
+                )
+            for table, value in (rest.get('sequences') or {}).items():
+                self._raise_sequence(conn, table, value)
+            version = self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info(f"💾 Saved to SQLite: {self.db_path}")
+        return version
+
+    def apply(self, op, payload):
+        """Áp dụng một thao tác (xem storage.JOURNAL_OPS) bằng một câu lệnh SQL, trả về version mới"""
+        return self.apply_many([(op, payload)])
+
+    def apply_many(self, changes):
+        """Áp dụng nhiều thao tác [(op, payload)] trong một transaction (tất cả hoặc không gì), trả về version mới"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for op, payload in changes:
+                if op in ('add_goal', 'update_goal'):
+                    self._insert_many(conn, 'goals', GOAL_COLUMNS, [payload], replace=True)
+                    self._raise_sequence(conn, 'goals', payload['id'])
+                elif op == 'delete_goal':
+                    conn.execute('DELETE FROM goals WHERE id = ?', (payload['id'],))
+                    conn.execute('DELETE FROM sub_tasks WHERE goal_id = ?', (payload['id'],))
+                elif op == 'add_subtask':
+                    self._insert_many(conn, 'sub_tasks', SUBTASK_COLUMNS, [payload], replace=True)
+                    self._raise_sequence(conn, 'sub_tasks', payload['id'])
+                elif op == 'delete_subtask':
+                    conn.execute('DELETE FROM sub_tasks WHERE id = ?', (payload['id'],))
+                else:
+                    raise ValueError(f"Unknown storage operation: {op}")
+            version = self._bump_version(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return version
+
+    def next_id(self, table):
+        """Cấp id mới (atomic giữa các connection/process), không dùng lại id đã xóa"""
+        return self.reserve_ids(table, 1)
+
+    def reserve_ids(self, table, count):
+        """Cấp count id liên tiếp trong một transaction, trả về id đầu tiên"""
+        if table not in ('goals', 'sub_tasks'):
+            raise ValueError(f"Unknown table: {table}")
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = self._sequences(conn)[table]
+            max_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) AS m FROM {table}').fetchone()['m']
+            first_id = max(current, max_id) + 1
+            self._raise_sequence(conn, table, first_id + count - 1)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return first_id
+
+    def _raise_sequence(self, conn, table, value):
+        """Đặt sequence = max(sequence hiện tại, value)"""
+        conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+            (f'seq_{table}', str(value))
+        )
+
+    def _insert_many(self, conn, table, columns, records, replace=False):
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT'
+        names = list(columns) + ['extra']
+        rows = (_dict_to_row(r, columns) for r in records)
+        if table == 'sub_tasks':
+            # Cột ngày/giờ dạng số được tính một lần khi ghi
+            names += ['created_day', 'created_secs']
+            rows = (
+                _dict_to_row(r, columns) + (parse_day(r.get('created_at')), parse_time(r.get('created_time')))
+                for r in records
+            )
+        sql = f"{verb} INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})"
+        conn.executemany(sql, rows)
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+        return int(conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()['value'])
+
+    # ---------- Migrate ----------
+
+    def migrate_from_json(self, json_file):
+        """Import một lần từ file JSON cũ (chỉ khi database còn trống)"""
+        if not os.path.exists(json_file):
+            return False
+        if not self.is_empty():
+            logger.info("🗄️  SQLite already has data, skipping JSON migration")
+            return False
+
+        with open(json_file, 'r', encoding='utf-8') as f:
+            # Đọc từng record, file export ({'data': {...}}) được mở lớp tự động
+            self.replace_stream(iter_data(f))
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)", (json_file,)
+        )
+        goals = conn.execute('SELECT COUNT(*) AS n FROM goals').fetchone()['n']
+        sub_tasks = conn.execute('SELECT COUNT(*) AS n FROM sub_tasks').fetchone()['n']
+        logger.info(f"📥 Migrated {goals} goals, {sub_tasks} sub tasks from {json_file}")
+        return True
+
+    def get_info(self):
+        return {
+            'sqlite_path': self.db_path,
+            'sqlite_size': os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0,
+        }
+
+
+def _day_range(start, end):
+    """Điều kiện WHERE theo created_day cho [start, end] (end=None: không giới hạn trên)"""
+    if end is None:
+        return 'created_day >= ?', (start.toordinal(),)
+    return 'created_day BETWEEN ? AND ?', (start.toordinal(), end.toordinal())
+
+
+def _row_to_dict(row, columns):
+    """sqlite3.Row → dict giống record trong JSON (cột mà record gốc không có thì không có key)"""
+    record = {col: row[col] for col in columns}
+    if row['extra']:
+        extra = json.loads(row['extra'])
+        for col in extra.pop(ABSENT_KEY, ()):
+            record.pop(col, None)
+        record.update(extra)
+    return record
+
+
+def _dict_to_row(record, columns):
+    extra = {k: v for k, v in record.items() if k not in columns}
+    absent = [col for col in columns if col not in record]
+    if absent:
+        extra[ABSENT_KEY] = absent
+    return tuple(record.get(col) for col in columns) + (
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python storage_sqlite.py migrate [json_file] [db_path]")
+        sys.exit(1)
+
+    source = sys.argv[2] if len(sys.argv) > 2 else 'data/goals_data.json'
+    target = sys.argv[3] if len(sys.argv) > 3 else 'data/goals.db'
+    if not SqliteStore(target).migrate_from_json(source):
+        sys.exit(1)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+telegram_outbox.py - Hàng đợi gửi Telegram bền vững + thread gửi nền
+- Request chỉ ghi job vào outbox (SQLite, data/telegram_outbox.db) rồi trả job id ngay,
+  không chờ api.telegram.org; trạng thái job đọc lại bằng Outbox.get (xem /api/telegram/jobs/<id>)
+- Thread nền lấy job đến hạn, gửi qua requests.Session (keep-alive, pool kết nối, timeout),
+  giới hạn tốc độ bằng token bucket, lỗi tạm thời (mạng, 429, 5xx) thì thử lại với backoff
+- Nhiều worker dùng chung outbox: job được "nhận" trong transaction (BEGIN IMMEDIATE) kèm lease,
+  worker chết giữa chừng thì job được gửi lại khi hết lease (giao ít nhất một lần)
+- API base cấu hình được (TELEGRAM_API_BASE) → chạy thử với server Telegram giả trên máy
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = 'https://api.telegram.org'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_at     REAL NOT NULL,
+    lease_until REAL,
+    last_error  TEXT,
+    result      TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, next_at);
+"""
+
+QUEUED, SENDING, SENT, FAILED = 'queued', 'sending', 'sent', 'failed'
+
+
+class TelegramError(Exception):
+    """Gửi thất bại; retryable=False → không thử lại (vd. 400 sai chat_id), retry_after (giây) từ 429"""
+
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TelegramClient:
+    """Gọi Bot API qua một requests.Session dùng lại kết nối (keep-alive), luôn có timeout"""
+
+    def __init__(self, token, api_base=DEFAULT_API_BASE, connect_timeout=5.0, read_timeout=30.0,
+                 pool_size=4, session=None):
+        self.token = token
+        self.api_base = api_base.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = session or requests.Session()
+        if session is None:
+            # Không để urllib3 tự thử lại: backoff do sender quyết định
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+    def call(self, method, **kwargs):
+        """POST {api_base}/bot<token>/<method>, trả về 'result'; lỗi → TelegramError"""
+        url = f"{self.api_base}/bot{self.token}/{method}"
+        try:
+            response = self.session.post(url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as e:
+            raise TelegramError(f"Lỗi kết nối: {e}") from e
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code == 200 and body.get('ok', True):
+            return body.get('result')
+        retry_after = (body.get('parameters') or {}).get('retry_after')
+        retryable = response.status_code == 429 or response.status_code >= 500
+        raise TelegramError(f"Lỗi: {response.text}", retryable, retry_after)
+
+    def send_message(self, chat_id, text, thread_id=None, parse_mode='Markdown'):
+        payload = {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode}
+        if thread_id:
+            payload['message_thread_id'] = thread_id
+        return self.call('sendMessage', json=payload)
+
+    def send_document(self, chat_id, file_path, caption='', thread_id=None):
+        data = {'chat_id': chat_id, 'caption': caption}
+        if thread_id:
+            data['message_thread_id'] = thread_id
+        with open(file_path, 'rb') as f:
+            return self.call('sendDocument', files={'document': f}, data=data)
+
+    def close(self):
+        self.session.close()
+
+
+class TokenBucket:
+    """Giới hạn tốc độ: rate token mỗi giây, tích tối đa capacity (cho phép gửi dồn một ít)"""
+
+    def __init__(self, rate=1.0, capacity=3, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Lấy một token: trả về 0 nếu lấy được, ngược lại số giây cần chờ (chưa lấy)"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def refund(self):
+        """Trả lại token vừa lấy mà không dùng"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class Outbox:
+    """Hàng đợi job trong SQLite, dùng chung giữa các worker process, mỗi thread một connection"""
+
+    def __init__(self, db_path='data/telegram_outbox.db', lease=300.0, clock=time.time):
+        self.db_path = db_path
+        self.lease = lease
+        self._clock = clock
+        self._local = threading.local()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        """Connection của thread hiện tại (autocommit, transaction mở bằng BEGIN)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind, payload):
+        """Thêm job, trả về job id"""
+        job_id = uuid.uuid4().hex
+        now = self._clock()
+        self._conn().execute(
+            'INSERT INTO jobs (id, kind, payload, status, next_at, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, now, now, now)
+        )
+        return job_id
+
+    def claim(self):
+        """
+        Nhận job đến hạn (hoặc job 'sending' đã hết lease) trong một transaction:
+        chuyển sang 'sending', tăng attempts. Trả về dict job hoặc None
+        """
+        conn = self._conn()
+        now = self._clock()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM jobs WHERE (status = ? AND next_at <= ?) OR (status = ? AND lease_until <= ?) '
+                'ORDER BY next_at LIMIT 1',
+                (QUEUED, now, SENDING, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?',
+                    (SENDING, now + self.lease, now, row['id'])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        job = _row_to_job(row)
+        job['status'] = SENDING
+        job['attempts'] += 1
+        return job
+
+    def complete(self, job_id, result):
+        self._finish(job_id, SENT, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def retry(self, job_id, error, delay):
+        """Đưa job về hàng đợi, gửi lại sau delay giây"""
+        now = self._clock()
+        self._conn().execute(
+            'UPDATE jobs SET status = ?, next_at = ?, lease_until = NULL, last_error = ?, updated_at = ? WHERE id = ?',
+            (QUEUED, now + delay, error, now, job_id)
+        )
+
+    def _finish(self, job_id, status, result=None, error=None):
+        """Job gửi xong → xóa lỗi của lần thử trước; job lỗi hẳn → giữ lỗi cuối nếu không có lỗi mới"""
+        self._conn().execute(
+            'UPDATE jobs SET status = ?, lease_until = NULL, result = ?, '
+            'last_error = CASE WHEN ? = ? THEN NULL ELSE COALESCE(?, last_error) END, '
+            'updated_at = ? WHERE id = ?',
+            (status, result, status, SENT, error, self._clock(), job_id)
+        )
+
+    def get(self, job_id):
+        """Trạng thái job (không kèm payload) hoặc None"""
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = _row_to_job(row)
+        del job['payload']
+        return job
+
+    def next_due(self):
+        """Thời điểm job đang chờ sớm nhất đến hạn (None nếu hàng đợi trống)"""
+        row = self._conn().execute(
+            'SELECT MIN(CASE WHEN status = ? THEN next_at ELSE lease_until END) AS due '
+            'FROM jobs WHERE status IN (?, ?)',
+            (QUEUED, QUEUED, SENDING)
+        ).fetchone()
+        return row['due']
+
+    def prune(self, older_than):
+        """Xóa job đã xong (sent / failed) cập nhật lần cuối trước older_than giây, trả về số job đã xóa"""
+        cursor = self._conn().execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+            (SENT, FAILED, self._clock() - older_than)
+        )
+        return cursor.rowcount
+
+    def counts(self):
+        rows = self._conn().execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status')
+        return {row['status']: row['n'] for row in rows}
+
+
+class OutboxSender:
+    """
+    Thread nền gửi job trong outbox: handlers = {kind: fn(payload) → message}
+    fn raise TelegramError → thử lại theo backoff (retryable) hoặc đánh dấu failed
+    """
+
+    def __init__(self, outbox, handlers, bucket=None, max_attempts=5, base_delay=2.0, max_delay=300.0,
+                 poll_interval=5.0, retention=7 * 86400, start=True):
+        self.outbox = outbox
+        self.handlers = handlers
+        self.bucket = bucket or TokenBucket()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.retention = retention
+
+        self._stop = threading.Event()
+        # Đánh thức thread khi có job mới trong process này (job của worker khác: chờ poll_interval)
+        self._wake = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name='telegram-outbox', daemon=True)
+        if start:
+            self._thread.start()
+
+    def submit(self, kind, payload):
+        """Ghi job vào outbox và đánh thức thread gửi, trả về job id"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown outbox job kind: {kind}")
+        job_id = self.outbox.enqueue(kind, payload)
+        self._wake.set()
+        return job_id
+
+    def _run(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            if time.time() - last_prune > 3600:
+                last_prune = time.time()
+                self._safely(self.outbox.prune, self.retention)
+            # clear trước run_once: submit() chen vào lúc đang gửi vẫn đánh thức vòng sau
+            self._wake.clear()
+            if not self._safely(self.run_once):
+                self._wake.wait(self._idle_timeout())
+
+    def _safely(self, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            # Lỗi outbox (vd. database bị khóa quá lâu) không được làm chết thread
+            logger.error(f"❌ Telegram outbox error: {e}")
+            return None
+
+    def _idle_timeout(self):
+        due = self.outbox.next_due()
+        if due is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, due - time.time()))
+
+    def run_once(self):
+        """Gửi một job đến hạn (nếu có), trả về True nếu đã xử lý một job"""
+        wait = self.bucket.take()
+        while wait:
+            if self._stop.wait(wait):
+                return False
+            wait = self.bucket.take()
+        job = self.outbox.claim()
+        if job is None:
+            self.bucket.refund()
+            return False
+        self._send(job)
+        return True
+
+    def _send(self, job):
+        try:
+            result = self.handlers[job['kind']](job['payload'])
+        except TelegramError as e:
+            self._failed(job, str(e), e.retryable, e.retry_after)
+        except Exception as e:
+            logger.error(f"❌ Telegram job {job['id']} ({job['kind']}) crashed: {e}")
+            self._failed(job, str(e), False, None)
+        else:
+            self.outbox.complete(job['id'], result)
+            with self._stats_lock:
+                self.sent += 1
+            logger.info(f"📨 Telegram job {job['id']} ({job['kind']}) sent")
+
+    def _failed(self, job, error, retryable, retry_after):
+        with self._stats_lock:
+            self.last_error = error
+        if retryable and job['attempts'] < self.max_attempts:
+            delay = self._backoff(job['attempts'], retry_after)
+            self.outbox.retry(job['id'], error, delay)
+            with self._stats_lock:
+                self.retries += 1
+            logger.warning(f"⚠️  Telegram job {job['id']} failed (attempt {job['attempts']}), retry in {delay:.1f}s: {error}")
+            return
+        self.outbox.fail(job['id'], error)
+        with self._stats_lock:
+            self.failed += 1
+        logger.error(f"❌ Telegram job {job['id']} ({job['kind']}) failed: {error}")
+
+    def _backoff(self, attempts, retry_after=None):
+        """retry_after của Telegram (429) nếu có, ngược lại lũy thừa 2 có jitter, tối đa max_delay"""
+        if retry_after:
+            return float(retry_after)
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries,
+                'last_error': self.last_error,
+            }
+        stats['jobs'] = self._safely(self.outbox.counts)
+        return stats
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    return job